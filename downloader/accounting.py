@@ -0,0 +1,132 @@
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import VideoDownload
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadCounter:
+    """Buffers download accounting in memory and writes it in batches.
+
+    Request threads only touch a dict under a lock. A daemon thread flushes
+    the buffer every ``interval`` seconds (sooner once ``max_pending`` keys
+    are waiting) in a single transaction: a ``bulk_create`` upsert on
+    ``(video_id, quality)`` and an ``F()`` update per key with deliveries to
+    count, so the SQLite write lock is taken once per flush instead of once
+    per request. The upsert leaves no window for two processes to insert
+    the same key.
+    """
+
+    def __init__(self, interval=None, max_pending=None):
+        self.interval = interval or settings.DOWNLOAD_STATS_FLUSH_INTERVAL
+        self.max_pending = max_pending or settings.DOWNLOAD_STATS_MAX_PENDING
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def record(self, url, video_id, quality, file_path='', digest=None, served=0):
+        """Note a stored download; ``served`` counts deliveries to clients"""
+        if not video_id:
+            return
+        with self._lock:
+            entry = self._pending.get((video_id, quality))
+            if entry is None:
+                entry = self._pending[(video_id, quality)] = {
+                    'url': url, 'file_path': file_path, 'digest': '', 'served': 0,
+                }
+            entry['served'] += served
+            entry['last'] = timezone.now()
+            if url and not entry['url']:
+                entry['url'] = url
+            if digest:
+                entry['digest'] = digest
+                entry['file_path'] = file_path
+            full = len(self._pending) >= self.max_pending
+        self._ensure_thread()
+        if full:
+            self._wakeup.set()
+
+    def flush(self):
+        """Write everything buffered so far and return the number of keys"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        try:
+            with transaction.atomic():
+                # Keys with a new blob also replace the stored file; the
+                # rest keep theirs and only get touched
+                stored, touched = [], []
+                for (video_id, quality), entry in pending.items():
+                    row = VideoDownload(
+                        url=entry['url'],
+                        video_id=video_id,
+                        quality=quality,
+                        content_hash=entry['digest'],
+                        file_path=entry['file_path'],
+                        last_downloaded=entry['last'],
+                    )
+                    (stored if entry['digest'] else touched).append(row)
+                for rows, update_fields in (
+                    (stored, ['last_downloaded', 'content_hash', 'file_path']),
+                    (touched, ['last_downloaded']),
+                ):
+                    VideoDownload.objects.bulk_create(
+                        rows,
+                        update_conflicts=True,
+                        unique_fields=['video_id', 'quality'],
+                        update_fields=update_fields,
+                    )
+                # An upsert can only overwrite, so counts are added separately
+                for (video_id, quality), entry in pending.items():
+                    if entry['served']:
+                        VideoDownload.objects.filter(video_id=video_id, quality=quality).update(
+                            download_count=F('download_count') + entry['served']
+                        )
+        except Exception as e:
+            logger.error(f"Error flushing download stats: {str(e)}")
+            self._restore(pending)
+            return 0
+        return len(pending)
+
+    def _restore(self, pending):
+        # Put a failed batch back so the counts are retried next flush
+        with self._lock:
+            for key, entry in pending.items():
+                current = self._pending.get(key)
+                if current is None:
+                    self._pending[key] = entry
+                    continue
+                current['served'] += entry['served']
+                current['url'] = current['url'] or entry['url']
+                if not current['digest']:
+                    current['digest'] = entry['digest']
+                    current['file_path'] = entry['file_path']
+
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='download-stats', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+            close_old_connections()
+
+
+download_stats = DownloadCounter()
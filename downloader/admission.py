@@ -0,0 +1,243 @@
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+from django.conf import settings
+
+from . import metrics
+
+
+class Overloaded(Exception):
+    """No download slot is available; answer ``status`` with ``Retry-After``"""
+
+    def __init__(self, message, status, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """A held download slot; release it exactly once when the transfer ends"""
+
+    def __init__(self, controller, host, client):
+        self.controller = controller
+        self.host = host
+        self.client = client
+        self.started = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class _Waiter:
+    def __init__(self, host, client, loop=None):
+        self.host = host
+        self.client = client
+        self.granted = False
+        self.loop = loop
+        if loop is None:
+            self.event = threading.Event()
+        else:
+            self.future = loop.create_future()
+
+    def grant(self):
+        self.granted = True
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(True)
+
+
+class AdmissionController:
+    """Bounds concurrent upstream transfers per process.
+
+    A transfer needs a free global slot and a free slot for its upstream
+    host. Callers that find none wait in a FIFO queue of at most
+    ``max_queue`` entries for up to ``timeout`` seconds; freed slots are
+    handed to the first waiter they fit, so a saturated host does not hold
+    up transfers to other hosts. A full queue or an expired wait raises
+    ``Overloaded`` with status 503, and a client that already has
+    ``max_per_client`` transfers running or queued gets 429, so excess load
+    is turned away at once instead of slowing every request down.
+    """
+
+    def __init__(self, max_active=None, max_per_host=None, max_per_client=None,
+                 max_queue=None, timeout=None):
+        self.max_active = max_active or settings.ADMISSION_MAX_ACTIVE
+        self.max_per_host = max_per_host or settings.ADMISSION_MAX_PER_HOST
+        self.max_per_client = max_per_client or settings.ADMISSION_MAX_PER_CLIENT
+        self.max_queue = max_queue if max_queue is not None else settings.ADMISSION_MAX_QUEUE
+        self.timeout = timeout if timeout is not None else settings.ADMISSION_QUEUE_TIMEOUT
+        self._lock = threading.Lock()
+        self._active = 0
+        self._hosts = {}
+        self._clients = {}
+        self._waiters = deque()
+        # Moving average of how long a transfer holds its slot
+        self._hold = 1.0
+
+    def acquire(self, url, client=None):
+        """Block until a slot for ``url`` is free and return its Ticket"""
+        host = urlsplit(url).hostname or ''
+        start = time.monotonic()
+        waiter = self._enter(host, client, None)
+        if waiter is None:
+            return self._admitted(host, client, start)
+        waiter.event.wait(self.timeout)
+        return self._finish_wait(waiter, start)
+
+    async def aacquire(self, url, client=None):
+        """Async twin of ``acquire`` that waits without blocking the loop"""
+        host = urlsplit(url).hostname or ''
+        start = time.monotonic()
+        waiter = self._enter(host, client, asyncio.get_running_loop())
+        if waiter is None:
+            return self._admitted(host, client, start)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            if not self._abandon(waiter):
+                Ticket(self, waiter.host, waiter.client).release()
+            raise
+        return self._finish_wait(waiter, start)
+
+    def check(self, client=None):
+        """Raise ``Overloaded`` now if a new transfer could not even queue"""
+        with self._lock:
+            self._check_client(client)
+            if self._active >= self.max_active:
+                self._check_queue()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'active': self._active,
+                'queued': len(self._waiters),
+                'hosts': dict(self._hosts),
+            }
+
+    def _enter(self, host, client, loop):
+        with self._lock:
+            self._check_client(client)
+            if not self._waiters and self._fits(host):
+                self._take(host)
+                self._add_client(client)
+                return None
+            self._check_queue()
+            self._add_client(client)
+            waiter = _Waiter(host, client, loop)
+            self._waiters.append(waiter)
+            # Waiters ahead may all be for full hosts; one that fits goes at once
+            self._dispatch()
+            return waiter
+
+    def _check_client(self, client):
+        if client and self._clients.get(client, 0) >= self.max_per_client:
+            metrics.admission_rejected.inc(reason='client')
+            raise Overloaded('Too many downloads in progress', 429, self._retry_after())
+
+    def _check_queue(self):
+        if len(self._waiters) >= self.max_queue:
+            metrics.admission_rejected.inc(reason='queue_full')
+            raise Overloaded('Server busy, please retry shortly', 503, self._retry_after())
+
+    def _finish_wait(self, waiter, start):
+        if not self._abandon(waiter):
+            return self._admitted(waiter.host, waiter.client, start)
+        metrics.admission_rejected.inc(reason='timeout')
+        raise Overloaded('Server busy, please retry shortly', 503, self._retry_after())
+
+    def _abandon(self, waiter):
+        """Leave the queue; ``False`` when a slot was granted meanwhile"""
+        with self._lock:
+            if waiter.granted:
+                return False
+            self._waiters.remove(waiter)
+            self._drop_client(waiter.client)
+            # Leaving may unblock waiters queued behind this one
+            self._dispatch()
+            return True
+
+    def _admitted(self, host, client, start):
+        metrics.admission_wait_seconds.observe(time.monotonic() - start)
+        return Ticket(self, host, client)
+
+    def _release(self, ticket):
+        held = time.monotonic() - ticket.started
+        with self._lock:
+            self._hold = 0.8 * self._hold + 0.2 * held
+            self._active -= 1
+            remaining = self._hosts[ticket.host] - 1
+            if remaining:
+                self._hosts[ticket.host] = remaining
+            else:
+                del self._hosts[ticket.host]
+            self._drop_client(ticket.client)
+            self._dispatch()
+
+    def _dispatch(self):
+        # Hand freed slots straight to waiters, skipping those whose host is full
+        for waiter in list(self._waiters):
+            if self._active >= self.max_active:
+                break
+            if self._fits(waiter.host):
+                self._waiters.remove(waiter)
+                self._take(waiter.host)
+                waiter.grant()
+
+    def _fits(self, host):
+        return self._active < self.max_active and self._hosts.get(host, 0) < self.max_per_host
+
+    def _take(self, host):
+        self._active += 1
+        self._hosts[host] = self._hosts.get(host, 0) + 1
+
+    def _add_client(self, client):
+        if client:
+            self._clients[client] = self._clients.get(client, 0) + 1
+
+    def _drop_client(self, client):
+        if not client:
+            return
+        remaining = self._clients.get(client, 0) - 1
+        if remaining > 0:
+            self._clients[client] = remaining
+        else:
+            self._clients.pop(client, None)
+
+    def _retry_after(self):
+        # Time for the queue ahead to drain through the available slots
+        backlog = len(self._waiters) + 1
+        return max(1, math.ceil(self._hold * backlog / self.max_active))
+
+
+admission = AdmissionController()
+
+
+@metrics.registry.collector
+def _admission_metrics():
+    state = admission.snapshot()
+    yield ('tiktok_admission_active', 'gauge', 'Upstream transfers holding a slot',
+           [({}, state['active'])])
+    yield ('tiktok_admission_queued', 'gauge', 'Transfers waiting for a slot',
+           [({}, state['queued'])])
+    yield ('tiktok_admission_host_active', 'gauge', 'Upstream transfers per host',
+           [({'host': host}, count) for host, count in sorted(state['hosts'].items())])
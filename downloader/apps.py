@@ -4,6 +4,3 @@ from django.apps import AppConfig
 class DownloaderConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'downloader'
-
-    def ready(self):
-        from . import signals
\ No newline at end of file
@@ -0,0 +1,390 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+
+from . import canonical, metrics
+from .admission import Overloaded, admission
+from .cache import info_cache
+from .http_client import aguarded_get, aguarded_request, get_async_session
+from .jobs import DONE, FAILED, job_queue
+from .mp4 import MP4Error
+from .progress import progress_hub
+from .ratelimit import client_ip
+from .responses import aiterate, file_response
+from .storage import blob_store
+from .views import (
+    TIKWM_HEADERS,
+    content_type_for,
+    download_audio,
+    download_video,
+    event_stream_response,
+    extracted_audio_chunks,
+    extracted_audio_response,
+    get_resolver,
+    info_cache_aliases,
+    lookup_stored,
+    overloaded_response,
+    parse_tikwm_response,
+    record_download,
+    record_served,
+    require_video_id,
+    select_download_url,
+    sse_event,
+    storage_redirect,
+    stored_video,
+    with_local_thumbnail,
+)
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# In-flight transfers per event loop, keyed by (video_id, quality)
+_transfers = weakref.WeakKeyDictionary()
+
+
+@csrf_exempt
+async def get_video_info(request):
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Method not allowed'})
+
+    try:
+        data = json.loads(request.body)
+        url = data.get('url')
+
+        if not url:
+            return JsonResponse({'status': 'error', 'message': 'URL is required'})
+
+        video_info = await afetch_tiktok_info(url)
+
+        return JsonResponse({
+            'status': 'success',
+            'data': with_local_thumbnail(video_info)
+        })
+
+    except Exception as e:
+        logger.error(f"Error getting video info: {str(e)}")
+        metrics.request_errors.inc(view='async_video_info')
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        })
+
+
+@csrf_exempt
+async def process_video(request):
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Method not allowed'})
+
+    try:
+        data = json.loads(request.body)
+        url = data.get('url')
+        quality = data.get('quality', 'hd')
+
+        if not url:
+            return JsonResponse({
+                'status': 'error',
+                'message': 'URL is required'
+            })
+
+        video_info = await afetch_tiktok_info(url)
+
+        if quality == 'audio':
+            # Demuxing and the sound download block, so they run on a thread
+            filename = await sync_to_async(download_audio, thread_sensitive=False)(
+                video_info, url, client=client_ip(request)
+            )
+        else:
+            download_url = select_download_url(video_info, quality)
+            video_id = video_info['id'] or await sync_to_async(require_video_id)(url)
+            filename = await adownload_video(
+                download_url, video_id, quality, page_url=url, client=client_ip(request)
+            )
+        if not filename:
+            raise ValueError("Failed to download video")
+
+        return JsonResponse({
+            'status': 'success',
+            'message': 'Video downloaded successfully!',
+            'download_url': f'/download/async/{filename}'
+        })
+
+    except Overloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        logger.error(f"Error processing video: {str(e)}")
+        metrics.request_errors.inc(view='async_process')
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        })
+
+
+@require_http_methods(["GET", "HEAD"])
+async def download_file(request, filename):
+    try:
+        file_path = blob_store.path(filename)
+        if not os.path.exists(file_path) or blob_store.backend.shared:
+            # Redirect lookups and read-through fetches block, so run them off the loop
+            redirect_url = await sync_to_async(blob_store.redirect_url, thread_sensitive=False)(
+                filename, content_type_for(filename)
+            )
+            if redirect_url:
+                response = storage_redirect(redirect_url)
+                record_served(request, response, filename)
+                return response
+            try:
+                file_path = await sync_to_async(blob_store.local_path, thread_sensitive=False)(filename)
+            except FileNotFoundError:
+                pass
+        if not os.path.exists(file_path):
+            return JsonResponse({
+                'status': 'error',
+                'message': 'File not found'
+            })
+
+        response = file_response(
+            request, file_path, filename, content_type=content_type_for(filename),
+            digest=blob_store.digest(filename), asynchronous=True,
+        )
+        record_served(request, response, filename)
+        return response
+    except Exception as e:
+        logger.error(f"Error serving file: {str(e)}")
+        metrics.request_errors.inc(view='async_file')
+        return JsonResponse({
+            'status': 'error',
+            'message': 'Error downloading file'
+        })
+
+
+@require_http_methods(["GET"])
+async def stream_video(request):
+    """Async stream proxy: CDN chunks go out as they arrive instead of being
+    collected in full, which is what Django does to a sync body under ASGI"""
+    try:
+        url = request.GET.get('url')
+        quality = request.GET.get('quality', 'hd')
+        if not url:
+            return JsonResponse({'status': 'error', 'message': 'URL is required'})
+
+        video_info = await afetch_tiktok_info(url)
+        video_id = video_info['id'] or await sync_to_async(require_video_id)(url)
+
+        # A stored copy is cheaper than another trip to the CDN
+        filename = await sync_to_async(lookup_stored, thread_sensitive=False)(video_id, quality)
+        if filename:
+            return await download_file(request, filename)
+
+        if quality == 'audio':
+            source = await sync_to_async(stored_video, thread_sensitive=False)(video_id)
+            if source is None and not video_info['download_urls'].get('audio'):
+                source = await sync_to_async(download_video, thread_sensitive=False)(
+                    video_info['download_urls'].get('sd') or video_info['download_urls'].get('hd'),
+                    video_id, 'sd', page_url=url, client=client_ip(request),
+                )
+            if source:
+                try:
+                    chunks = await sync_to_async(extracted_audio_chunks, thread_sensitive=False)(
+                        url, video_id, source
+                    )
+                    return extracted_audio_response(request, aiterate(chunks), video_id)
+                except MP4Error as e:
+                    # Nothing has been sent yet; proxy the music track instead
+                    logger.warning(f"Error extracting audio: {str(e)}")
+                    if not video_info['download_urls'].get('audio'):
+                        raise
+
+        headers = {'Referer': 'https://tikwm.com/'}
+        for header in ('Range', 'If-Range'):
+            value = request.headers.get(header)
+            if value:
+                headers[header] = value
+
+        download_url = select_download_url(video_info, quality)
+        # The slot is held until the proxied body has been sent
+        ticket = await admission.aacquire(download_url, client_ip(request))
+        try:
+            upstream = await aguarded_request('GET', download_url, canonical.is_media_url, headers=headers)
+        except Exception:
+            ticket.release()
+            raise
+        if upstream.status not in (200, 206):
+            upstream.release()
+            ticket.release()
+            raise ValueError(f"Download failed with status: {upstream.status}")
+
+        ext = 'mp3' if quality == 'audio' else 'mp4'
+        chunks = metrics.atimed_stream(upstream.content.iter_chunked(settings.STREAM_CHUNK_SIZE), 'proxy')
+        # Only a complete body can become a blob
+        if upstream.status == 200 and settings.STREAM_TEE_TO_STORE:
+            chunks = _atee_to_store(chunks, url, video_id, quality, ext)
+
+        response = StreamingHttpResponse(
+            chunks,
+            status=upstream.status,
+            content_type=upstream.headers.get('Content-Type', 'video/mp4'),
+        )
+        for header in ('Content-Length', 'Content-Range', 'Accept-Ranges', 'Last-Modified', 'ETag'):
+            if header in upstream.headers:
+                response[header] = upstream.headers[header]
+        filename = blob_store.filename_for(video_id, quality, ext)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response._resource_closers.append(upstream.release)
+        response._resource_closers.append(ticket.release)
+        record_served(request, response, filename)
+        return response
+
+    except Overloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        logger.error(f"Error streaming video: {str(e)}")
+        metrics.request_errors.inc(view='async_stream')
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        })
+
+
+async def _atee_to_store(chunks, url, video_id, quality, ext='mp4'):
+    """Async twin of ``views._tee_to_store``"""
+    with blob_store.writer(video_id, quality, ext) as writer:
+        async for chunk in chunks:
+            writer.write(chunk)
+            yield chunk
+        filename, digest = await sync_to_async(writer.commit, thread_sensitive=False)()
+    record_download(url, video_id, quality, filename, digest)
+
+
+@require_http_methods(["GET"])
+async def job_events(request, job_id):
+    """Async job event stream: watchers wait on the event loop, not on threads"""
+    job = await job_queue.aget(job_id)
+    if not job:
+        return JsonResponse({'status': 'error', 'message': 'Job not found'}, status=404)
+    return event_stream_response(_ajob_events(job_id, job))
+
+
+async def _ajob_events(job_id, job):
+    version, local = progress_hub.latest(job_id)
+    job = local or job
+    yield b'retry: 2000\n\n' + sse_event(job)
+
+    deadline = time.monotonic() + settings.PROGRESS_STREAM_SECONDS
+    idle = 0
+    while job['status'] not in (DONE, FAILED) and time.monotonic() < deadline:
+        timeout = settings.PROGRESS_HEARTBEAT_SECONDS if local else settings.PROGRESS_POLL_SECONDS
+        version, event = await progress_hub.await_(job_id, version, timeout)
+        if event is not None:
+            local = event
+        elif not local:
+            event = await job_queue.aget(job_id)
+            if event is None:
+                return
+            if event == job:
+                event = None
+        if event is None:
+            idle += timeout
+            if idle >= settings.PROGRESS_HEARTBEAT_SECONDS:
+                idle = 0
+                yield b': keepalive\n\n'
+            continue
+        idle = 0
+        job = event
+        yield sse_event(job)
+
+
+async def afetch_tiktok_info(url):
+    """Async fetch_tiktok_info, sharing the same metadata cache"""
+    canonical.require_tiktok_url(url)
+    key = canonical.cache_key(url, database=False)
+    short = canonical.short_key(url)
+    if short and key.startswith('url:'):
+        # Only a short link missing from memory needs the database
+        key = await sync_to_async(canonical.cache_key)(url)
+    info = await info_cache.aget_or_fetch(
+        key,
+        lambda: get_resolver().aresolve(url),
+        aliases=info_cache_aliases,
+    )
+    if short and info.get('id') and canonical.short_links.peek(short) != str(info['id']):
+        await sync_to_async(canonical.remember)(url, info['id'])
+    return info
+
+
+async def _afetch_tiktok_info(url):
+    """Fetch video information from TikWM over the pooled async client"""
+    try:
+        session = get_async_session()
+        async with session.post(
+            settings.TIKWM_API_URL, data={'url': url, 'hd': 1}, headers=TIKWM_HEADERS
+        ) as response:
+            if response.status != 200:
+                raise ValueError(f"API request failed with status: {response.status}")
+            data = await response.json(content_type=None)
+
+        return parse_tikwm_response(data, url)
+
+    except Exception as e:
+        logger.error(f"Error fetching TikTok info: {str(e)}")
+        raise ValueError(f"Failed to fetch video information: {str(e)}")
+
+
+async def adownload_video(url, video_id, quality='hd', page_url=None, client=None):
+    """Async download_video: stream the CDN response into the blob store.
+
+    Concurrent calls for the same video and quality share one transfer, as
+    the job queue does for the sync views; a caller that goes away does not
+    cancel it for the others.
+    """
+    try:
+        filename = await blob_store.alookup(video_id, quality)
+        if filename:
+            record_download(page_url or url, video_id, quality, filename)
+            return filename
+
+        loop = asyncio.get_running_loop()
+        flights = _transfers.setdefault(loop, {})
+        key = (video_id, quality)
+        task = flights.get(key)
+        if task is None:
+            task = flights[key] = loop.create_task(_atransfer(url, video_id, quality, page_url, client))
+            task.add_done_callback(lambda _: flights.pop(key, None))
+            return await asyncio.shield(task)
+
+        filename = await asyncio.shield(task)
+        record_download(page_url or url, video_id, quality, filename)
+        return filename
+
+    except Overloaded:
+        raise
+    except Exception as e:
+        logger.error(f"Error downloading video: {str(e)}")
+        metrics.request_errors.inc(view='async_download')
+        return None
+
+
+async def _atransfer(url, video_id, quality, page_url, client):
+    canonical.require_media_url(url)
+    with await admission.aacquire(url, client):
+        start = time.perf_counter()
+        async with aguarded_get(url, canonical.is_media_url, headers={'Referer': 'https://tikwm.com/'}) as response:
+            if response.status != 200:
+                raise ValueError(f"Download failed with status: {response.status}")
+            filename, digest = await blob_store.asave(
+                video_id, quality, response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE)
+            )
+    metrics.download_seconds.observe(time.perf_counter() - start, mode='async')
+    metrics.download_bytes.inc(os.path.getsize(blob_store.path(filename)), mode='async')
+
+    record_download(page_url or url, video_id, quality, filename, digest)
+    return filename
@@ -0,0 +1,231 @@
+import json
+import logging
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .http_client import get_session
+from .storage import blob_store
+
+logger = logging.getLogger(__name__)
+
+ZIP_CHUNK_SIZE = 256 * 1024
+
+
+class BatchProcessor:
+    """Resolve (and optionally download) many TikTok URLs concurrently.
+
+    Work runs on a shared thread pool, but each batch keeps at most
+    ``concurrency`` items in flight so one large request cannot starve the
+    others. URLs that point at the same video are only processed once and
+    results are yielded in completion order.
+    """
+
+    def __init__(self, max_workers=None, concurrency=None):
+        self.max_workers = max_workers or settings.BATCH_WORKERS
+        self.concurrency = concurrency or settings.BATCH_CONCURRENCY
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='batch')
+            return self._executor
+
+    def run(self, urls, quality='hd', download=False):
+        """Yield one result dict per URL as soon as it is ready"""
+        from .views import info_cache_key
+
+        queue = deque()
+        seen_keys = {}
+        for url in urls:
+            key = info_cache_key(url)
+            if key in seen_keys:
+                yield {'status': 'duplicate', 'url': url, 'duplicate_of': seen_keys[key]}
+                continue
+            seen_keys[key] = url
+            queue.append(url)
+
+        seen_ids = {}
+        pending = {}
+        try:
+            while queue or pending:
+                while queue and len(pending) < self.concurrency:
+                    url = queue.popleft()
+                    pending[self.executor.submit(self._process, url, quality, download)] = url
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    video_id = result.get('data', {}).get('id')
+                    # Short links only reveal their video id once resolved
+                    if video_id and video_id in seen_ids:
+                        result = {'status': 'duplicate', 'url': result['url'], 'duplicate_of': seen_ids[video_id]}
+                    elif video_id:
+                        seen_ids[video_id] = result['url']
+                    del pending[future]
+                    yield result
+        finally:
+            # The client went away: drop what has not started yet
+            for future in pending:
+                future.cancel()
+
+    def _process(self, url, quality, download):
+        from .views import download_for_quality, fetch_tiktok_info
+
+        try:
+            video_info = fetch_tiktok_info(url)
+            result = {'status': 'success', 'url': url, 'data': video_info}
+            if download:
+                filename = download_for_quality(video_info, url, quality)
+                if not filename:
+                    raise ValueError("Failed to download video")
+                result['filename'] = filename
+                result['download_url'] = f'/download/{filename}'
+            return result
+        except Exception as e:
+            logger.error(f"Error processing batch item: {str(e)}")
+            return {'status': 'error', 'url': url, 'message': str(e)}
+        finally:
+            close_old_connections()
+
+
+def iter_ndjson(results):
+    """Encode result dicts as newline-delimited JSON"""
+    for result in results:
+        yield json.dumps(result).encode() + b'\n'
+
+
+class _ZipSink:
+    """Write-only file object that hands zipfile output to a generator.
+
+    It has no ``tell``/``seek``, so zipfile writes data descriptors after
+    each member instead of seeking back, and the archive streams out without
+    ever being staged on disk.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_zip(results):
+    """Stream a ZIP of every downloaded video, with a manifest at the end"""
+    sink = _ZipSink()
+    manifest = []
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for result in results:
+            manifest.append(result)
+            filename = result.get('filename')
+            if not filename:
+                continue
+            try:
+                path = blob_store.local_path(filename)
+                source = open(path, 'rb')
+            except OSError as e:
+                logger.error(f"Error adding {filename} to archive: {str(e)}")
+                result.update(status='error', message='File not found')
+                continue
+
+            with source:
+                info = zipfile.ZipInfo.from_file(path, arcname=filename)
+                # Videos are already compressed
+                info.compress_type = zipfile.ZIP_STORED
+                with archive.open(info, 'w', force_zip64=True) as member:
+                    while True:
+                        chunk = source.read(ZIP_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        member.write(chunk)
+                        data = sink.drain()
+                        if data:
+                            yield data
+            data = sink.drain()
+            if data:
+                yield data
+
+        archive.writestr('manifest.ndjson', b''.join(iter_ndjson(manifest)))
+    yield sink.drain()
+
+
+def expand_sources(data, limit):
+    """Collect the URLs of a batch request from urls, user and hashtag"""
+    urls = [url for url in data.get('urls') or [] if isinstance(url, str) and url.strip()]
+    if data.get('user'):
+        urls += fetch_user_videos(data['user'], limit)
+    if data.get('hashtag'):
+        urls += fetch_hashtag_videos(data['hashtag'], limit)
+    return urls[:limit]
+
+
+def fetch_user_videos(username, limit):
+    """Video URLs from a user's profile, newest first"""
+    username = username.strip().lstrip('@')
+    return _paginate(
+        _api_url('user/posts'), {'unique_id': username}, limit,
+        lambda video: f"https://www.tiktok.com/@{username}/video/{video['video_id']}",
+    )
+
+
+def fetch_hashtag_videos(hashtag, limit):
+    """Video URLs for a hashtag, as listed by TikWM"""
+    data = _api_get(_api_url('challenge/info'), {'challenge_name': hashtag.strip().lstrip('#')})
+    challenge_id = data.get('id')
+    if not challenge_id:
+        raise ValueError(f"Hashtag not found: {hashtag}")
+    return _paginate(
+        _api_url('challenge/posts'), {'challenge_id': challenge_id}, limit,
+        lambda video: f"https://www.tiktok.com/@{video['author']['unique_id']}/video/{video['video_id']}",
+    )
+
+
+def _api_url(endpoint):
+    return settings.TIKWM_API_URL.rstrip('/') + '/' + endpoint
+
+
+def _api_get(url, params):
+    from .views import TIKWM_HEADERS
+
+    response = get_session().get(url, params=params, headers=TIKWM_HEADERS)
+    if response.status_code != 200:
+        raise ValueError(f"API request failed with status: {response.status_code}")
+    payload = response.json()
+    if payload.get('code') != 0:
+        raise ValueError(payload.get('msg', 'Failed to list videos'))
+    return payload.get('data') or {}
+
+
+def _paginate(url, params, limit, to_url):
+    urls = []
+    cursor = 0
+    while len(urls) < limit:
+        data = _api_get(url, {**params, 'count': min(35, limit - len(urls)), 'cursor': cursor})
+        for video in data.get('videos', []):
+            try:
+                urls.append(to_url(video))
+            except (KeyError, TypeError):
+                continue
+        if not data.get('hasMore') or not data.get('videos'):
+            break
+        cursor = data.get('cursor', 0)
+    return urls[:limit]
+
+
+batch_processor = BatchProcessor()
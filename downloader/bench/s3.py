@@ -0,0 +1,204 @@
+import hashlib
+import re
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+from downloader.storage_backends import S3Backend
+
+AUTHORIZATION = re.compile(r'Credential=([^/]+)/[^,]+, SignedHeaders=([^,]+), Signature=(\w+)')
+PART = re.compile(r'<PartNumber>(\d+)</PartNumber><ETag>([^<]+)</ETag>')
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class FakeS3:
+    """Local stand-in for an S3-compatible store such as MinIO.
+
+    Keeps objects in memory for one path-style bucket and implements what
+    ``S3Backend`` uses: PUT, GET with a single range, HEAD, DELETE,
+    multipart uploads and presigned GETs. Every request's SigV4 signature
+    is checked, so a signing mistake fails here as it would against a real
+    store. ``requests`` counts calls by method.
+    """
+
+    def __init__(self, bucket='bench', access_key='bench', secret_key='bench-secret',
+                 host='127.0.0.1', port=0):
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.objects = {}
+        self.uploads = {}
+        self.requests = {}
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def endpoint_url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def settings(self, **overrides):
+        """``override_settings`` arguments pointing the app at this store"""
+        values = {
+            'STORAGE_BACKEND': 's3',
+            'STORAGE_S3_ENDPOINT_URL': self.endpoint_url,
+            'STORAGE_S3_PUBLIC_URL': None,
+            'STORAGE_S3_BUCKET': self.bucket,
+            'STORAGE_S3_ACCESS_KEY': self.access_key,
+            'STORAGE_S3_SECRET_KEY': self.secret_key,
+            'STORAGE_S3_REGION': 'us-east-1',
+            'STORAGE_S3_PREFIX': '',
+            'STORAGE_S3_ADDRESSING': 'path',
+        }
+        values.update(overrides)
+        return values
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _verify(self, method, path, query, headers):
+        signer = S3Backend(self.endpoint_url, self.bucket, self.access_key, self.secret_key)
+        if 'X-Amz-Signature' in query:
+            query = dict(query)
+            signature = query.pop('X-Amz-Signature')
+            signed = {'host': headers['Host']}
+            payload_hash = 'UNSIGNED-PAYLOAD'
+            amz_date = query.get('X-Amz-Date', '')
+        else:
+            match = AUTHORIZATION.search(headers.get('Authorization', ''))
+            if not match or match.group(1) != self.access_key:
+                return False
+            signature = match.group(3)
+            signed = {name: headers.get(name, '') for name in match.group(2).split(';')}
+            payload_hash = headers.get('x-amz-content-sha256', '')
+            amz_date = headers.get('x-amz-date', '')
+        expected, _, _ = signer._signature(method, path, query, signed, payload_hash, amz_date)
+        return expected == signature
+
+    def _handler_class(self):
+        store = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _dispatch(self, method):
+                with store._lock:
+                    store.requests[method] = store.requests.get(method, 0) + 1
+                parts = urlsplit(self.path)
+                query = dict(parse_qsl(parts.query, keep_blank_values=True))
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                if not store._verify(method, parts.path, query, self.headers):
+                    return self._reply(403, b'<Error><Code>SignatureDoesNotMatch</Code></Error>')
+                prefix = f'/{store.bucket}/'
+                if not parts.path.startswith(prefix):
+                    return self._reply(404, b'<Error><Code>NoSuchBucket</Code></Error>')
+                key = unquote(parts.path[len(prefix):])
+                if method == 'PUT' and 'uploadId' in query:
+                    return self._put_part(query, body)
+                if method == 'PUT':
+                    with store._lock:
+                        store.objects[key] = body
+                    return self._reply(200, b'', {'ETag': _etag(body)})
+                if method == 'POST' and 'uploads' in query:
+                    upload_id = uuid.uuid4().hex
+                    with store._lock:
+                        store.uploads[upload_id] = {}
+                    return self._reply(200, f'<InitiateMultipartUploadResult><UploadId>{upload_id}</UploadId>'
+                                            f'</InitiateMultipartUploadResult>'.encode())
+                if method == 'POST' and 'uploadId' in query:
+                    return self._complete(key, query['uploadId'], body.decode())
+                if method == 'DELETE':
+                    with store._lock:
+                        store.uploads.pop(query.get('uploadId'), None)
+                        if 'uploadId' not in query:
+                            store.objects.pop(key, None)
+                    return self._reply(204, b'')
+                data = store.objects.get(key)
+                if data is None:
+                    return self._reply(404, b'<Error><Code>NoSuchKey</Code></Error>')
+                return self._get(method, data, query)
+
+            def _put_part(self, query, body):
+                with store._lock:
+                    parts = store.uploads.get(query['uploadId'])
+                    if parts is None:
+                        return self._reply(404, b'<Error><Code>NoSuchUpload</Code></Error>')
+                    parts[int(query['partNumber'])] = body
+                return self._reply(200, b'', {'ETag': _etag(body)})
+
+            def _complete(self, key, upload_id, document):
+                with store._lock:
+                    parts = store.uploads.pop(upload_id, None)
+                if parts is None:
+                    return self._reply(404, b'<Error><Code>NoSuchUpload</Code></Error>')
+                listed = [(int(number), etag) for number, etag in PART.findall(document)]
+                if not listed or any(_etag(parts.get(number, b'')) != etag for number, etag in listed):
+                    return self._reply(400, b'<Error><Code>InvalidPart</Code></Error>')
+                with store._lock:
+                    store.objects[key] = b''.join(parts[number] for number, _ in listed)
+                return self._reply(200, b'<CompleteMultipartUploadResult/>')
+
+            def _get(self, method, data, query):
+                headers = {'Content-Type': query.get('response-content-type', 'application/octet-stream')}
+                if 'response-content-disposition' in query:
+                    headers['Content-Disposition'] = query['response-content-disposition']
+                status = 200
+                match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+                if match:
+                    start = int(match.group(1))
+                    end = int(match.group(2) or len(data) - 1)
+                    headers['Content-Range'] = f'bytes {start}-{end}/{len(data)}'
+                    data = data[start:end + 1]
+                    status = 206
+                return self._reply(status, data, headers)
+
+            def _reply(self, status, body, headers=None):
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(body)
+
+            def do_GET(self):
+                self._dispatch('GET')
+
+            def do_HEAD(self):
+                self._dispatch('HEAD')
+
+            def do_PUT(self):
+                self._dispatch('PUT')
+
+            def do_POST(self):
+                self._dispatch('POST')
+
+            def do_DELETE(self):
+                self._dispatch('DELETE')
+
+        return Handler
+
+
+def _etag(data):
+    return f'"{hashlib.md5(data).hexdigest()}"'
@@ -0,0 +1,243 @@
+import asyncio
+import itertools
+import os
+import random
+import resource
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.test import AsyncClient, Client
+
+from downloader.http_client import close_async_session
+
+from .stats import percentile
+
+
+_client_numbers = itertools.count(1)
+
+
+def client_address():
+    """A distinct address per simulated client, so per-client limits apply as in production.
+
+    It is sent as ``X-Forwarded-For``, which the harness trusts.
+    """
+    number = next(_client_numbers)
+    return f'10.{number >> 16 & 255}.{number >> 8 & 255}.{number & 255}'
+
+
+class Scenario:
+    """A load shape: which URLs clients ask for and how they download.
+
+    ``pick(i, rng)`` returns the video id for request ``i``. ``resume``
+    makes every client fetch the file in two Range requests, the second
+    one conditional on the first response's ETag.
+    """
+
+    def __init__(self, name, description, pick, payload_kb=256, bandwidth_mb=None,
+                 request_factor=1.0, resume=False):
+        self.name = name
+        self.description = description
+        self.pick = pick
+        self.payload_kb = payload_kb
+        self.bandwidth_mb = bandwidth_mb
+        self.request_factor = request_factor
+        self.resume = resume
+
+    def video_ids(self, requests, base, seed):
+        rng = random.Random(seed)
+        count = max(1, int(requests * self.request_factor))
+        return [base + self.pick(i, rng) for i in range(count)]
+
+
+def _zipf(catalog, exponent):
+    weights = [1 / (rank ** exponent) for rank in range(1, catalog + 1)]
+    total = sum(weights)
+    cumulative = []
+    running = 0.0
+    for weight in weights:
+        running += weight / total
+        cumulative.append(running)
+
+    def pick(i, rng):
+        point = rng.random()
+        low, high = 0, len(cumulative) - 1
+        while low < high:
+            middle = (low + high) // 2
+            if cumulative[middle] < point:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    return pick
+
+
+SCENARIOS = {
+    'unique': Scenario(
+        'unique', 'every request is a different video', lambda i, rng: i,
+    ),
+    'viral': Scenario(
+        'viral', 'every client asks for the same video at once', lambda i, rng: 0,
+    ),
+    'long-tail': Scenario(
+        'long-tail', 'zipf-distributed picks from a 10k video catalog', _zipf(10000, 1.1),
+    ),
+    'hd': Scenario(
+        'hd', 'large HD files over throttled connections', lambda i, rng: i,
+        payload_kb=16 * 1024, bandwidth_mb=8, request_factor=0.1,
+    ),
+    'resume': Scenario(
+        'resume', 'clients download in two Range requests', lambda i, rng: i % 20,
+        payload_kb=2 * 1024, resume=True,
+    ),
+}
+
+
+class Result:
+    def __init__(self, entry, scenario, latencies, elapsed, errors, upstream_requests, rss_growth):
+        self.entry = entry
+        self.scenario = scenario
+        self.latencies = latencies
+        self.elapsed = elapsed
+        self.errors = errors
+        self.upstream_requests = upstream_requests
+        self.rss_growth = rss_growth
+
+    def line(self):
+        count = len(self.latencies)
+        rps = count / self.elapsed if self.elapsed else 0.0
+        return (
+            f'{self.scenario:<10} {self.entry:<5} {count:>5} ok {self.errors:>4} err  '
+            f'{rps:>8.1f} req/s  '
+            f'p50 {percentile(self.latencies, 50) * 1000:>8.1f} ms  '
+            f'p99 {percentile(self.latencies, 99) * 1000:>8.1f} ms  '
+            f'upstream {self.upstream_requests:>5}  '
+            f'rss +{self.rss_growth / (1024 * 1024):.1f} MB'
+        )
+
+
+def current_rss():
+    """Resident set size of this process in bytes"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes (Linux reports KB)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_wsgi(scenario, urls, size, workers, upstream):
+    def one(url):
+        client = Client(headers={'X-Forwarded-For': client_address()})
+        start = time.perf_counter()
+        client.post('/api/video-info/', {'url': url}, content_type='application/json')
+        data = client.post('/api/process/', {'url': url}, content_type='application/json').json()
+        if 'status_url' in data:
+            data = _wait_for_job(client, data['status_url'])
+        if 'download_url' not in data:
+            return None
+        if not _fetch(client, data['download_url'], size, scenario.resume):
+            return None
+        return time.perf_counter() - start
+
+    return _measure('wsgi', scenario, upstream, lambda: _map_threads(one, urls, workers))
+
+
+def run_asgi(scenario, urls, size, concurrency, upstream):
+    async def one(url, gate):
+        async with gate:
+            client = AsyncClient()
+            # AsyncClient drops client-wide custom headers, so send it per request
+            forwarded = {'X-Forwarded-For': client_address()}
+            start = time.perf_counter()
+            await client.post('/api/async/video-info/', {'url': url}, content_type='application/json',
+                              headers=forwarded)
+            response = await client.post('/api/async/process/', {'url': url}, content_type='application/json',
+                                         headers=forwarded)
+            data = response.json()
+            if data.get('status') != 'success':
+                return None
+            if not await _afetch(client, data['download_url'], size, scenario.resume):
+                return None
+            return time.perf_counter() - start
+
+    async def run():
+        gate = asyncio.Semaphore(concurrency)
+        try:
+            return await asyncio.gather(*(one(url, gate) for url in urls))
+        finally:
+            await close_async_session()
+
+    return _measure('asgi', scenario, upstream, lambda: asyncio.run(run()))
+
+
+def _measure(entry, scenario, upstream, run):
+    upstream_before = upstream.requests
+    rss_before = current_rss()
+    start = time.perf_counter()
+    results = run()
+    elapsed = time.perf_counter() - start
+    latencies = [r for r in results if r is not None]
+    return Result(
+        entry, scenario.name, latencies, elapsed, len(results) - len(latencies),
+        upstream.requests - upstream_before, max(0, current_rss() - rss_before),
+    )
+
+
+def _map_threads(one, urls, workers):
+    def safe(url):
+        try:
+            return one(url)
+        except Exception:
+            return None
+
+    with ThreadPoolExecutor(workers) as pool:
+        return list(pool.map(safe, urls))
+
+
+def _wait_for_job(client, status_url):
+    while True:
+        job = client.get(status_url).json().get('job', {})
+        if job.get('status') not in ('queued', 'running'):
+            return job
+        time.sleep(0.02)
+
+
+def _fetch(client, download_url, size, resume):
+    if not resume:
+        response = client.get(download_url)
+        received = sum(len(chunk) for chunk in response.streaming_content)
+        response.close()
+        return received == size
+
+    half = size // 2
+    first = client.get(download_url, headers={'Range': f'bytes=0-{half - 1}'})
+    received = sum(len(chunk) for chunk in first.streaming_content)
+    first.close()
+    second = client.get(download_url, headers={'Range': f'bytes={half}-', 'If-Range': first['ETag']})
+    received += sum(len(chunk) for chunk in second.streaming_content)
+    second.close()
+    return first.status_code == 206 and second.status_code == 206 and received == size
+
+
+async def _afetch(client, download_url, size, resume):
+    async def body(response):
+        total = 0
+        async for chunk in response.streaming_content:
+            total += len(chunk)
+        return total
+
+    if not resume:
+        response = await client.get(download_url)
+        return await body(response) == size
+
+    half = size // 2
+    first = await client.get(download_url, headers={'Range': f'bytes=0-{half - 1}'})
+    received = await body(first)
+    second = await client.get(download_url, headers={'Range': f'bytes={half}-', 'If-Range': first['ETag']})
+    received += await body(second)
+    return first.status_code == 206 and second.status_code == 206 and received == size
@@ -0,0 +1,120 @@
+"""Cold start probe.
+
+``python -m downloader.bench.startup <entry>`` loads the app the way a
+fresh worker would, serves one request and prints its timings as JSON.
+The helpers below run it in new interpreters for ``bench_startup``.
+"""
+import json
+import os
+import sys
+import time
+
+ENTRIES = ('manage', 'wsgi', 'asgi')
+
+
+def probe(entry):
+    started = time.perf_counter()
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'video_downloader.settings')
+    if entry == 'manage':
+        from io import StringIO
+
+        import django
+        from django.core.management import call_command
+
+        django.setup()
+        ready = time.perf_counter()
+        # The system checks import the URLconf and every view, like most commands
+        call_command('check', stdout=StringIO(), stderr=StringIO())
+        status = 0
+    elif entry == 'wsgi':
+        from wsgiref.util import setup_testing_defaults
+
+        from video_downloader.wsgi import application
+
+        ready = time.perf_counter()
+        environ = {}
+        setup_testing_defaults(environ)
+        statuses = []
+        b''.join(application(environ, lambda status, headers, exc_info=None: statuses.append(status)))
+        status = int(statuses[0].split()[0])
+    else:
+        import asyncio
+
+        from video_downloader.asgi import application
+
+        ready = time.perf_counter()
+        status = asyncio.run(_asgi_request(application))
+    done = time.perf_counter()
+    return {
+        'ready': ready - started,
+        'first_request': done - ready,
+        'status': status,
+        'modules': len(sys.modules),
+    }
+
+
+async def _asgi_request(application):
+    import asyncio
+
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': 'GET', 'scheme': 'http', 'path': '/', 'raw_path': b'/',
+        'query_string': b'', 'root_path': '', 'headers': [(b'host', b'127.0.0.1')],
+        'client': ('127.0.0.1', 50000), 'server': ('127.0.0.1', 80),
+    }
+    sent = []
+    finished = asyncio.Event()
+    requested = []
+
+    async def receive():
+        if not requested:
+            requested.append(True)
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # Django listens for a disconnect until the response is complete
+        await finished.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+        if message['type'] == 'http.response.body' and not message.get('more_body'):
+            finished.set()
+
+    await application(scope, receive, send)
+    return sent[0]['status']
+
+
+def run_probe(entry, cwd, env=None):
+    """Timings of one cold start, with ``total`` measured from outside"""
+    # Only the parent needs subprocess, so the probe does not pay for it
+    import subprocess
+
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-m', 'downloader.bench.startup', entry],
+        cwd=cwd, env=env, capture_output=True, text=True, check=True,
+    )
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings['total'] = time.perf_counter() - start
+    return timings
+
+
+def import_profile(entry, cwd, env=None):
+    """Self import time per top-level package, from ``python -X importtime``"""
+    import subprocess
+
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-m', 'downloader.bench.startup', entry],
+        cwd=cwd, env=env, capture_output=True, text=True, check=True,
+    )
+    packages = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        package = name.strip().split('.')[0]
+        packages[package] = packages.get(package, 0) + int(self_us) / 1e6
+    return sorted(packages.items(), key=lambda item: item[1], reverse=True)
+
+
+if __name__ == '__main__':
+    print(json.dumps(probe(sys.argv[1])))
@@ -0,0 +1,19 @@
+def percentile(values, pct):
+    """Nearest-rank percentile of an unsorted list"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(name, latencies, elapsed, errors=0):
+    """One report line: throughput and latency percentiles in ms"""
+    count = len(latencies)
+    rps = count / elapsed if elapsed else 0.0
+    return (
+        f'{name:<12} {count:>6} req  {rps:>9.1f} req/s  '
+        f'p50 {percentile(latencies, 50) * 1000:>8.1f} ms  '
+        f'p99 {percentile(latencies, 99) * 1000:>8.1f} ms  '
+        f'errors {errors}'
+    )
@@ -0,0 +1,192 @@
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class FakeUpstream:
+    """Local stand-in for the TikWM API and its video CDN.
+
+    ``POST /api/`` answers like tikwm.com with play URLs pointing back at
+    this server, and ``GET /video/<id>.mp4`` serves ``payload_size`` bytes
+    with single-range support. ``GET /api/user/posts`` and the challenge
+    endpoints list ten videos. Every response is delayed by ``latency``
+    seconds and bodies are throttled to ``bandwidth`` bytes/s per connection.
+
+    Failures are injected at random: ``error_rate`` of responses are 503s
+    and ``drop_rate`` of media bodies are cut off halfway by closing the
+    connection. ``seed`` makes a run repeatable.
+    """
+
+    def __init__(self, latency=0.0, payload_size=512 * 1024, bandwidth=None,
+                 host='127.0.0.1', port=0, error_rate=0.0, drop_rate=0.0, seed=None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.errors = 0
+        self.drops = 0
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self.payload = bytes(range(256)) * (payload_size // 256) + b'\0' * (payload_size % 256)
+        self.requests = 0
+        self._server = _Server((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def api_url(self):
+        return f'{self.base_url}/api/'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def video_info(self, url):
+        match = re.search(r'/video/(\d+)', url)
+        video_id = match.group(1) if match else str(abs(hash(url)))
+        return {
+            'code': 0,
+            'msg': 'success',
+            'data': {
+                'id': video_id,
+                'title': f'Benchmark video {video_id}',
+                'author': {'unique_id': 'bench'},
+                'cover': f'{self.base_url}/cover/{video_id}.jpg',
+                'play': f'{self.base_url}/video/{video_id}.mp4',
+                'hdplay': f'{self.base_url}/video/{video_id}.mp4?hd=1',
+                'music': f'{self.base_url}/music/{video_id}.mp3',
+                'play_count': 0,
+                'digg_count': 0,
+                'share_count': 0,
+            }
+        }
+
+    def roll(self, rate):
+        """Whether an injected failure with probability ``rate`` happens"""
+        if not rate:
+            return False
+        with self._random_lock:
+            return self._random.random() < rate
+
+    def listing(self, path):
+        """A single page of videos for the user and hashtag endpoints"""
+        if path.endswith('/challenge/info'):
+            return {'code': 0, 'msg': 'success', 'data': {'id': '1'}}
+        videos = [
+            {'video_id': str(7000000000000000000 + n), 'author': {'unique_id': 'bench'}}
+            for n in range(10)
+        ]
+        return {'code': 0, 'msg': 'success', 'data': {'videos': videos, 'hasMore': False, 'cursor': 0}}
+
+    def _handler_class(self):
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                upstream.requests += 1
+                length = int(self.headers.get('Content-Length', 0))
+                form = parse_qs(self.rfile.read(length).decode())
+                time.sleep(upstream.latency)
+                if upstream.roll(upstream.error_rate):
+                    upstream.errors += 1
+                    self._send(503, b'', 'text/plain')
+                    return
+                body = json.dumps(upstream.video_info(form.get('url', [''])[0])).encode()
+                self._send(200, body, 'application/json')
+
+            def do_GET(self):
+                path = urlparse(self.path).path
+                if path.startswith(('/api/user/posts', '/api/challenge/')):
+                    upstream.requests += 1
+                    time.sleep(upstream.latency)
+                    body = json.dumps(upstream.listing(path)).encode()
+                    self._send(200, body, 'application/json')
+                    return
+                self._media(send_body=True)
+
+            def do_HEAD(self):
+                self._media(send_body=False)
+
+            def _media(self, send_body):
+                upstream.requests += 1
+                time.sleep(upstream.latency)
+                if not urlparse(self.path).path.startswith(('/video/', '/music/')):
+                    self._send(404, b'', 'text/plain')
+                    return
+                if upstream.roll(upstream.error_rate):
+                    upstream.errors += 1
+                    self._send(503, b'', 'text/plain')
+                    return
+
+                payload = upstream.payload
+                size = len(payload)
+                match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+                if match:
+                    start = int(match.group(1))
+                    end = min(int(match.group(2) or size - 1), size - 1)
+                    self.send_response(206)
+                    self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+                    body = payload[start:end + 1]
+                else:
+                    self.send_response(200)
+                    body = payload
+                self.send_header('Content-Type', 'video/mp4')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('Accept-Ranges', 'bytes')
+                self.send_header('ETag', '"bench"')
+                self.end_headers()
+                if send_body and upstream.roll(upstream.drop_rate):
+                    # Promise the whole body, deliver half, hang up
+                    upstream.drops += 1
+                    self._write(body[:len(body) // 2])
+                    self.close_connection = True
+                elif send_body:
+                    self._write(body)
+
+            def _send(self, status, body, content_type):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self._write(body)
+
+            def _write(self, body):
+                if not upstream.bandwidth:
+                    self.wfile.write(body)
+                    return
+                step = 64 * 1024
+                for offset in range(0, len(body), step):
+                    self.wfile.write(body[offset:offset + step])
+                    time.sleep(min(step, len(body) - offset) / upstream.bandwidth)
+
+        return Handler
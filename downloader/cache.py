@@ -0,0 +1,221 @@
+import asyncio
+import logging
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class CachedError(ValueError):
+    """A lookup failure replayed from the negative cache"""
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class MetadataCache:
+    """Two-tier TTL cache with single-flight coalescing.
+
+    Lookups hit an in-process LRU first, then the shared Django cache, and
+    only then call ``fetch``. Concurrent misses for the same key wait on the
+    first caller instead of each going upstream. Failures are cached for a
+    shorter ``negative_ttl`` so a broken URL cannot hammer the API.
+    """
+
+    def __init__(self, prefix, maxsize=None, ttl=None, negative_ttl=None, alias=None):
+        self.prefix = prefix
+        self.maxsize = maxsize if maxsize is not None else getattr(settings, 'TIKTOK_INFO_CACHE_SIZE', 1024)
+        self.ttl = ttl if ttl is not None else getattr(settings, 'TIKTOK_INFO_CACHE_TTL', 300)
+        self.negative_ttl = negative_ttl if negative_ttl is not None else getattr(settings, 'TIKTOK_INFO_NEGATIVE_TTL', 30)
+        self.alias = alias or getattr(settings, 'TIKTOK_INFO_CACHE_ALIAS', 'default')
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._aflights = weakref.WeakKeyDictionary()
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    def get_or_fetch(self, key, fetch, aliases=None):
+        """Return the cached value for ``key`` or call ``fetch()`` once.
+
+        ``aliases`` is an optional callable that receives the fetched value
+        and returns extra keys to store it under, so a short link and the
+        canonical video id end up sharing one entry.
+        """
+        entry = self._get(key)
+        if entry is not None:
+            return self._unwrap(entry)
+
+        with self._lock:
+            flight = self._flights.get(key)
+            # A leader that finished since our miss stored its result first
+            entry = self._local_entry(key, time.monotonic()) if flight is None else None
+            leader = flight is None and entry is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if entry is not None:
+            return self._unwrap(entry)
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                # Each waiter gets its own exception and traceback
+                raise CachedError(flight.error)
+            return flight.value
+
+        try:
+            try:
+                value = fetch()
+            except Exception as e:
+                self._set(key, {'error': str(e)}, self.negative_ttl)
+                flight.error = str(e)
+                raise
+            keys = [key] + list(aliases(value) if aliases else [])
+            for k in keys:
+                self._set(k, {'value': value}, self.ttl)
+            flight.value = value
+            return value
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    async def aget_or_fetch(self, key, fetch, aliases=None):
+        """Async twin of ``get_or_fetch`` for coroutine ``fetch`` callables.
+
+        Coalescing happens per event loop: waiters share the leader's task
+        rather than blocking a thread.
+        """
+        entry = await self._aget(key)
+        if entry is not None:
+            return self._unwrap(entry)
+
+        loop = asyncio.get_running_loop()
+        flights = self._aflights.setdefault(loop, {})
+        task = flights.get(key)
+        if task is None:
+            entry = self._get_local(key)
+            if entry is not None:
+                return self._unwrap(entry)
+            task = flights[key] = loop.create_task(self._afetch(key, fetch, aliases))
+            task.add_done_callback(lambda _: flights.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _afetch(self, key, fetch, aliases):
+        try:
+            value = await fetch()
+        except Exception as e:
+            await self._aset(key, {'error': str(e)}, self.negative_ttl)
+            raise
+        keys = [key] + list(aliases(value) if aliases else [])
+        for k in keys:
+            await self._aset(k, {'value': value}, self.ttl)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._local.pop(key, None)
+        self.shared.delete(self._shared_key(key))
+
+    def _unwrap(self, entry):
+        if 'error' in entry:
+            raise CachedError(entry['error'])
+        return entry['value']
+
+    def _get_local(self, key):
+        now = time.monotonic()
+        with self._lock:
+            return self._local_entry(key, now)
+
+    def _local_entry(self, key, now):
+        """LRU lookup; the caller holds ``_lock``"""
+        item = self._local.get(key)
+        if item is not None:
+            expires, entry = item
+            if expires > now:
+                self._local.move_to_end(key)
+                return entry
+            del self._local[key]
+        return None
+
+    def _get(self, key):
+        entry = self._get_local(key)
+        if entry is not None:
+            metrics.info_cache_requests.inc(result='local')
+            return entry
+        try:
+            entry = self.shared.get(self._shared_key(key))
+        except Exception as e:
+            logger.error(f"Shared cache read failed: {str(e)}")
+            return None
+        self._count_shared(entry)
+        if entry is not None:
+            self._set_local(key, entry, entry['expires'] - time.time())
+        return entry
+
+    async def _aget(self, key):
+        entry = self._get_local(key)
+        if entry is not None:
+            metrics.info_cache_requests.inc(result='local')
+            return entry
+        try:
+            entry = await self.shared.aget(self._shared_key(key))
+        except Exception as e:
+            logger.error(f"Shared cache read failed: {str(e)}")
+            return None
+        self._count_shared(entry)
+        if entry is not None:
+            self._set_local(key, entry, entry['expires'] - time.time())
+        return entry
+
+    def _count_shared(self, entry):
+        if entry is None:
+            metrics.info_cache_requests.inc(result='miss')
+        elif 'error' in entry:
+            metrics.info_cache_requests.inc(result='negative')
+        else:
+            metrics.info_cache_requests.inc(result='shared')
+
+    async def _aset(self, key, entry, ttl):
+        entry['expires'] = time.time() + ttl
+        self._set_local(key, entry, ttl)
+        try:
+            await self.shared.aset(self._shared_key(key), entry, ttl)
+        except Exception as e:
+            logger.error(f"Shared cache write failed: {str(e)}")
+
+    def _set(self, key, entry, ttl):
+        entry['expires'] = time.time() + ttl
+        self._set_local(key, entry, ttl)
+        try:
+            self.shared.set(self._shared_key(key), entry, ttl)
+        except Exception as e:
+            logger.error(f"Shared cache write failed: {str(e)}")
+
+    def _set_local(self, key, entry, ttl):
+        if self.maxsize <= 0 or ttl <= 0:
+            return
+        with self._lock:
+            self._local[key] = (time.monotonic() + ttl, entry)
+            self._local.move_to_end(key)
+            while len(self._local) > self.maxsize:
+                self._local.popitem(last=False)
+
+    def _shared_key(self, key):
+        return f'{self.prefix}:{key}'
+
+
+info_cache = MetadataCache('tiktok_info')
@@ -0,0 +1,344 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+PICKLED = b'\x00'
+COMPRESSED = b'\x01'
+
+_MISSING = object()
+
+# Django builds cache instances per thread, so the memory tier lives here
+# to be shared by every thread of the process, like LocMemCache does
+_tiers = {}
+_tier_locks = {}
+
+
+def dumps(value, compress_min_size=1024):
+    """Serialize a cache value: plain ints stay ints, the rest is pickled.
+
+    Pickles larger than ``compress_min_size`` bytes are zlib-compressed when
+    that actually saves space.
+    """
+    if type(value) is int:
+        return value
+    data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    if compress_min_size is not None and len(data) > compress_min_size:
+        packed = zlib.compress(data, 1)
+        if len(packed) < len(data):
+            return COMPRESSED + packed
+    return PICKLED + data
+
+
+def loads(data):
+    if type(data) is int:
+        return data
+    data = bytes(data)
+    if data[:1] == COMPRESSED:
+        return pickle.loads(zlib.decompress(data[1:]))
+    return pickle.loads(data[1:])
+
+
+class SQLiteCache(BaseCache):
+    """Cache shared by every worker on a host through one SQLite file.
+
+    The database runs in WAL mode so readers never block the writer, and
+    each thread keeps its own connection. Integers are stored as SQLite
+    integers, which makes ``incr`` a single atomic ``UPDATE``. Expired rows
+    are culled every ``CULL_EVERY`` writes together with the oldest rows
+    once ``MAX_ENTRIES`` is exceeded.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.path = location
+        self.compress_min_size = options.get('COMPRESS_MIN_SIZE', 1024)
+        self.cull_every = options.get('CULL_EVERY', 500)
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS cache '
+            '(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)')
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _expiry(self, timeout):
+        return self.get_backend_timeout(timeout)
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        row = self._connection().execute(
+            'SELECT value FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (key, time.time()),
+        ).fetchone()
+        return default if row is None else loads(row[0])
+
+    def get_many(self, keys, version=None):
+        key_map = {self.make_and_validate_key(key, version=version): key for key in keys}
+        found = {}
+        conn = self._connection()
+        now = time.time()
+        names = list(key_map)
+        # Stay under SQLite's bound parameter limit
+        for offset in range(0, len(names), 500):
+            chunk = names[offset:offset + 500]
+            rows = conn.execute(
+                f"SELECT key, value FROM cache WHERE key IN ({','.join('?' * len(chunk))}) "
+                'AND (expires IS NULL OR expires > ?)',
+                (*chunk, now),
+            )
+            for key, value in rows:
+                found[key_map[key]] = loads(value)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        self._connection().execute(
+            'INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+            (key, dumps(value, self.compress_min_size), self._expiry(timeout)),
+        )
+        self._maybe_cull()
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        expires = self._expiry(timeout)
+        rows = [
+            (self.make_and_validate_key(key, version=version), dumps(value, self.compress_min_size), expires)
+            for key, value in data.items()
+        ]
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany('INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)', rows)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        self._maybe_cull(len(rows))
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        # Only overwrite a row that has already expired
+        cursor = self._connection().execute(
+            'INSERT INTO cache (key, value, expires) VALUES (?, ?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires = excluded.expires '
+            'WHERE cache.expires IS NOT NULL AND cache.expires <= ?',
+            (key, dumps(value, self.compress_min_size), self._expiry(timeout), time.time()),
+        )
+        if cursor.rowcount:
+            self._maybe_cull()
+        return cursor.rowcount > 0
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        cursor = self._connection().execute(
+            'UPDATE cache SET expires = ? WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (self._expiry(timeout), key, time.time()),
+        )
+        return cursor.rowcount > 0
+
+    def incr(self, key, delta=1, version=None):
+        name = self.make_and_validate_key(key, version=version)
+        # fetchall() finishes the statement, which is what commits it
+        rows = self._connection().execute(
+            "UPDATE cache SET value = value + ? WHERE key = ? AND typeof(value) = 'integer' "
+            'AND (expires IS NULL OR expires > ?) RETURNING value',
+            (delta, name, time.time()),
+        ).fetchall()
+        if not rows:
+            raise ValueError("Key '%s' not found" % key)
+        return rows[0][0]
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self._connection().execute('DELETE FROM cache WHERE key = ?', (key,)).rowcount > 0
+
+    def delete_many(self, keys, version=None):
+        names = [(self.make_and_validate_key(key, version=version),) for key in keys]
+        self._connection().executemany('DELETE FROM cache WHERE key = ?', names)
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self._connection().execute(
+            'SELECT 1 FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (key, time.time()),
+        ).fetchone() is not None
+
+    def clear(self):
+        self._connection().execute('DELETE FROM cache')
+
+    def close(self, **kwargs):
+        # Connections are per thread and reused across requests
+        pass
+
+    def _maybe_cull(self, count=1):
+        self._writes += count
+        if self._writes < self.cull_every:
+            return
+        self._writes = 0
+        conn = self._connection()
+        conn.execute('DELETE FROM cache WHERE expires IS NOT NULL AND expires <= ?', (time.time(),))
+        total = conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        if total > self._max_entries:
+            # Oldest writes go first; a replaced row gets a new rowid
+            excess = total - self._max_entries + self._max_entries // max(self._cull_frequency, 1)
+            conn.execute(
+                'DELETE FROM cache WHERE rowid IN (SELECT rowid FROM cache ORDER BY rowid LIMIT ?)',
+                (excess,),
+            )
+
+
+class TieredCache(BaseCache):
+    """Per-process LRU in front of a shared cache alias.
+
+    Reads are served from memory when possible and fall through to the
+    ``SHARED`` cache, with ``get_many`` batching the misses into a single
+    shared lookup. Local copies live for at most ``LOCAL_TIMEOUT`` seconds
+    so writes from other workers show up quickly. Counters (``incr``,
+    ``decr``, ``add``) always go to the shared tier, where they are atomic.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.shared_alias = options.get('SHARED', location)
+        self.local_timeout = options.get('LOCAL_TIMEOUT', 2)
+        self.compress_min_size = options.get('COMPRESS_MIN_SIZE')
+        name = f'{self.shared_alias}:{self.key_prefix}'
+        self._local = _tiers.setdefault(name, OrderedDict())
+        self._lock = _tier_locks.setdefault(name, threading.Lock())
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    def get(self, key, default=None, version=None):
+        name = self.make_and_validate_key(key, version=version)
+        value = self._get_local(name)
+        if value is not _MISSING:
+            return value
+        value = self.shared.get(key, _MISSING, version=version)
+        if value is _MISSING:
+            return default
+        self._set_local(name, value, DEFAULT_TIMEOUT)
+        return value
+
+    def get_many(self, keys, version=None):
+        found = {}
+        misses = []
+        for key in keys:
+            value = self._get_local(self.make_and_validate_key(key, version=version))
+            if value is _MISSING:
+                misses.append(key)
+            else:
+                found[key] = value
+        if misses:
+            fetched = self.shared.get_many(misses, version=version)
+            for key, value in fetched.items():
+                self._set_local(self.make_key(key, version=version), value, DEFAULT_TIMEOUT)
+            found.update(fetched)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        name = self.make_and_validate_key(key, version=version)
+        self.shared.set(key, value, timeout, version=version)
+        self._set_local(name, value, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout, version=version)
+        for key, value in data.items():
+            if key not in failed:
+                self._set_local(self.make_and_validate_key(key, version=version), value, timeout)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        name = self.make_and_validate_key(key, version=version)
+        self._delete_local(name)
+        added = self.shared.add(key, value, timeout, version=version)
+        if added:
+            self._set_local(name, value, timeout)
+        return added
+
+    def incr(self, key, delta=1, version=None):
+        self._delete_local(self.make_and_validate_key(key, version=version))
+        return self.shared.incr(key, delta, version=version)
+
+    def decr(self, key, delta=1, version=None):
+        self._delete_local(self.make_and_validate_key(key, version=version))
+        return self.shared.decr(key, delta, version=version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self._delete_local(self.make_and_validate_key(key, version=version))
+        return self.shared.touch(key, timeout, version=version)
+
+    def delete(self, key, version=None):
+        self._delete_local(self.make_and_validate_key(key, version=version))
+        return self.shared.delete(key, version=version)
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self._delete_local(self.make_and_validate_key(key, version=version))
+        self.shared.delete_many(keys, version=version)
+
+    def has_key(self, key, version=None):
+        if self._get_local(self.make_and_validate_key(key, version=version)) is not _MISSING:
+            return True
+        return self.shared.has_key(key, version=version)
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+        self.shared.clear()
+
+    def _get_local(self, name):
+        with self._lock:
+            item = self._local.get(name)
+            if item is None:
+                return _MISSING
+            expires, data = item
+            if expires <= time.monotonic():
+                del self._local[name]
+                return _MISSING
+            self._local.move_to_end(name)
+        # Stored serialized so callers never share a mutable object
+        return loads(data)
+
+    def _set_local(self, name, value, timeout):
+        ttl = self.local_timeout
+        expiry = self.get_backend_timeout(timeout)
+        if expiry is not None:
+            ttl = min(ttl, expiry - time.time())
+        if ttl <= 0 or self._max_entries <= 0:
+            self._delete_local(name)
+            return
+        data = dumps(value, self.compress_min_size)
+        with self._lock:
+            self._local[name] = (time.monotonic() + ttl, data)
+            self._local.move_to_end(name)
+            while len(self._local) > self._max_entries:
+                self._local.popitem(last=False)
+
+    def _delete_local(self, name):
+        with self._lock:
+            self._local.pop(name, None)
@@ -0,0 +1,235 @@
+import logging
+import re
+import threading
+from collections import OrderedDict
+from urllib.parse import parse_qs, urlsplit
+
+from django.conf import settings
+from django.db import IntegrityError
+
+from .http_client import guarded_request
+from .models import ShortLink
+
+logger = logging.getLogger(__name__)
+
+# Every form of a TikTok link that carries the numeric id in the URL itself
+VIDEO_ID_PATTERNS = [
+    re.compile(r'/video/(\d+)'),
+    re.compile(r'/photo/(\d+)'),
+    re.compile(r'/v/(\d+)'),
+    re.compile(r'/embed(?:/v2)?/(\d+)'),
+]
+VIDEO_ID_PARAMS = ('item_id', 'share_item_id', 'aweme_id')
+NUMERIC_ID = re.compile(r'^\d{8,}$')
+
+# Hosts whose paths are opaque codes that redirect to the real video
+SHORT_HOSTS = {'vm.tiktok.com', 'vt.tiktok.com'}
+SHORT_PATH = re.compile(r'^/t/[\w-]+$')
+TIKTOK_HOST = re.compile(r'(^|\.)tiktok\.com$')
+
+
+def split(url):
+    """``urlsplit`` that tolerates links pasted without a scheme"""
+    url = url.strip()
+    if '://' not in url:
+        url = f'https://{url}'
+    return urlsplit(url)
+
+
+def is_tiktok_url(url):
+    try:
+        parts = split(url)
+        return parts.scheme in ('http', 'https') and bool(TIKTOK_HOST.search(parts.hostname or ''))
+    except ValueError:
+        return False
+
+
+def require_tiktok_url(url):
+    """Reject anything but a TikTok link or bare video id before it is fetched"""
+    if not isinstance(url, str) or not (NUMERIC_ID.match(url.strip()) or is_tiktok_url(url)):
+        raise ValueError("Not a valid TikTok URL")
+    return url
+
+
+def is_media_url(url):
+    """Whether a download or cover URL points at an allowed TikTok/TikWM CDN host"""
+    try:
+        parts = urlsplit(url)
+        host = (parts.hostname or '').lower()
+    except ValueError:
+        return False
+    return parts.scheme in ('http', 'https') and any(
+        host == allowed or host.endswith(f'.{allowed}') for allowed in settings.MEDIA_ALLOWED_HOSTS
+    )
+
+
+def require_media_url(url):
+    if not url or not is_media_url(url):
+        raise ValueError("Download URL is not on an allowed host")
+    return url
+
+
+def parse_video_id(url):
+    """The video id carried by the URL itself, without any network access"""
+    url = url.strip()
+    if NUMERIC_ID.match(url):
+        return url
+    parts = split(url)
+    for pattern in VIDEO_ID_PATTERNS:
+        match = pattern.search(parts.path)
+        if match:
+            return match.group(1)
+    query = parse_qs(parts.query)
+    for param in VIDEO_ID_PARAMS:
+        values = query.get(param)
+        if values and NUMERIC_ID.match(values[0]):
+            return values[0]
+    return None
+
+
+def short_key(url):
+    """``host/code`` for a short link, or ``None`` for any other URL.
+
+    Short codes are case-sensitive, so only the host is lowercased.
+    """
+    parts = split(url)
+    host = (parts.hostname or '').lower()
+    path = parts.path.rstrip('/')
+    if host in SHORT_HOSTS and path and path != '/':
+        return f'{host}{path}'
+    if TIKTOK_HOST.search(host) and SHORT_PATH.match(path):
+        return f'www.tiktok.com{path}'
+    return None
+
+
+def normalize_url(url):
+    """Scheme-, query- and fragment-free form of a URL with a lowercase host"""
+    parts = split(url)
+    host = (parts.hostname or '').lower()
+    if host in ('tiktok.com', 'm.tiktok.com'):
+        host = 'www.tiktok.com'
+    return f"https://{host}{parts.path.rstrip('/')}"
+
+
+class ShortLinkIndex:
+    """Maps short links to video ids, resolving each link only once.
+
+    Lookups hit a bounded in-process LRU, then the ``ShortLink`` table, and
+    only then follow the redirect upstream. Concurrent misses for the same
+    link wait for the first resolver. Ids learned any other way, such as a
+    metadata response for the short link, can be fed in with ``remember``.
+    """
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize or settings.SHORTLINK_CACHE_SIZE
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def peek(self, key):
+        """In-memory lookup only; safe to call from async code"""
+        with self._lock:
+            video_id = self._local.get(key)
+            if video_id is not None:
+                self._local.move_to_end(key)
+            return video_id
+
+    def get(self, key):
+        """Memory, then database; never touches the network"""
+        video_id = self.peek(key)
+        if video_id is not None:
+            return video_id
+        video_id = ShortLink.objects.filter(key=key).values_list('video_id', flat=True).first()
+        if video_id:
+            self._store(key, video_id)
+        return video_id
+
+    def resolve(self, key):
+        """``get``, falling back to following the redirect once"""
+        video_id = self.get(key)
+        if video_id is not None:
+            return video_id
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = threading.Event()
+        if not leader:
+            flight.wait()
+            return self.peek(key)
+
+        try:
+            # Every hop must stay on TikTok; the last one names the video
+            response = guarded_request('HEAD', f'https://{key}', is_tiktok_url)
+            response.close()
+            video_id = parse_video_id(response.url)
+            if video_id:
+                self.remember(key, video_id)
+            return video_id
+        except Exception as e:
+            logger.error(f"Error resolving short link: {str(e)}")
+            return None
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.set()
+
+    def remember(self, key, video_id):
+        if self.peek(key) == video_id:
+            return
+        self._store(key, video_id)
+        try:
+            ShortLink.objects.update_or_create(key=key, defaults={'video_id': video_id})
+        except IntegrityError:
+            # Another worker inserted it first; the mapping never changes
+            pass
+
+    def _store(self, key, video_id):
+        with self._lock:
+            self._local[key] = video_id
+            self._local.move_to_end(key)
+            while len(self._local) > self.maxsize:
+                self._local.popitem(last=False)
+
+
+short_links = ShortLinkIndex()
+
+
+def video_id_for(url, resolve=True):
+    """Canonical video id of any TikTok URL form.
+
+    Long URLs are parsed locally. Short links come from the index and are
+    only resolved over the network when ``resolve`` is set and the link has
+    never been seen before.
+    """
+    video_id = parse_video_id(url)
+    if video_id:
+        return video_id
+    key = short_key(url)
+    if key is None:
+        return None
+    return short_links.resolve(key) if resolve else short_links.get(key)
+
+
+def cache_key(url, database=True):
+    """Key every cache shares for ``url``: ``id:<video id>`` when it is known.
+
+    Never touches the network. ``database=False`` limits short-link lookups
+    to memory, for callers running on an event loop.
+    """
+    video_id = parse_video_id(url)
+    if not video_id:
+        key = short_key(url)
+        if key is not None:
+            video_id = short_links.get(key) if database else short_links.peek(key)
+    if video_id:
+        return f'id:{video_id}'
+    return f'url:{normalize_url(url)}'
+
+
+def remember(url, video_id):
+    """Record the id a metadata lookup found for a short link"""
+    key = short_key(url)
+    if key is not None and video_id and not parse_video_id(url):
+        short_links.remember(key, str(video_id))
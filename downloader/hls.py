@@ -0,0 +1,244 @@
+import bisect
+import json
+import math
+import os
+import struct
+import uuid
+
+from django.conf import settings
+
+from .mp4 import MP4Error, box, find_box, full_box, iter_boxes, read_moov, tracks
+from .storage import blob_store, file_lock
+
+# trun sample flags: sync samples depend on nothing, others are non-sync
+SYNC_FLAGS = 0x02000000
+NON_SYNC_FLAGS = 0x01010000
+
+EMPTY_SAMPLE_TABLE = (
+    full_box(b'stts', 0, 0, struct.pack('>I', 0))
+    + full_box(b'stsc', 0, 0, struct.pack('>I', 0))
+    + full_box(b'stsz', 0, 0, struct.pack('>II', 0, 0))
+    + full_box(b'stco', 0, 0, struct.pack('>I', 0))
+)
+
+
+class HlsStore:
+    """Fragmented-MP4 HLS renditions of stored videos, cut on demand.
+
+    The playlist and segment plan come from the moov alone, so building
+    them costs a few reads no matter how large the video is. Each segment
+    (``moof`` + ``mdat``) is written the first time it is requested and
+    kept under ``hls/<blob digest>/``; samples are copied, never re-encoded.
+    Segments start on video sync samples about ``segment_seconds`` apart.
+    """
+
+    def __init__(self, root=None, segment_seconds=None):
+        self._root = root
+        self.segment_seconds = segment_seconds or settings.HLS_SEGMENT_SECONDS
+
+    @property
+    def root(self):
+        return self._root or os.path.join(settings.MEDIA_ROOT, 'hls')
+
+    def playlist(self, filename):
+        """Path of the ``index.m3u8`` for a stored MP4"""
+        path = os.path.join(self._directory(filename), 'index.m3u8')
+        if not os.path.exists(path):
+            plan = self._plan(filename)
+            lines = [
+                '#EXTM3U',
+                '#EXT-X-VERSION:7',
+                f"#EXT-X-TARGETDURATION:{max(1, math.ceil(max(s['duration'] for s in plan['segments'])))}",
+                '#EXT-X-MEDIA-SEQUENCE:0',
+                '#EXT-X-PLAYLIST-TYPE:VOD',
+                '#EXT-X-INDEPENDENT-SEGMENTS',
+                '#EXT-X-MAP:URI="init.mp4"',
+            ]
+            for number, segment in enumerate(plan['segments']):
+                lines.append(f"#EXTINF:{segment['duration']:.3f},")
+                lines.append(f'{number}.m4s')
+            lines.append('#EXT-X-ENDLIST')
+            _write(path, ('\n'.join(lines) + '\n').encode())
+        return path
+
+    def init_segment(self, filename):
+        """Path of the ``ftyp`` + ``moov`` initialization segment"""
+        path = os.path.join(self._directory(filename), 'init.mp4')
+        if os.path.exists(path):
+            return path
+        with file_lock(path):
+            if not os.path.exists(path):
+                with open(blob_store.path(filename), 'rb') as f:
+                    moov = read_moov(f)
+                _write(path, _init_segment(moov, _media_tracks(moov)))
+        return path
+
+    def segment(self, filename, number):
+        """Path of media segment ``number``, cutting it on first use"""
+        path = os.path.join(self._directory(filename), f'{number}.m4s')
+        if os.path.exists(path):
+            return path
+        plan = self._plan(filename)
+        if not 0 <= number < len(plan['segments']):
+            raise ValueError("No such segment")
+        with file_lock(path):
+            if not os.path.exists(path):
+                with open(blob_store.path(filename), 'rb') as f:
+                    moov = read_moov(f)
+                    parts = []
+                    for track in _media_tracks(moov):
+                        first, last = plan['segments'][number]['tracks'][str(track.track_id)]
+                        samples = track.samples()
+                        base_time = sum(sample[2] for sample in samples[:first])
+                        parts.append((track, samples[first:last], base_time))
+                    _write(path, _fragment(f, number + 1, parts))
+        return path
+
+    def _directory(self, filename):
+        source = blob_store.local_path(filename)
+        if not os.path.exists(source):
+            raise FileNotFoundError(filename)
+        # Keyed by content so a re-downloaded file never reuses old segments
+        key = blob_store.digest(filename)
+        if not key:
+            stat = os.stat(source)
+            key = f'{os.path.splitext(filename)[0]}-{stat.st_size:x}-{int(stat.st_mtime):x}'
+        return os.path.join(self.root, key)
+
+    def _plan(self, filename):
+        """Segment durations and sample ranges, computed once per file"""
+        path = os.path.join(self._directory(filename), 'plan.json')
+        if not os.path.exists(path):
+            with file_lock(path):
+                if not os.path.exists(path):
+                    with open(blob_store.path(filename), 'rb') as f:
+                        moov = read_moov(f)
+                    _write(path, json.dumps(_plan(_media_tracks(moov), self.segment_seconds)).encode())
+        with open(path) as f:
+            return json.load(f)
+
+
+def _media_tracks(moov):
+    found = [track for track in tracks(moov) if track.handler in (b'vide', b'soun')]
+    if not found:
+        raise MP4Error("No audio or video track")
+    return found
+
+
+def _plan(media_tracks, segment_seconds):
+    """Cut points on video sync samples, with every track's samples assigned"""
+    timeline = {}
+    for track in media_tracks:
+        samples = track.samples()
+        starts = []
+        elapsed = 0
+        for sample in samples:
+            starts.append(elapsed / track.timescale)
+            elapsed += sample[2]
+        timeline[track.track_id] = (samples, starts, elapsed / track.timescale)
+
+    lead = next((t for t in media_tracks if t.handler == b'vide'), media_tracks[0])
+    samples, starts, total = timeline[lead.track_id]
+    cuts = [0.0]
+    for sample, start in zip(samples, starts):
+        if sample[4] and start - cuts[-1] >= segment_seconds:
+            cuts.append(start)
+    ends = cuts[1:] + [max(total for _, _, total in timeline.values())]
+
+    segments = []
+    for start, end in zip(cuts, ends):
+        ranges = {}
+        for track_id, (_, track_starts, _) in timeline.items():
+            first = bisect.bisect_left(track_starts, start)
+            last = len(track_starts) if end == ends[-1] else bisect.bisect_left(track_starts, end)
+            ranges[str(track_id)] = [first, last]
+        segments.append({'duration': end - start, 'tracks': ranges})
+    return {'segments': segments}
+
+
+def _init_segment(moov, media_tracks):
+    mvhd = find_box(moov, [b'mvhd'], 8)
+    traks = b''.join(
+        box(b'trak', _strip_samples(moov, track.start, track.end)) for track in media_tracks
+    )
+    trex = b''.join(
+        full_box(b'trex', 0, 0, struct.pack('>IIIII', track.track_id, 1, 0, 0, 0))
+        for track in media_tracks
+    )
+    ftyp = box(b'ftyp', b'iso6', struct.pack('>I', 0), b'iso6', b'iso5', b'mp41')
+    return ftyp + box(b'moov', box(b'mvhd', moov[mvhd[0]:mvhd[1]]), traks, box(b'mvex', trex))
+
+
+def _strip_samples(data, start, end):
+    """A trak's children with every sample table emptied, for fragmented use"""
+    out = []
+    for kind, payload, box_end in iter_boxes(data, start, end):
+        if kind in (b'mdia', b'minf'):
+            out.append(box(kind, _strip_samples(data, payload, box_end)))
+        elif kind == b'stbl':
+            stsd = find_box(data, [b'stsd'], payload, box_end)
+            out.append(box(b'stbl', box(b'stsd', data[stsd[0]:stsd[1]]), EMPTY_SAMPLE_TABLE))
+        else:
+            out.append(box(kind, data[payload:box_end]))
+    return b''.join(out)
+
+
+def _fragment(f, sequence, parts):
+    """One ``moof`` + ``mdat`` holding each track's samples in turn"""
+    def moof(data_offsets):
+        trafs = []
+        for (track, samples, base_time), data_offset in zip(parts, data_offsets):
+            entries = b''.join(
+                struct.pack('>IIIi', duration, size, SYNC_FLAGS if sync else NON_SYNC_FLAGS, composition)
+                for _, size, duration, composition, sync in samples
+            )
+            trafs.append(box(
+                b'traf',
+                # default-base-is-moof: data offsets count from the moof start
+                full_box(b'tfhd', 0, 0x020000, struct.pack('>I', track.track_id)),
+                full_box(b'tfdt', 1, 0, struct.pack('>Q', base_time)),
+                # data offset, then duration, size, flags and composition per sample
+                full_box(b'trun', 1, 0x000F01, struct.pack('>Ii', len(samples), data_offset), entries),
+            ))
+        return box(b'moof', full_box(b'mfhd', 0, 0, struct.pack('>I', sequence)), *trafs)
+
+    sizes = [sum(sample[1] for sample in samples) for _, samples, _ in parts]
+    moof_size = len(moof([0] * len(parts)))
+    data_offsets = []
+    position = moof_size + 8
+    for size in sizes:
+        data_offsets.append(position)
+        position += size
+
+    payload = []
+    for _, samples, _ in parts:
+        payload.extend(_read_samples(f, samples))
+    return moof(data_offsets) + box(b'mdat', *payload)
+
+
+def _read_samples(f, samples):
+    """Sample bytes in order, reading contiguous runs at once"""
+    index = 0
+    while index < len(samples):
+        offset, size = samples[index][0], samples[index][1]
+        end = index + 1
+        while end < len(samples) and samples[end][0] == offset + size:
+            size += samples[end][1]
+            end += 1
+        f.seek(offset)
+        data = f.read(size)
+        if len(data) != size:
+            raise MP4Error("Truncated media data")
+        yield data
+        index = end
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+hls_store = HlsStore()
@@ -0,0 +1,211 @@
+import asyncio
+import functools
+import http.cookiejar
+import logging
+import threading
+import weakref
+from contextlib import asynccontextmanager
+from urllib.parse import urljoin
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+_session = None
+_session_lock = threading.Lock()
+_async_sessions = weakref.WeakKeyDictionary()
+
+
+class NoCookies(http.cookiejar.DefaultCookiePolicy):
+    """Refuse every cookie.
+
+    The session is shared by all requests of the process, so a cookie set
+    while serving one user's URL would otherwise be sent with everyone's.
+    """
+
+    def set_ok(self, cookie, request):
+        return False
+
+    def return_ok(self, cookie, request):
+        return False
+
+
+@functools.lru_cache(maxsize=None)
+def session_class():
+    """requests.Session subclass that applies the configured default timeout.
+
+    requests, urllib3 and certifi take longer to import than the rest of
+    the app, so they load with the first session instead of with the views.
+    """
+    import requests
+
+    class UpstreamSession(requests.Session):
+        def request(self, method, url, **kwargs):
+            kwargs.setdefault(
+                'timeout', (settings.UPSTREAM_CONNECT_TIMEOUT, settings.UPSTREAM_TIMEOUT)
+            )
+            return super().request(method, url, **kwargs)
+
+    return UpstreamSession
+
+
+@functools.lru_cache(maxsize=None)
+def retry_class():
+    """urllib3 Retry that waits at most UPSTREAM_MAX_RETRY_AFTER seconds.
+
+    An upstream asking for a long Retry-After would otherwise hold the
+    worker thread, and the client, for that long.
+    """
+    from urllib3.util.retry import Retry
+
+    class CappedRetry(Retry):
+        def get_retry_after(self, response):
+            retry_after = super().get_retry_after(response)
+            if retry_after is None:
+                return None
+            return min(retry_after, settings.UPSTREAM_MAX_RETRY_AFTER)
+
+    return CappedRetry
+
+
+def _adapter(pool_size, retry_methods):
+    from requests.adapters import HTTPAdapter
+
+    retry = retry_class()(
+        total=settings.UPSTREAM_RETRIES,
+        backoff_factor=settings.UPSTREAM_BACKOFF,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=retry_methods,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    return HTTPAdapter(
+        pool_connections=settings.UPSTREAM_POOL_HOSTS,
+        pool_maxsize=pool_size,
+        max_retries=retry,
+    )
+
+
+def build_session():
+    """A keep-alive session with per-host connection pools and retries"""
+    from urllib3.util.retry import Retry
+
+    session = session_class()()
+    session.headers['User-Agent'] = USER_AGENT
+    session.cookies.set_policy(NoCookies())
+    # Anything not listed (the video CDNs) shares the default pools
+    default = _adapter(settings.UPSTREAM_DEFAULT_POOL_SIZE, Retry.DEFAULT_ALLOWED_METHODS)
+    session.mount('https://', default)
+    session.mount('http://', default)
+    for prefix, pool_size in settings.UPSTREAM_POOLS.items():
+        # API lookups are read-only, so POSTs to them are safe to retry
+        session.mount(prefix, _adapter(pool_size, Retry.DEFAULT_ALLOWED_METHODS | {'POST'}))
+    return session
+
+
+def get_session():
+    """Process-wide upstream session, shared by every thread.
+
+    urllib3's pools are thread-safe, so all views, jobs and the
+    TikTokDownloader reuse the same warm TCP+TLS connections.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = build_session()
+    return _session
+
+
+def get_async_session():
+    """Shared aiohttp.ClientSession for the running event loop.
+
+    aiohttp sessions are bound to the loop they were created on, so one
+    pooled session is kept per loop. Under uvicorn that is one per worker.
+    """
+    import aiohttp
+
+    loop = asyncio.get_running_loop()
+    session = _async_sessions.get(loop)
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(
+            headers={'User-Agent': USER_AGENT},
+            timeout=aiohttp.ClientTimeout(
+                total=None,
+                connect=settings.UPSTREAM_CONNECT_TIMEOUT,
+                sock_read=settings.UPSTREAM_TIMEOUT,
+            ),
+            connector=aiohttp.TCPConnector(
+                limit=settings.UPSTREAM_MAX_CONNECTIONS,
+                limit_per_host=settings.UPSTREAM_MAX_CONNECTIONS_PER_HOST,
+                ttl_dns_cache=300,
+            ),
+            # Shared by every request on the loop, like the sync session
+            cookie_jar=aiohttp.DummyCookieJar(),
+        )
+        _async_sessions[loop] = session
+    return session
+
+
+async def close_async_session():
+    """Close the pooled session of the running loop, e.g. on shutdown"""
+    session = _async_sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+def guarded_request(method, url, allowed, session=None, **kwargs):
+    """Request that only ever connects to URLs ``allowed`` accepts.
+
+    Redirects are followed by hand so every hop is checked before it is
+    fetched; a URL from user input or upstream metadata can then never
+    reach an internal host, not even by bouncing off an allowed one.
+    """
+    session = session or get_session()
+    kwargs['allow_redirects'] = False
+    for _ in range(MAX_REDIRECTS + 1):
+        if not allowed(url):
+            raise ValueError("Refusing to fetch a URL outside the allowed hosts")
+        response = session.request(method, url, **kwargs)
+        location = response.headers.get('Location')
+        if response.status_code not in REDIRECT_STATUSES or not location:
+            return response
+        response.close()
+        url = urljoin(url, location)
+        if response.status_code == 303:
+            method = 'GET'
+    raise ValueError("Too many redirects")
+
+
+async def aguarded_request(method, url, allowed, **kwargs):
+    """Async ``guarded_request`` on the pooled aiohttp session.
+
+    The caller releases the returned response, or uses ``aguarded_get``.
+    """
+    session = get_async_session()
+    for _ in range(MAX_REDIRECTS + 1):
+        if not allowed(url):
+            raise ValueError("Refusing to fetch a URL outside the allowed hosts")
+        response = await session.request(method, url, allow_redirects=False, **kwargs)
+        location = response.headers.get('Location')
+        if response.status not in REDIRECT_STATUSES or not location:
+            return response
+        response.release()
+        url = urljoin(url, location)
+        if response.status == 303:
+            method = 'GET'
+    raise ValueError("Too many redirects")
+
+
+@asynccontextmanager
+async def aguarded_get(url, allowed, **kwargs):
+    response = await aguarded_request('GET', url, allowed, **kwargs)
+    try:
+        yield response
+    finally:
+        response.release()
@@ -0,0 +1,149 @@
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections
+
+from .progress import progress_hub
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Finer-grained than status: what a running job is doing right now
+RESOLVING = 'resolving'
+DOWNLOADING = 'downloading'
+
+
+class JobQueue:
+    """Background download jobs with status kept in the shared cache.
+
+    Jobs run on a per-process thread pool, but their state lives in the
+    Django cache so any worker can answer a status poll. Submitting a job
+    whose ``key`` matches one that is still pending returns the pending job
+    instead of starting a second download. Every state change is also
+    published to the in-process ``progress_hub`` for event-stream watchers.
+    """
+
+    def __init__(self, max_workers=None, ttl=None, alias=None):
+        self.max_workers = max_workers or getattr(settings, 'DOWNLOAD_JOB_WORKERS', 4)
+        self.ttl = ttl or getattr(settings, 'DOWNLOAD_JOB_TTL', 3600)
+        self.alias = alias or getattr(settings, 'DOWNLOAD_JOB_CACHE_ALIAS', 'default')
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    self.max_workers, thread_name_prefix='download-job'
+                )
+            return self._executor
+
+    def submit(self, key, task, *args, **kwargs):
+        """Queue ``task(*args, progress=..., **kwargs)`` unless ``key`` is pending.
+
+        ``task`` must return a dict that is merged into the finished job,
+        typically ``{'download_url': ...}``.
+        """
+        job_id = uuid.uuid4().hex
+        active_key = f'job:active:{key}'
+        if not self.cache.add(active_key, job_id, self.ttl):
+            existing = self.get(self.cache.get(active_key))
+            if existing and existing['status'] in (QUEUED, RUNNING):
+                return existing
+            self.cache.set(active_key, job_id, self.ttl)
+
+        job = {
+            'id': job_id,
+            'status': QUEUED,
+            'phase': QUEUED,
+            'bytes': 0,
+            'total': None,
+            'rate': None,
+            'eta': None,
+            'created': time.time(),
+        }
+        self._save(job)
+        # The worker mutates its copy; the caller's snapshot stays as queued
+        self.executor.submit(self._run, dict(job), active_key, task, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        if not job_id:
+            return None
+        return self.cache.get(f'job:{job_id}')
+
+    async def aget(self, job_id):
+        if not job_id:
+            return None
+        return await self.cache.aget(f'job:{job_id}')
+
+    def _run(self, job, active_key, task, args, kwargs):
+        job['status'] = RUNNING
+        job['phase'] = RESOLVING
+        self._save(job)
+        try:
+            result = task(*args, progress=self._progress(job), **kwargs)
+            job.update(result or {})
+            job['status'] = job['phase'] = DONE
+        except Exception as e:
+            logger.error(f"Download job {job['id']} failed: {str(e)}")
+            job['status'] = job['phase'] = FAILED
+            job['message'] = str(e)
+        finally:
+            job['eta'] = None
+            self._save(job)
+            if self.cache.get(active_key) == job['id']:
+                self.cache.delete(active_key)
+            close_old_connections()
+
+    def _progress(self, job):
+        # Watchers in this process hear about every few hundred ms of
+        # progress; the shared cache is written less often
+        state = {'published': 0.0, 'saved': 0.0, 'sampled': None, 'bytes': 0}
+
+        def report(done, total=None):
+            now = time.monotonic()
+            job['phase'] = DOWNLOADING
+            job['bytes'] = done
+            job['total'] = total
+            if state['sampled'] is None:
+                # The rate is measured from the first byte, not from job start
+                state['sampled'] = now
+                state['bytes'] = done
+            elapsed = now - state['sampled']
+            if elapsed >= 0.25:
+                rate = (done - state['bytes']) / elapsed
+                # Smoothed so one slow chunk does not swing the ETA around
+                job['rate'] = round(rate if job['rate'] is None else 0.3 * rate + 0.7 * job['rate'])
+                job['eta'] = round((total - done) / job['rate'], 1) if total and job['rate'] else None
+                state['sampled'] = now
+                state['bytes'] = done
+            if now - state['saved'] >= 0.5:
+                state['saved'] = state['published'] = now
+                self._save(job)
+            elif now - state['published'] >= settings.PROGRESS_PUBLISH_INTERVAL:
+                state['published'] = now
+                progress_hub.publish(job['id'], dict(job))
+
+        return report
+
+    def _save(self, job):
+        self.cache.set(f"job:{job['id']}", dict(job), self.ttl)
+        progress_hub.publish(job['id'], dict(job), final=job['status'] in (DONE, FAILED))
+
+
+job_queue = JobQueue()
@@ -0,0 +1,64 @@
+import os
+import tempfile
+import time
+
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+
+class Command(BaseCommand):
+    help = 'Compare the tiered cache backend with the file-based cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ops', type=int, default=2000)
+        parser.add_argument('--keys', type=int, default=500)
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as work_dir:
+            backends = {
+                'file': {
+                    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                    'LOCATION': os.path.join(work_dir, 'file'),
+                    'OPTIONS': {'MAX_ENTRIES': 100000},
+                },
+                'sqlite': {
+                    'BACKEND': 'downloader.cache_backends.SQLiteCache',
+                    'LOCATION': os.path.join(work_dir, 'cache.sqlite3'),
+                    'OPTIONS': {'MAX_ENTRIES': 100000},
+                },
+                'tiered': {
+                    'BACKEND': 'downloader.cache_backends.TieredCache',
+                    'OPTIONS': {'SHARED': 'sqlite', 'MAX_ENTRIES': 10000, 'LOCAL_TIMEOUT': 2},
+                },
+            }
+            with override_settings(CACHES={'default': backends['file'], **backends}):
+                self.stdout.write(f"{options['ops']} ops per test, {options['keys']} keys, ops/s")
+                self.stdout.write(f"{'backend':<8} {'set':>9} {'get':>9} {'get_many':>9} {'incr':>9}")
+                for name in ('file', 'sqlite', 'tiered'):
+                    self._run(name, caches[name], options['ops'], options['keys'])
+
+    def _run(self, name, cache, ops, keys):
+        value = {
+            'id': '7300000000000000000', 'title': 'Benchmark video ' * 4, 'author': 'bench',
+            'download_urls': {'hd': 'https://example.com/' + 'x' * 200, 'sd': '', 'audio': ''},
+        }
+        names = [f'bench:{i}' for i in range(keys)]
+        results = [
+            self._rate(ops, lambda i: cache.set(names[i % keys], value, 300)),
+            self._rate(ops, lambda i: cache.get(names[i % keys])),
+            # 20 keys per call, counted per key
+            self._rate(ops // 20, lambda i: cache.get_many(names[i % (keys - 20):i % (keys - 20) + 20])) * 20,
+            self._incr_rate(cache, ops),
+        ]
+        self.stdout.write(f'{name:<8} ' + ' '.join(f'{rate:>9.0f}' for rate in results))
+
+    def _incr_rate(self, cache, ops):
+        cache.set('bench:counter', 0, 300)
+        return self._rate(ops, lambda i: cache.incr('bench:counter'))
+
+    def _rate(self, ops, operation):
+        start = time.perf_counter()
+        for i in range(ops):
+            operation(i)
+        return ops / (time.perf_counter() - start)
@@ -0,0 +1,100 @@
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from downloader.accounting import download_stats
+from downloader.bench.s3 import FakeS3
+from downloader.bench.scenarios import SCENARIOS, peak_rss, run_asgi, run_wsgi
+from downloader.bench.upstream import FakeUpstream
+
+
+class Command(BaseCommand):
+    help = 'Run load scenarios against the WSGI and ASGI paths with a local fake upstream'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', nargs='+', choices=sorted(SCENARIOS) + ['all'],
+                            default=['unique'])
+        parser.add_argument('--entry', choices=['wsgi', 'asgi', 'both'], default='both')
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=100,
+                            help='In-flight requests for the ASGI path')
+        parser.add_argument('--wsgi-workers', type=int, default=8,
+                            help='Worker threads for the WSGI path')
+        parser.add_argument('--latency', type=float, default=0.2,
+                            help='Upstream latency in seconds')
+        parser.add_argument('--payload-kb', type=int, help='Override the scenario file size')
+        parser.add_argument('--bandwidth-mb', type=float,
+                            help='Override the per-connection upstream bandwidth in MB/s')
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help='Fraction of upstream responses that are 503s')
+        parser.add_argument('--drop-rate', type=float, default=0.0,
+                            help='Fraction of upstream media bodies cut off halfway')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--storage', choices=['local', 's3'], default='local',
+                            help='Publish downloads to a local fake S3 bucket as well')
+
+    def handle(self, *args, **options):
+        names = sorted(SCENARIOS) if 'all' in options['scenario'] else options['scenario']
+        entries = ['wsgi', 'asgi'] if options['entry'] == 'both' else [options['entry']]
+
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        work_dir = tempfile.TemporaryDirectory()
+        # A file database, since in-memory SQLite locks whole tables
+        connection.settings_dict['TEST']['NAME'] = os.path.join(work_dir.name, 'bench.sqlite3')
+        connection.creation.create_test_db(verbosity=0)
+        s3 = FakeS3().start() if options['storage'] == 's3' else None
+        try:
+            with override_settings(
+                RATELIMIT_ENABLE=False,
+                RATELIMIT_IP_HEADER='X-Forwarded-For',
+                RATELIMIT_TRUSTED_PROXIES=['127.0.0.1'],
+                MEDIA_ROOT=work_dir.name,
+                CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                # Files are still served here, so the bench times uploads, not redirects
+                **(s3.settings(STORAGE_REDIRECT=False) if s3 else {}),
+            ):
+                self.stdout.write(
+                    f"{options['requests']} requests, upstream latency {options['latency'] * 1000:.0f} ms, "
+                    f"errors {options['error_rate']:.0%}, drops {options['drop_rate']:.0%}"
+                )
+                run = 0
+                for name in names:
+                    for entry in entries:
+                        run += 1
+                        self.stdout.write(self._run(SCENARIOS[name], entry, run, options))
+                self.stdout.write(f'peak rss {peak_rss() / (1024 * 1024):.1f} MB')
+                if s3:
+                    calls = ', '.join(f'{method} {count}' for method, count in sorted(s3.requests.items()))
+                    self.stdout.write(f'storage requests {calls}, objects {len(s3.objects)}')
+        finally:
+            if s3:
+                s3.stop()
+            download_stats.flush()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            work_dir.cleanup()
+
+    def _run(self, scenario, entry, run, options):
+        payload_kb = options['payload_kb'] or scenario.payload_kb
+        bandwidth_mb = options['bandwidth_mb'] or scenario.bandwidth_mb
+        upstream = FakeUpstream(
+            options['latency'], payload_kb * 1024,
+            bandwidth=bandwidth_mb * 1024 * 1024 if bandwidth_mb else None,
+            error_rate=options['error_rate'], drop_rate=options['drop_rate'], seed=options['seed'],
+        )
+        # Each run gets its own id range so nothing is cached from the last one
+        video_ids = scenario.video_ids(options['requests'], run * 10 ** 12, options['seed'])
+        urls = [f'https://www.tiktok.com/@bench/video/{video_id}' for video_id in video_ids]
+        with upstream, override_settings(
+            TIKWM_API_URL=upstream.api_url, TIKTOK_RESOLVERS=['tikwm'], MEDIA_ALLOWED_HOSTS=['127.0.0.1'],
+        ):
+            if entry == 'wsgi':
+                result = run_wsgi(scenario, urls, payload_kb * 1024, options['wsgi_workers'], upstream)
+            else:
+                result = run_asgi(scenario, urls, payload_kb * 1024, options['concurrency'], upstream)
+        return result.line()
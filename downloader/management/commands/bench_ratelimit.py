@@ -0,0 +1,77 @@
+import time
+
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+
+from downloader.bench.stats import percentile
+from downloader.middleware import RateLimitMiddleware
+
+
+class Command(BaseCommand):
+    help = 'Measure per-request rate limiter overhead as client history grows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=10000)
+        parser.add_argument('--history', type=int, nargs='+', default=[0, 1000, 10000])
+        parser.add_argument('--cache', default='locmem',
+                            help="'locmem' or the alias of a configured cache")
+
+    def handle(self, *args, **options):
+        caches_setting = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        alias = 'default'
+        if options['cache'] != 'locmem':
+            alias = options['cache']
+            caches_setting = None
+
+        policies = [{'name': 'bench', 'path': '/api/', 'limit': 10 ** 9, 'window': 3600}]
+        overrides = {'RATELIMIT_ENABLE': True, 'RATELIMIT_USE_CACHE': alias, 'RATELIMIT_POLICIES': policies}
+        if caches_setting:
+            overrides['CACHES'] = caches_setting
+
+        with override_settings(**overrides):
+            middleware = RateLimitMiddleware(lambda request: HttpResponse())
+            request = RequestFactory().post('/api/process/')
+            budget = 1e6 / 10000
+            self.stdout.write(
+                f"{options['requests']} requests per run, budget at 10k RPS: {budget:.0f} us/request"
+            )
+
+            for history in options['history']:
+                caches[alias].clear()
+                request.META['REMOTE_ADDR'] = f'10.0.0.{history % 250}'
+                for _ in range(history):
+                    middleware(request)
+                self._report('sliding', history, [
+                    self._time(middleware, request) for _ in range(options['requests'])
+                ])
+
+            # The timestamp-list approach this limiter replaced, for comparison
+            for history in options['history']:
+                cache = caches[alias]
+                cache.set('legacy', [time.time()] * history, 3600)
+                runs = min(options['requests'], 1000)
+                self._report('list', history, [self._legacy(cache) for _ in range(runs)])
+
+    def _time(self, middleware, request):
+        start = time.perf_counter()
+        middleware(request)
+        return time.perf_counter() - start
+
+    def _legacy(self, cache):
+        start = time.perf_counter()
+        requests = cache.get('legacy', [])
+        now = time.time()
+        requests = [req for req in requests if now - req < 3600]
+        requests.append(now)
+        cache.set('legacy', requests[-10000:], 3600)
+        return time.perf_counter() - start
+
+    def _report(self, name, history, latencies):
+        self.stdout.write(
+            f'{name:<8} history {history:>6}  '
+            f'p50 {percentile(latencies, 50) * 1e6:>8.1f} us  '
+            f'p99 {percentile(latencies, 99) * 1e6:>8.1f} us  '
+            f'max {1 / (sum(latencies) / len(latencies)):>10.0f} req/s'
+        )
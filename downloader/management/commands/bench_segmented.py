@@ -0,0 +1,52 @@
+import os
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from downloader.bench.upstream import FakeUpstream
+from downloader.http_client import get_session
+from downloader.segmented import SegmentedDownloader
+
+
+class Command(BaseCommand):
+    help = 'Compare the single-stream download loop with segmented Range downloads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size-mb', type=int, default=16)
+        parser.add_argument('--bandwidth-mb', type=float, default=4.0,
+                            help='Per-connection upstream bandwidth in MB/s')
+        parser.add_argument('--latency', type=float, default=0.05)
+        parser.add_argument('--segments', type=int, nargs='+', default=[2, 4, 8])
+
+    def handle(self, *args, **options):
+        size = options['size_mb'] * 1024 * 1024
+        bandwidth = options['bandwidth_mb'] * 1024 * 1024
+        with FakeUpstream(options['latency'], size, bandwidth) as upstream, \
+                tempfile.TemporaryDirectory() as work_dir:
+            url = f'{upstream.base_url}/video/1.mp4'
+            self.stdout.write(
+                f"{options['size_mb']} MB file, {options['bandwidth_mb']} MB/s per connection"
+            )
+
+            dest = os.path.join(work_dir, 'single.mp4')
+            start = time.perf_counter()
+            response = get_session().get(url, stream=True)
+            with open(dest, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=8192):
+                    f.write(chunk)
+            self._report('single', start, dest, size)
+
+            for segments in options['segments']:
+                dest = os.path.join(work_dir, f'segmented_{segments}.mp4')
+                start = time.perf_counter()
+                SegmentedDownloader(segments=segments).download(url, dest)
+                self._report(f'{segments} segments', start, dest, size)
+
+    def _report(self, name, start, dest, size):
+        elapsed = time.perf_counter() - start
+        ok = os.path.getsize(dest) == size
+        self.stdout.write(
+            f'{name:<12} {elapsed:>7.2f} s  {size / elapsed / (1024 * 1024):>7.1f} MB/s  '
+            f'{"ok" if ok else "SIZE MISMATCH"}'
+        )
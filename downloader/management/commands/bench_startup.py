@@ -0,0 +1,52 @@
+import os
+import subprocess
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from downloader.bench.startup import ENTRIES, import_profile, run_probe
+from downloader.bench.stats import percentile
+
+
+class Command(BaseCommand):
+    help = 'Time cold starts of manage.py, wsgi.py and asgi.py in fresh interpreters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entry', choices=list(ENTRIES) + ['all'], default='all')
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--budget-ms', type=int,
+                            help='Fail when a median cold start exceeds this (default STARTUP_BUDGET_MS)')
+        parser.add_argument('--top', type=int, default=10,
+                            help='Packages to list from the import-time profile, 0 to skip it')
+        parser.add_argument('--preload', action='store_true',
+                            help='Start the servers with STARTUP_PRELOAD enabled')
+
+    def handle(self, *args, **options):
+        entries = ENTRIES if options['entry'] == 'all' else [options['entry']]
+        budget = options['budget_ms'] or settings.STARTUP_BUDGET_MS
+        env = dict(os.environ, STARTUP_PRELOAD='true' if options['preload'] else 'false')
+        cwd = str(settings.BASE_DIR)
+
+        over = []
+        for entry in entries:
+            try:
+                runs = [run_probe(entry, cwd, env) for _ in range(options['runs'])]
+            except subprocess.CalledProcessError as e:
+                raise CommandError(f'{entry} failed to start:\n{e.stderr.strip()}')
+            total = percentile([run['total'] for run in runs], 50) * 1000
+            ready = percentile([run['ready'] for run in runs], 50) * 1000
+            first = percentile([run['first_request'] for run in runs], 50) * 1000
+            self.stdout.write(
+                f'{entry:<8} total {total:>7.1f} ms  app load {ready:>7.1f} ms  '
+                f"first request {first:>7.1f} ms  modules {runs[0]['modules']}  status {runs[0]['status']}"
+            )
+            if total > budget:
+                over.append(f'{entry} {total:.0f} ms')
+
+            if options['top']:
+                for package, seconds in import_profile(entry, cwd, env)[:options['top']]:
+                    self.stdout.write(f'    {package:<28} {seconds * 1000:>7.1f} ms')
+
+        if over:
+            raise CommandError(f"Cold start over the {budget} ms budget: {', '.join(over)}")
+        self.stdout.write(self.style.SUCCESS(f'All cold starts within {budget} ms'))
@@ -0,0 +1,30 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from downloader.storage import blob_store
+
+
+class Command(BaseCommand):
+    help = 'Fold duplicate files in media/downloads into the content-addressed blob store'
+
+    def handle(self, *args, **options):
+        if not os.path.isdir(blob_store.root):
+            self.stdout.write('Nothing to do')
+            return
+
+        blobs = set()
+        reclaimed = 0
+        for entry in os.scandir(blob_store.root):
+            if not entry.is_file() or not entry.name.endswith('.mp4'):
+                continue
+            if entry.stat().st_nlink > 1:
+                continue
+            digest = blob_store.adopt(entry.name)
+            if digest in blobs:
+                reclaimed += entry.stat().st_size
+            blobs.add(digest)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(blobs)} distinct blobs, {reclaimed / (1024 * 1024):.1f} MB reclaimed'
+        ))
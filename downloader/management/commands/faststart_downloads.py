@@ -0,0 +1,53 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from downloader.models import VideoDownload
+from downloader.mp4 import MP4Error, faststart, needs_faststart
+from downloader.storage import blob_store
+
+
+class Command(BaseCommand):
+    help = 'Rewrite stored MP4s whose moov comes after the media so they play progressively'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='List the files that need rewriting without touching them')
+
+    def handle(self, *args, **options):
+        if not os.path.isdir(blob_store.root):
+            self.stdout.write('Nothing to do')
+            return
+
+        rewritten = 0
+        for entry in os.scandir(blob_store.root):
+            if not entry.is_file() or not entry.name.endswith('.mp4'):
+                continue
+            key = blob_store.parse_filename(entry.name)
+            if not key or not needs_faststart(entry.path):
+                continue
+            if options['dry_run']:
+                self.stdout.write(entry.name)
+                rewritten += 1
+                continue
+
+            tmp_path = blob_store.partial_path(*key) + '.faststart'
+            os.makedirs(blob_store.tmp_dir, exist_ok=True)
+            try:
+                faststart(entry.path, tmp_path)
+            except (MP4Error, OSError) as e:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                self.stderr.write(f'{entry.name}: {str(e)}')
+                continue
+            # The old blob loses this link and is left for reap_downloads
+            filename, digest = blob_store.ingest(*key, tmp_path)
+            VideoDownload.objects.filter(video_id=key[0], quality=key[1]).update(
+                content_hash=digest, file_path=blob_store.blob_path(digest),
+            )
+            self.stdout.write(filename)
+            rewritten += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{rewritten} files {'need' if options['dry_run'] else 'rewritten for'} faststart"
+        ))
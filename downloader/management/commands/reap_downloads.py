@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from downloader.reaper import StorageReaper
+
+
+class Command(BaseCommand):
+    help = 'Evict expired and over-quota downloads, orphaned blobs, stale scratch files, HLS renditions and thumbnails'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would be removed without removing it')
+        parser.add_argument('--max-age', type=int, help='Seconds since last access (default REAPER_MAX_AGE)')
+        parser.add_argument('--quota-mb', type=int, help='Disk quota in MB (default REAPER_QUOTA_BYTES)')
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Keep running, one pass every INTERVAL seconds')
+
+    def handle(self, *args, **options):
+        quota = options['quota_mb'] * 1024 * 1024 if options['quota_mb'] is not None else None
+        reaper = StorageReaper(max_age=options['max_age'], quota=quota)
+        while True:
+            start = time.monotonic()
+            report = reaper.run(dry_run=options['dry_run'])
+            for line in report.lines():
+                self.stdout.write(line)
+            self.stdout.write(self.style.SUCCESS(
+                f"{'Dry run' if options['dry_run'] else 'Pass'} finished in {time.monotonic() - start:.2f} s"
+            ))
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,226 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Registry:
+    """Process-wide metrics with lock-free per-thread aggregation.
+
+    Each thread updates only its own dict, so recording a sample takes no
+    lock; ``render()`` sums the per-thread values when ``/metrics`` is
+    scraped. Values are per process; scrape every worker or sum them in
+    Prometheus.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._metrics = {}
+        self._collectors = []
+
+    def _values(self):
+        try:
+            return self._local.values
+        except AttributeError:
+            values = self._local.values = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), values))
+            return values
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter(self, name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self, name, documentation, labels, buckets))
+
+    def collector(self, func):
+        """Register ``func()`` yielding ``(name, type, help, [(labels dict, value)])``"""
+        self._collectors.append(func)
+        return func
+
+    def _register(self, metric):
+        with self._lock:
+            self._metrics.setdefault(metric.name, metric)
+        return self._metrics[metric.name]
+
+    def merged(self):
+        """Sum of every thread's values, keyed by (metric, label values)"""
+        with self._lock:
+            # Fold finished threads into one dict so shards do not pile up
+            alive = []
+            for thread, values in self._shards:
+                if thread.is_alive():
+                    alive.append((thread, values))
+                else:
+                    _merge(self._retired, values)
+            self._shards = alive
+            totals = {}
+            _merge(totals, self._retired)
+        for _, values in alive:
+            _merge(totals, values)
+        return totals
+
+    def render(self):
+        """Prometheus text exposition format"""
+        totals = self.merged()
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render(totals))
+        for collect in self._collectors:
+            try:
+                for name, kind, documentation, samples in collect():
+                    lines.append(f'# HELP {name} {documentation}')
+                    lines.append(f'# TYPE {name} {kind}')
+                    for labels, value in samples:
+                        lines.append(f'{name}{_labels(labels.items())} {_number(value)}')
+            except Exception as e:
+                lines.append(f'# collector failed: {str(e)}')
+        return '\n'.join(lines) + '\n'
+
+
+class Counter:
+    def __init__(self, registry, name, documentation, labels):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+
+    def inc(self, amount=1, **labels):
+        key = (self.name, tuple(labels.get(label, '') for label in self.labels))
+        values = self.registry._values()
+        values[key] = values.get(key, 0) + amount
+
+    def render(self, totals):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} counter'
+        for (name, label_values), value in sorted(totals.items()):
+            if name == self.name:
+                yield f'{self.name}{_labels(zip(self.labels, label_values))} {_number(value)}'
+
+
+class Histogram:
+    def __init__(self, registry, name, documentation, labels, buckets):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = (self.name, tuple(labels.get(label, '') for label in self.labels))
+        values = self.registry._values()
+        # [bucket counts..., +Inf count, sum]
+        slot = values.get(key)
+        if slot is None:
+            slot = values[key] = [0] * (len(self.buckets) + 2)
+        slot[bisect.bisect_left(self.buckets, value)] += 1
+        slot[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self, totals):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        for (name, label_values), slot in sorted(totals.items()):
+            if name != self.name:
+                continue
+            pairs = list(zip(self.labels, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), slot[:-1]):
+                cumulative += count
+                le = bound if bound == '+Inf' else _number(bound)
+                yield f'{self.name}_bucket{_labels(pairs + [("le", le)])} {cumulative}'
+            yield f'{self.name}_sum{_labels(pairs)} {_number(slot[-1])}'
+            yield f'{self.name}_count{_labels(pairs)} {cumulative}'
+
+
+def _merge(totals, values):
+    for key, value in list(values.items()):
+        if isinstance(value, list):
+            current = totals.get(key)
+            totals[key] = value[:] if current is None else [a + b for a, b in zip(current, value)]
+        else:
+            totals[key] = totals.get(key, 0) + value
+
+
+def _labels(pairs):
+    pairs = list(pairs)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+registry = Registry()
+
+resolve_seconds = registry.histogram(
+    'tiktok_resolve_seconds', 'Metadata lookups by provider', ('provider', 'outcome'))
+resolve_errors = registry.counter(
+    'tiktok_resolve_errors_total', 'Failed metadata lookups by provider', ('provider',))
+info_cache_requests = registry.counter(
+    'tiktok_info_cache_requests_total', 'Metadata cache lookups by tier that answered', ('result',))
+download_seconds = registry.histogram(
+    'tiktok_cdn_download_seconds', 'CDN downloads into the blob store', ('mode',))
+download_bytes = registry.counter(
+    'tiktok_cdn_download_bytes_total', 'Bytes fetched from the CDN', ('mode',))
+disk_write_seconds = registry.histogram(
+    'tiktok_disk_write_seconds', 'Time spent writing and committing one blob',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+stream_seconds = registry.histogram(
+    'tiktok_stream_seconds', 'Response bodies streamed to clients, first to last chunk', ('view',))
+bytes_served = registry.counter(
+    'tiktok_bytes_served_total', 'Response body bytes sent to clients', ('view',))
+scrape_bytes = registry.counter(
+    'tiktok_scrape_bytes_total', 'Page bytes read by the HTML fallback resolver', ('outcome',))
+admission_wait_seconds = registry.histogram(
+    'tiktok_admission_wait_seconds', 'Time transfers spent queued for a download slot')
+admission_rejected = registry.counter(
+    'tiktok_admission_rejected_total', 'Transfers turned away by admission control', ('reason',))
+request_errors = registry.counter(
+    'tiktok_request_errors_total', 'Requests that ended in an error response', ('view',))
+
+
+def timed_stream(chunks, view):
+    """Wrap a sync body iterator to record its duration and size"""
+    start = time.perf_counter()
+    sent = 0
+    try:
+        for chunk in chunks:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        stream_seconds.observe(time.perf_counter() - start, view=view)
+        bytes_served.inc(sent, view=view)
+
+
+async def atimed_stream(chunks, view):
+    """Async twin of ``timed_stream``"""
+    start = time.perf_counter()
+    sent = 0
+    try:
+        async for chunk in chunks:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        stream_seconds.observe(time.perf_counter() - start, view=view)
+        bytes_served.inc(sent, view=view)
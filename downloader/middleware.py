@@ -1,27 +1,74 @@
-from django.http import HttpResponseTooManyRequests
-from django.core.cache import cache
-import time
+import logging
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+
+from .ratelimit import limiter, load_policies
+
+logger = logging.getLogger(__name__)
+
 
 class RateLimitMiddleware:
+    # Async-capable, so ASGI requests are not funnelled through the single
+    # thread Django uses to run sync-only middleware
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        self.policies = load_policies()
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
-        if request.path.startswith('/process/'):
-            client_ip = request.META.get('REMOTE_ADDR')
-            cache_key = f'rate_limit_{client_ip}'
-            
-            # Get current request count
-            requests = cache.get(cache_key, [])
-            now = time.time()
-            
-            # Remove requests older than 1 hour
-            requests = [req for req in requests if now - req < 3600]
-            
-            if len(requests) >= 10:  # Limit to 10 requests per hour
-                return HttpResponseTooManyRequests("Rate limit exceeded")
-            
-            requests.append(now)
-            cache.set(cache_key, requests, 3600)
-        
-        return self.get_response(request)
\ No newline at end of file
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        check = self.check(request)
+        if check is None:
+            return self.get_response(request)
+        policy, key, allowed, remaining, retry_after = check
+        response = self.get_response(request) if allowed else self.reject(retry_after)
+        return self.annotate(response, policy, key, remaining)
+
+    async def __acall__(self, request):
+        # The limiter talks to the shared cache, which blocks
+        check = await sync_to_async(self.check, thread_sensitive=False)(request)
+        if check is None:
+            return await self.get_response(request)
+        policy, key, allowed, remaining, retry_after = check
+        response = await self.get_response(request) if allowed else self.reject(retry_after)
+        return self.annotate(response, policy, key, remaining)
+
+    def check(self, request):
+        """Count the request against its policy; ``None`` when unlimited"""
+        if not settings.RATELIMIT_ENABLE:
+            return None
+
+        policy = next((p for p in self.policies if p.matches(request)), None)
+        if policy is None:
+            return None
+
+        key = policy.client_key(request)
+        try:
+            allowed, remaining, retry_after = limiter.hit(policy, key)
+        except Exception as e:
+            logger.error(f"Error checking rate limit: {str(e)}")
+            if settings.RATELIMIT_FAIL_OPEN:
+                return None
+            allowed, remaining, retry_after = False, 0, 1
+        return policy, key, allowed, remaining, retry_after
+
+    def reject(self, retry_after):
+        response = JsonResponse({
+            'status': 'error',
+            'message': 'Rate limit exceeded'
+        }, status=429)
+        response['Retry-After'] = str(retry_after)
+        return response
+
+    def annotate(self, response, policy, key, remaining):
+        response['X-RateLimit-Limit'] = str(policy.limit_for(key))
+        response['X-RateLimit-Remaining'] = str(remaining)
+        return response
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videodownload',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='videodownload',
+            name='quality',
+            field=models.CharField(blank=True, default='', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='videodownload',
+            name='video_id',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0002_blob_store'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='videodownload',
+            index=models.Index(fields=['video_id', 'quality'], name='downloader__video_i_bcd17a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='videodownload',
+            index=models.Index(fields=['url'], name='downloader__url_11dd79_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='videodownload',
+            index=models.Index(fields=['created_at'], name='downloader__created_4014c6_idx'),
+        ),
+    ]
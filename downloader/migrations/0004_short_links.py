@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:14
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0003_download_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShortLink',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255, unique=True)),
+                ('video_id', models.CharField(max_length=64)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
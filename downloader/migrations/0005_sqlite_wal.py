@@ -0,0 +1,30 @@
+from django.db import migrations
+
+
+def enable_wal(apps, schema_editor):
+    # WAL lets readers run alongside the single writer. The journal mode is
+    # stored in the database file, so it is switched once here rather than
+    # on every connection, which would rewrite the file on any manage.py call
+    if schema_editor.connection.vendor == 'sqlite':
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode=WAL')
+
+
+def disable_wal(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode=DELETE')
+
+
+class Migration(migrations.Migration):
+
+    # SQLite cannot change the journal mode inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('downloader', '0004_short_links'),
+    ]
+
+    operations = [
+        migrations.RunPython(enable_wal, disable_wal),
+    ]
@@ -0,0 +1,40 @@
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicates(apps, schema_editor):
+    # Concurrent flushes could each insert the same key before the
+    # constraint existed; fold those rows into the most recent one
+    VideoDownload = apps.get_model('downloader', 'VideoDownload')
+    duplicates = (
+        VideoDownload.objects.values('video_id', 'quality')
+        .annotate(rows=Count('id'), total=Sum('download_count'), first=Min('created_at'))
+        .filter(rows__gt=1)
+    )
+    for group in duplicates:
+        rows = VideoDownload.objects.filter(video_id=group['video_id'], quality=group['quality'])
+        keep = rows.order_by('-last_downloaded', '-id').first()
+        fields = {'download_count': group['total'], 'created_at': group['first']}
+        if not keep.content_hash:
+            stored = rows.exclude(content_hash='').order_by('-last_downloaded', '-id').first()
+            if stored is not None:
+                fields['content_hash'] = stored.content_hash
+                fields['file_path'] = stored.file_path
+        # update() rather than save(), which would bump last_downloaded
+        rows.filter(id=keep.id).update(**fields)
+        rows.exclude(id=keep.id).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0005_sqlite_wal'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='videodownload',
+            constraint=models.UniqueConstraint(fields=('video_id', 'quality'), name='unique_video_quality'),
+        ),
+    ]
@@ -3,11 +3,34 @@ from django.utils import timezone
 
 class VideoDownload(models.Model):
     url = models.URLField(max_length=500)
+    video_id = models.CharField(max_length=64, blank=True, default='')
+    quality = models.CharField(max_length=10, blank=True, default='')
+    content_hash = models.CharField(max_length=64, blank=True, default='')
     download_count = models.IntegerField(default=0)
     created_at = models.DateTimeField(default=timezone.now)
     last_downloaded = models.DateTimeField(auto_now=True)
     file_path = models.CharField(max_length=500, null=True, blank=True)
-    
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['video_id', 'quality']),
+            models.Index(fields=['url']),
+            models.Index(fields=['created_at']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['video_id', 'quality'], name='unique_video_quality'),
+        ]
+
     def __str__(self):
         return f"Video: {self.url} (Downloaded: {self.download_count} times)"
 
+
+
+class ShortLink(models.Model):
+    """A vm.tiktok.com style short link and the video it redirects to"""
+    key = models.CharField(max_length=255, unique=True)
+    video_id = models.CharField(max_length=64)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.key} -> {self.video_id}"
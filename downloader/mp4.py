@@ -0,0 +1,259 @@
+import struct
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class MP4Error(ValueError):
+    """The file is not an MP4 we can parse"""
+
+
+def unpack_from(fmt, data, offset=0):
+    """``struct.unpack_from`` that reports a field running off the end as an MP4Error"""
+    try:
+        return struct.unpack_from(fmt, data, offset)
+    except struct.error as e:
+        raise MP4Error(f"Truncated box: {str(e)}")
+
+
+def iter_boxes(data, start=0, end=None):
+    """Yield ``(type, payload_start, box_end)`` for boxes in ``data[start:end]``"""
+    end = len(data) if end is None else end
+    offset = start
+    while offset + 8 <= end:
+        size, kind = unpack_from('>I4s', data, offset)
+        header = 8
+        if size == 1:
+            size = unpack_from('>Q', data, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header or offset + size > end:
+            raise MP4Error(f"Corrupt {kind!r} box")
+        yield kind, offset + header, offset + size
+        offset += size
+
+
+def find_box(data, path, start=0, end=None):
+    """Payload bounds of the first box along ``path``, e.g. ``[b'mdia', b'hdlr']``"""
+    for kind, payload, box_end in iter_boxes(data, start, end):
+        if kind == path[0]:
+            if len(path) == 1:
+                return payload, box_end
+            return find_box(data, path[1:], payload, box_end)
+    return None
+
+
+def box(kind, *payloads):
+    body = b''.join(payloads)
+    return struct.pack('>I4s', len(body) + 8, kind) + body
+
+
+def full_box(kind, version, flags, *payloads):
+    return box(kind, struct.pack('>I', (version << 24) | flags), *payloads)
+
+
+def top_level_boxes(f):
+    """``[(type, offset, size)]`` of the top-level boxes, read header by header"""
+    f.seek(0, 2)
+    file_size = f.tell()
+    boxes = []
+    offset = 0
+    while offset + 8 <= file_size:
+        f.seek(offset)
+        header = f.read(16)
+        size, kind = unpack_from('>I4s', header)
+        header_size = 8
+        if size == 1:
+            size = unpack_from('>Q', header, 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = file_size - offset
+        if size < header_size or offset + size > file_size:
+            raise MP4Error(f"Corrupt {kind!r} box")
+        boxes.append((kind, offset, size))
+        offset += size
+    return boxes
+
+
+def read_moov(f):
+    """Return the raw ``moov`` box, wherever it sits in the file"""
+    for kind, offset, size in top_level_boxes(f):
+        if kind == b'moov':
+            f.seek(offset)
+            return f.read(size)
+    raise MP4Error("No moov box")
+
+
+class Track:
+    """One ``trak`` of a moov: its ids, timing and sample table.
+
+    Positions are offsets into the moov buffer the track was parsed from.
+    """
+
+    def __init__(self, moov, start, end):
+        self.moov = moov
+        self.start = start
+        self.end = end
+
+        tkhd = find_box(moov, [b'tkhd'], start, end)
+        mdhd = find_box(moov, [b'mdia', b'mdhd'], start, end)
+        hdlr = find_box(moov, [b'mdia', b'hdlr'], start, end)
+        stbl = find_box(moov, [b'mdia', b'minf', b'stbl'], start, end)
+        if not (tkhd and mdhd and hdlr and stbl):
+            raise MP4Error("Incomplete track")
+
+        version = moov[tkhd[0]]
+        self.track_id = unpack_from('>I', moov, tkhd[0] + (20 if version == 1 else 12))[0]
+        version = moov[mdhd[0]]
+        if version == 1:
+            self.timescale, self.duration = unpack_from('>IQ', moov, mdhd[0] + 20)
+        else:
+            self.timescale, self.duration = unpack_from('>II', moov, mdhd[0] + 12)
+        self.handler = moov[hdlr[0] + 8:hdlr[0] + 12]
+        self.stbl = {kind: (payload, box_end) for kind, payload, box_end in iter_boxes(moov, *stbl)}
+        for required in (b'stsd', b'stts', b'stsc', b'stsz'):
+            if required not in self.stbl:
+                raise MP4Error("Incomplete sample table")
+        if b'stco' not in self.stbl and b'co64' not in self.stbl:
+            raise MP4Error("No chunk offsets")
+
+    def sizes(self):
+        start = self.stbl[b'stsz'][0]
+        sample_size, count = unpack_from('>II', self.moov, start + 4)
+        if sample_size:
+            return [sample_size] * count
+        return list(unpack_from(f'>{count}I', self.moov, start + 12))
+
+    def chunk_offsets(self):
+        if b'stco' in self.stbl:
+            start, kind = self.stbl[b'stco'][0], 'I'
+        else:
+            start, kind = self.stbl[b'co64'][0], 'Q'
+        count = unpack_from('>I', self.moov, start + 4)[0]
+        return list(unpack_from(f'>{count}{kind}', self.moov, start + 8))
+
+    def chunks(self):
+        """``[(file offset, [sample sizes])]`` in decode order"""
+        start = self.stbl[b'stsc'][0]
+        count = unpack_from('>I', self.moov, start + 4)[0]
+        values = unpack_from(f'>{count * 3}I', self.moov, start + 8)
+        runs = [(values[i], values[i + 1]) for i in range(0, len(values), 3)]
+
+        sizes = self.sizes()
+        chunks = []
+        sample = 0
+        run = 0
+        for index, offset in enumerate(self.chunk_offsets(), start=1):
+            while run + 1 < len(runs) and runs[run + 1][0] <= index:
+                run += 1
+            per_chunk = runs[run][1] if runs else 0
+            chunks.append((offset, sizes[sample:sample + per_chunk]))
+            sample += per_chunk
+        return chunks
+
+    def samples(self):
+        """``[(offset, size, duration, composition offset, is_sync)]`` in decode order"""
+        durations = self._expand(b'stts', signed=False)
+        offsets = self._expand(b'ctts', signed=True) if b'ctts' in self.stbl else None
+        sync = None
+        if b'stss' in self.stbl:
+            start = self.stbl[b'stss'][0]
+            count = unpack_from('>I', self.moov, start + 4)[0]
+            sync = set(unpack_from(f'>{count}I', self.moov, start + 8))
+
+        samples = []
+        for offset, sizes in self.chunks():
+            for size in sizes:
+                number = len(samples)
+                samples.append((
+                    offset,
+                    size,
+                    durations[number] if number < len(durations) else 0,
+                    offsets[number] if offsets and number < len(offsets) else 0,
+                    sync is None or number + 1 in sync,
+                ))
+                offset += size
+        return samples
+
+    def _expand(self, kind, signed):
+        start = self.stbl[kind][0]
+        count = unpack_from('>I', self.moov, start + 4)[0]
+        values = unpack_from(f">{count * 2}{'i' if signed else 'I'}", self.moov, start + 8)
+        expanded = []
+        for i in range(0, len(values), 2):
+            expanded.extend([values[i + 1]] * values[i])
+        return expanded
+
+
+def tracks(moov):
+    """Every parsable track of a raw moov box"""
+    found = []
+    for kind, payload, box_end in iter_boxes(moov, 8):
+        if kind == b'trak':
+            try:
+                found.append(Track(moov, payload, box_end))
+            except MP4Error:
+                continue
+    return found
+
+
+def needs_faststart(path):
+    """Whether the moov box comes after the media data"""
+    try:
+        with open(path, 'rb') as f:
+            kinds = [kind for kind, _, _ in top_level_boxes(f)]
+    except (OSError, MP4Error):
+        return False
+    if b'moov' not in kinds or b'mdat' not in kinds:
+        return False
+    return kinds.index(b'moov') > kinds.index(b'mdat')
+
+
+def faststart(src_path, dst_path):
+    """Write a copy of ``src_path`` with its moov moved in front of the media.
+
+    Only box order and chunk offsets change; samples are copied verbatim.
+    """
+    with open(src_path, 'rb') as src:
+        boxes = top_level_boxes(src)
+        kinds = [kind for kind, _, _ in boxes]
+        first_mdat = kinds.index(b'mdat')
+        moov_index = kinds.index(b'moov')
+        _, moov_offset, moov_size = boxes[moov_index]
+        src.seek(moov_offset)
+        moov = bytearray(src.read(moov_size))
+
+        # Media between the first mdat and the old moov moves down by the
+        # moov size; anything after the old moov stays where it was
+        shift_start = boxes[first_mdat][1]
+        for track in tracks(bytes(moov)):
+            if b'stco' in track.stbl:
+                start, kind = track.stbl[b'stco'][0], 'I'
+            else:
+                start, kind = track.stbl[b'co64'][0], 'Q'
+            offsets = [
+                offset + moov_size if shift_start <= offset < moov_offset else offset
+                for offset in track.chunk_offsets()
+            ]
+            if kind == 'I' and offsets and max(offsets) > 0xFFFFFFFF:
+                raise MP4Error("Chunk offsets would overflow stco")
+            struct.pack_into(f'>{len(offsets)}{kind}', moov, start + 8, *offsets)
+
+        with open(dst_path, 'wb') as dst:
+            for index, (kind, offset, size) in enumerate(boxes):
+                if index == first_mdat:
+                    dst.write(moov)
+                if index == moov_index:
+                    continue
+                src.seek(offset)
+                _copy(src, dst, size)
+
+
+def _copy(src, dst, size):
+    remaining = size
+    while remaining > 0:
+        chunk = src.read(min(CHUNK_SIZE, remaining))
+        if not chunk:
+            raise MP4Error("Truncated box")
+        dst.write(chunk)
+        remaining -= len(chunk)
@@ -0,0 +1,104 @@
+import asyncio
+import threading
+import time
+
+from django.conf import settings
+
+
+class _Channel:
+    def __init__(self):
+        self.version = 0
+        self.event = None
+        self.finished = None
+        self.waiters = set()
+
+
+class ProgressHub:
+    """In-process fan-out of job progress to any number of watchers.
+
+    A channel only keeps the latest event, so a slow watcher skips straight
+    to the current state instead of queueing every update, and publishing
+    costs the same no matter how many watchers share a job. Thread watchers
+    block on a condition; asyncio watchers get a future resolved on their
+    own loop. Finished channels linger for ``retain`` seconds so late
+    subscribers still see the outcome.
+    """
+
+    def __init__(self, retain=None):
+        self.retain = retain or settings.PROGRESS_RETAIN_SECONDS
+        self._channels = {}
+        self._condition = threading.Condition()
+
+    def publish(self, key, event, final=False):
+        with self._condition:
+            channel = self._channels.get(key)
+            if channel is None:
+                channel = self._channels[key] = _Channel()
+            channel.version += 1
+            channel.event = event
+            if final:
+                channel.finished = time.monotonic()
+            waiters, channel.waiters = channel.waiters, set()
+            self._prune()
+            self._condition.notify_all()
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future)
+
+    def latest(self, key):
+        """``(version, event)`` of a channel, or ``(0, None)`` if it is not local"""
+        with self._condition:
+            channel = self._channels.get(key)
+            if channel is None:
+                return 0, None
+            return channel.version, channel.event
+
+    def wait(self, key, version, timeout):
+        """Block until the channel moves past ``version`` or ``timeout`` ends"""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                channel = self._channels.get(key)
+                if channel is not None and channel.version > version:
+                    return channel.version, channel.event
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return version, None
+                self._condition.wait(remaining)
+
+    async def await_(self, key, version, timeout):
+        """Async ``wait`` that parks on the caller's event loop, not a thread"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._condition:
+            channel = self._channels.get(key)
+            if channel is not None and channel.version > version:
+                return channel.version, channel.event
+            if channel is None:
+                channel = self._channels[key] = _Channel()
+            waiter = (loop, future)
+            channel.waiters.add(waiter)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._condition:
+                channel.waiters.discard(waiter)
+        return self.latest(key) if future.done() else (version, None)
+
+    def _prune(self):
+        now = time.monotonic()
+        for key in [
+            key for key, channel in self._channels.items()
+            if (channel.finished and now - channel.finished > self.retain)
+            or (channel.event is None and not channel.waiters)
+        ]:
+            del self._channels[key]
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+progress_hub = ProgressHub()
@@ -0,0 +1,163 @@
+import ipaddress
+import logging
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitPolicy:
+    """A request budget for one route, counted per client key.
+
+    ``key`` is ``'ip'`` or ``'header:<Name>'``; ``overrides`` maps specific
+    key values (an API key, a trusted IP) to their own limit. A header key
+    is only believed when the request comes from a trusted proxy, which is
+    expected to set or strip it; anyone else is counted by IP.
+    """
+
+    def __init__(self, name, path, limit, window, key='ip', overrides=None, methods=None):
+        self.name = name
+        self.path = path
+        self.limit = limit
+        self.window = window
+        self.key = key
+        self.overrides = overrides or {}
+        self.methods = {m.upper() for m in methods} if methods else None
+
+    @classmethod
+    def from_setting(cls, config):
+        return cls(
+            config.get('name') or config['path'],
+            config['path'],
+            config['limit'],
+            config['window'],
+            key=config.get('key', 'ip'),
+            overrides=config.get('overrides'),
+            methods=config.get('methods'),
+        )
+
+    def matches(self, request):
+        if self.methods and request.method not in self.methods:
+            return False
+        return request.path.startswith(self.path)
+
+    def client_key(self, request):
+        if self.key.startswith('header:') and from_trusted_proxy(request):
+            value = request.headers.get(self.key[len('header:'):])
+            if value:
+                return value
+        return client_ip(request)
+
+    def limit_for(self, key):
+        return self.overrides.get(key, self.limit)
+
+
+class SlidingWindowLimiter:
+    """Sliding-window counter rate limiter over a shared cache.
+
+    Each client holds two integer counters, the current and the previous
+    fixed window. The previous count is weighted by how much of it still
+    overlaps the sliding window, so a check costs the same few cache
+    operations no matter how many requests the client has made.
+    Increments are atomic on the SQLite and Redis shared tiers, Memcached
+    and the in-process cache.
+    """
+
+    def __init__(self, alias=None):
+        self._alias = alias
+
+    @property
+    def cache(self):
+        return caches[self._alias or settings.RATELIMIT_USE_CACHE]
+
+    def hit(self, policy, key, now=None):
+        """Count a request and return ``(allowed, remaining, retry_after)``"""
+        now = time.time() if now is None else now
+        window = policy.window
+        limit = policy.limit_for(key)
+        index = int(now // window)
+        elapsed = now - index * window
+
+        current_key = f'rl:{policy.name}:{key}:{index}'
+        previous_key = f'rl:{policy.name}:{key}:{index - 1}'
+        previous = self.cache.get(previous_key, 0)
+        # Two windows of TTL keep the counter around while it is "previous"
+        self.cache.add(current_key, 0, window * 2)
+        try:
+            current = self.cache.incr(current_key)
+        except ValueError:
+            # Expired between add and incr
+            self.cache.set(current_key, 1, window * 2)
+            current = 1
+
+        weight = 1 - elapsed / window
+        estimate = previous * weight + current
+        if estimate <= limit:
+            return True, int(limit - estimate), 0
+
+        # Rejected requests do not eat into the budget
+        try:
+            self.cache.decr(current_key)
+        except ValueError:
+            pass
+        current -= 1
+        return False, 0, self._retry_after(limit, previous, current, elapsed, window)
+
+    def _retry_after(self, limit, previous, current, elapsed, window):
+        """Seconds until one more request fits under the limit"""
+        room = limit - 1 - current
+        if room >= 0 and previous:
+            wait = window * (1 - room / previous) - elapsed
+            if wait <= window - elapsed:
+                return max(1, math.ceil(wait))
+        # Only the current window's count, decaying next window, stands in the way
+        wait = window - elapsed
+        if current > limit - 1 and current:
+            wait += window * (1 - (limit - 1) / current)
+        return max(1, math.ceil(wait))
+
+
+def client_ip(request):
+    """The client address, read from ``RATELIMIT_IP_HEADER`` behind a trusted proxy
+
+    Clients can put anything in the header, so it is only read when the
+    peer is a trusted proxy, and then from the right: the nearest hop that
+    is not itself a trusted proxy is the one our proxies saw connect.
+    """
+    remote_addr = request.META.get('REMOTE_ADDR', '')
+    header = settings.RATELIMIT_IP_HEADER
+    if header and is_trusted_proxy(remote_addr):
+        forwarded = request.headers.get(header)
+        if forwarded:
+            hops = [hop.strip() for hop in forwarded.split(',') if hop.strip()]
+            for hop in reversed(hops):
+                if not is_trusted_proxy(hop):
+                    return hop
+            if hops:
+                return hops[0]
+    return remote_addr
+
+
+def is_trusted_proxy(address):
+    """Whether ``address`` is one of ``RATELIMIT_TRUSTED_PROXIES``"""
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(proxy, strict=False)
+               for proxy in settings.RATELIMIT_TRUSTED_PROXIES)
+
+
+def from_trusted_proxy(request):
+    """Whether the peer is one of ``RATELIMIT_TRUSTED_PROXIES``"""
+    return is_trusted_proxy(request.META.get('REMOTE_ADDR', ''))
+
+
+def load_policies():
+    return [RateLimitPolicy.from_setting(config) for config in settings.RATELIMIT_POLICIES]
+
+
+limiter = SlidingWindowLimiter()
@@ -0,0 +1,399 @@
+import fcntl
+import logging
+import math
+import os
+import re
+import shutil
+import time
+from collections import Counter
+
+from django.conf import settings
+
+from .hls import hls_store
+from .models import VideoDownload
+from .storage import blob_store
+from .thumbnails import thumbnail_store
+
+logger = logging.getLogger(__name__)
+
+DIGEST = re.compile(r'^[0-9a-f]{64}$')
+
+class ReapReport:
+    """What one reaper pass removed, and why"""
+
+    def __init__(self):
+        self.counts = {}
+        self.bytes = {}
+        self.rows = 0
+        self.scanned = 0
+        self.kept_bytes = 0
+
+    def add(self, reason, size):
+        self.counts[reason] = self.counts.get(reason, 0) + 1
+        self.bytes[reason] = self.bytes.get(reason, 0) + size
+
+    @property
+    def reclaimed(self):
+        return sum(self.bytes.values())
+
+    def lines(self):
+        yield f'{self.scanned} files scanned, {self.kept_bytes / (1024 * 1024):.1f} MB kept'
+        for reason in sorted(self.counts):
+            yield f'{reason:<12} {self.counts[reason]:>6} files {self.bytes[reason] / (1024 * 1024):>9.1f} MB'
+        yield f'{self.rows} download records removed, {self.reclaimed / (1024 * 1024):.1f} MB reclaimed'
+
+
+class StorageReaper:
+    """Reclaims disk space in the download store outside the request path.
+
+    A pass scans ``media/downloads`` with ``os.scandir`` and evicts:
+
+    - public files not accessed for ``max_age`` seconds, recorded or not;
+    - the least valuable files while the store is over ``quota`` bytes,
+      ranked by last access plus ``popularity_weight`` seconds per doubling
+      of their download count;
+    - blobs no public name links to any more, and stale scratch files;
+    - HLS renditions of blobs that are gone, not cut for ``hls_max_age``
+      seconds, or oldest first while they use more than ``hls_quota``
+      bytes. They are recut on demand;
+    - thumbnails the same way, per video, under ``thumbnail_max_age`` and
+      ``thumbnail_quota``.
+
+    Removals and their database rows are processed ``batch_size`` at a time
+    with a short pause in between, so a large backlog never monopolises the
+    disk or the database.
+    """
+
+    def __init__(self, store=None, max_age=None, quota=None, batch_size=None, pause=None,
+                 grace=None, tmp_max_age=None, popularity_weight=None, hls=None,
+                 hls_max_age=None, hls_quota=None, thumbnails=None, thumbnail_max_age=None,
+                 thumbnail_quota=None):
+        self.store = store or blob_store
+        self.hls = hls or hls_store
+        self.thumbnails = thumbnails or thumbnail_store
+        self.max_age = max_age if max_age is not None else settings.REAPER_MAX_AGE
+        self.quota = quota if quota is not None else settings.REAPER_QUOTA_BYTES
+        self.batch_size = batch_size or settings.REAPER_BATCH_SIZE
+        self.pause = pause if pause is not None else settings.REAPER_BATCH_PAUSE
+        self.grace = grace if grace is not None else settings.REAPER_GRACE
+        self.tmp_max_age = tmp_max_age if tmp_max_age is not None else settings.REAPER_TMP_MAX_AGE
+        self.popularity_weight = (
+            popularity_weight if popularity_weight is not None else settings.REAPER_POPULARITY_WEIGHT
+        )
+        self.hls_max_age = hls_max_age if hls_max_age is not None else settings.REAPER_HLS_MAX_AGE
+        self.hls_quota = hls_quota if hls_quota is not None else settings.REAPER_HLS_QUOTA_BYTES
+        self.thumbnail_max_age = (
+            thumbnail_max_age if thumbnail_max_age is not None else settings.REAPER_THUMBNAIL_MAX_AGE
+        )
+        self.thumbnail_quota = (
+            thumbnail_quota if thumbnail_quota is not None else settings.REAPER_THUMBNAIL_QUOTA_BYTES
+        )
+
+    def run(self, dry_run=False):
+        report = ReapReport()
+        now = time.time()
+        files = self._scan_public(now)
+        report.scanned = len(files)
+        self._attach_records(files)
+
+        # Hardlinks to one blob cost its bytes only once, and only free them
+        # when the last scanned name goes
+        refs = Counter(item['inode'] for item in files)
+        evict = []
+        keep = []
+
+        def drop(item, reason):
+            refs[item['inode']] -= 1
+            freed = refs[item['inode']] == 0
+            evict.append((item, reason, freed))
+            return freed
+
+        for item in files:
+            if self.max_age and now - item['last_access'] > self.max_age:
+                drop(item, 'expired')
+            else:
+                keep.append(item)
+
+        if self.quota:
+            total = sum({item['inode']: item['size'] for item in keep}.values())
+            keep.sort(key=self._score)
+            while keep and total > self.quota:
+                item = keep.pop(0)
+                if drop(item, 'quota'):
+                    total -= item['size']
+        report.kept_bytes = sum({item['inode']: item['size'] for item in keep}.values())
+
+        for offset in range(0, len(evict), self.batch_size):
+            batch = evict[offset:offset + self.batch_size]
+            for item, reason, freed in batch:
+                if not dry_run:
+                    self._evict(item)
+                report.add(reason, item['size'] if freed else 0)
+            row_ids = [item['row_id'] for item, _, _ in batch if item['row_id']]
+            if row_ids and not dry_run:
+                VideoDownload.objects.filter(id__in=row_ids).delete()
+            report.rows += len(row_ids)
+            self._rest()
+
+        self._reap_blobs(now, report, dry_run)
+        self._reap_tmp(now, report, dry_run)
+        self._reap_derived(self._scan_hls(now), 'hls', self.hls_max_age, self.hls_quota, now, report, dry_run)
+        self._reap_derived(
+            self._scan_thumbnails(now), 'thumbnail', self.thumbnail_max_age, self.thumbnail_quota,
+            now, report, dry_run,
+        )
+        return report
+
+    def _score(self, item):
+        return item['last_access'] + self.popularity_weight * math.log2(1 + item['downloads'])
+
+    def _scan_public(self, now):
+        files = []
+        if not os.path.isdir(self.store.root):
+            return files
+        with os.scandir(self.store.root) as entries:
+            for entry in entries:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+                # Freshly linked files may not have their row committed yet;
+                # linking touches ctime even when the blob itself is old
+                if now - max(stat.st_mtime, stat.st_ctime) < self.grace:
+                    continue
+                files.append({
+                    'name': entry.name,
+                    'key': self.store.parse_filename(entry.name),
+                    'size': stat.st_size,
+                    'inode': stat.st_ino,
+                    'last_access': stat.st_mtime,
+                    'downloads': 0,
+                    'row_id': None,
+                    'digest': None,
+                })
+        return files
+
+    def _attach_records(self, files):
+        """Fill in last access and download count from VideoDownload rows"""
+        by_key = {}
+        for item in files:
+            if item['key']:
+                by_key.setdefault(tuple(item['key']), []).append(item)
+        video_ids = sorted({key[0] for key in by_key})
+        for offset in range(0, len(video_ids), self.batch_size):
+            rows = VideoDownload.objects.filter(
+                video_id__in=video_ids[offset:offset + self.batch_size]
+            ).values_list('id', 'video_id', 'quality', 'last_downloaded', 'download_count', 'content_hash',
+                          'file_path')
+            for row_id, video_id, quality, last_downloaded, downloads, digest, file_path in rows:
+                item = self._recorded_file(by_key.get((video_id, quality), []), file_path)
+                if item is None:
+                    continue
+                item['row_id'] = row_id
+                item['downloads'] = downloads
+                item['digest'] = digest or None
+                if last_downloaded:
+                    item['last_access'] = last_downloaded.timestamp()
+
+    def _recorded_file(self, candidates, file_path):
+        """The scanned file a row describes.
+
+        Rows are per video and quality, but audio can be stored as both
+        ``.mp3`` and ``.aac``; the row then belongs to the file it points
+        at, by name or by the blob it links to.
+        """
+        if len(candidates) <= 1:
+            return candidates[0] if candidates else None
+        if not file_path:
+            return None
+        name = os.path.basename(file_path)
+        try:
+            inode = os.stat(file_path).st_ino
+        except OSError:
+            inode = None
+        return next((item for item in candidates if item['name'] == name or item['inode'] == inode), None)
+
+    def _evict(self, item):
+        try:
+            digest = item['digest'] or self.store.digest(item['name'])
+            self.store.release(item['name'], digest)
+        except OSError as e:
+            logger.error(f"Error removing {item['name']}: {str(e)}")
+
+    def _reap_blobs(self, now, report, dry_run):
+        """Remove blobs whose last public link is gone"""
+        if not os.path.isdir(self.store.blobs_dir):
+            return
+        removed = 0
+        with os.scandir(self.store.blobs_dir) as shards:
+            for shard in shards:
+                if not shard.is_dir(follow_symlinks=False):
+                    continue
+                with os.scandir(shard.path) as blobs:
+                    for blob in blobs:
+                        stat = blob.stat(follow_symlinks=False)
+                        # Link count 1 means only the blob itself is left; a
+                        # blob between commit and link is protected by grace
+                        if stat.st_nlink > 1 or now - stat.st_ctime < self.grace:
+                            continue
+                        if not dry_run:
+                            self._remove(blob.path)
+                        report.add('orphaned', stat.st_size)
+                        removed += 1
+                        if removed % self.batch_size == 0:
+                            self._rest()
+
+    def _reap_tmp(self, now, report, dry_run):
+        """Remove abandoned spool, link and partial download files"""
+        if not os.path.isdir(self.store.tmp_dir):
+            return
+        with os.scandir(self.store.tmp_dir) as entries:
+            for entry in entries:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+                if now - stat.st_mtime < self.tmp_max_age:
+                    continue
+                if entry.name.endswith('.lock'):
+                    if not self._remove_lock(entry.path, dry_run):
+                        continue
+                elif self._locked(entry):
+                    continue
+                elif not dry_run:
+                    self._remove(entry.path)
+                report.add('stale tmp', stat.st_size)
+
+    def _scan_hls(self, now):
+        """One entry per rendition directory, sized and dated by its files"""
+        if not os.path.isdir(self.hls.root):
+            return []
+        renditions = []
+        # A shared backend keeps only a cache of blobs on local disk
+        local_blobs = not self.store.backend.shared
+        with os.scandir(self.hls.root) as entries:
+            for entry in entries:
+                if not entry.is_dir(follow_symlinks=False):
+                    continue
+                size, mtime = _tree_usage(entry.path)
+                # Directories are keyed by blob digest when the blob has one
+                orphaned = local_blobs and bool(DIGEST.match(entry.name)) and not os.path.exists(
+                    self.store.blob_path(entry.name)
+                )
+                renditions.append({'paths': [entry.path], 'size': size, 'mtime': mtime, 'orphaned': orphaned})
+        return [item for item in renditions if now - item['mtime'] >= self.grace]
+
+    def _scan_thumbnails(self, now):
+        """One entry per video: its cover source, variants and lock files"""
+        if not os.path.isdir(self.thumbnails.root):
+            return []
+        videos = {}
+        with os.scandir(self.thumbnails.root) as entries:
+            for entry in entries:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+                item = videos.setdefault(entry.name.split('_', 1)[0], {'paths': [], 'size': 0, 'mtime': 0})
+                item['paths'].append(entry.path)
+                item['size'] += stat.st_size
+                item['mtime'] = max(item['mtime'], stat.st_mtime)
+        return [item for item in videos.values() if now - item['mtime'] >= self.grace]
+
+    def _reap_derived(self, items, label, max_age, quota, now, report, dry_run):
+        """Evict files derived from downloads: orphaned, expired, then
+        oldest first while the rest is over ``quota`` bytes"""
+        keep = []
+        evict = []
+        for item in items:
+            if item.get('orphaned'):
+                evict.append((item, f'{label} orphan'))
+            elif max_age and now - item['mtime'] > max_age:
+                evict.append((item, f'{label} expired'))
+            else:
+                keep.append(item)
+        if quota:
+            keep.sort(key=lambda item: item['mtime'])
+            total = sum(item['size'] for item in keep)
+            while keep and total > quota:
+                item = keep.pop(0)
+                evict.append((item, f'{label} quota'))
+                total -= item['size']
+
+        for number, (item, reason) in enumerate(evict, 1):
+            if not dry_run:
+                for path in item['paths']:
+                    if os.path.isdir(path):
+                        shutil.rmtree(path, onerror=_log_remove_error)
+                    else:
+                        self._remove(path)
+            report.add(reason, item['size'])
+            if number % self.batch_size == 0:
+                self._rest()
+
+    def _locked(self, entry):
+        """Whether a segmented download still holds this file's lock"""
+        base = entry.path
+        for suffix in ('.part.json', '.part', '.lock'):
+            if base.endswith(suffix):
+                base = base[:-len(suffix)]
+                break
+        lock_path = base + '.lock'
+        if not os.path.exists(lock_path):
+            return False
+        try:
+            fd = os.open(lock_path, os.O_RDONLY)
+        except OSError:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return False
+        except BlockingIOError:
+            return True
+        finally:
+            os.close(fd)
+
+    def _remove_lock(self, path, dry_run):
+        """Unlink a lock file only while holding it, so no worker loses its lock"""
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            if not dry_run:
+                self._remove(path)
+            return True
+        except BlockingIOError:
+            return False
+        finally:
+            os.close(fd)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Error removing {path}: {str(e)}")
+
+    def _rest(self):
+        if self.pause:
+            time.sleep(self.pause)
+
+
+def _tree_usage(path):
+    """Total size and newest mtime of the files under ``path``"""
+    size = 0
+    mtime = os.stat(path).st_mtime
+    for directory, _, names in os.walk(path):
+        for name in names:
+            try:
+                stat = os.stat(os.path.join(directory, name), follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            size += stat.st_size
+            mtime = max(mtime, stat.st_mtime)
+    return size, mtime
+
+
+def _log_remove_error(function, path, exc_info):
+    if not isinstance(exc_info[1], FileNotFoundError):
+        logger.error(f"Error removing {path}: {str(exc_info[1])}")
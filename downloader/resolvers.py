@@ -0,0 +1,260 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+
+from . import metrics
+from .canonical import parse_video_id
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class Provider:
+    """One way of turning a TikTok URL into a video info dict.
+
+    Keeps a window of recent latencies and a circuit breaker: after
+    ``failure_threshold`` consecutive failures the provider is skipped for
+    ``cooldown`` seconds, then a single trial request decides whether it
+    closes again.
+    """
+
+    def __init__(self, name, fetch, afetch=None, failure_threshold=None, cooldown=None):
+        self.name = name
+        self.fetch = fetch
+        self.afetch = afetch
+        self.failure_threshold = failure_threshold or settings.RESOLVER_FAILURE_THRESHOLD
+        self.cooldown = cooldown or settings.RESOLVER_COOLDOWN
+        self.latencies = deque(maxlen=100)
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def available(self):
+        """Whether the breaker would let a request through right now"""
+        if self.state == OPEN:
+            return time.monotonic() - self.opened_at >= self.cooldown
+        return self.state == CLOSED
+
+    def acquire(self):
+        """Claim a request slot, turning a cooled-down breaker half-open"""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                # Let exactly one trial through
+                self.state = HALF_OPEN
+                return True
+            return self.state == CLOSED
+
+    def release_trial(self):
+        """Give back an abandoned half-open trial"""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.state = OPEN
+
+    def p95(self):
+        if len(self.latencies) < 20:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    def error_rate(self):
+        total = self.successes + self.failures
+        return self.failures / total if total else 0.0
+
+    def record_success(self, elapsed):
+        metrics.resolve_seconds.observe(elapsed, provider=self.name, outcome='ok')
+        with self._lock:
+            self.latencies.append(elapsed)
+            self.successes += 1
+            self.consecutive_failures = 0
+            self.state = CLOSED
+
+    def record_failure(self, elapsed=None):
+        if elapsed is not None:
+            metrics.resolve_seconds.observe(elapsed, provider=self.name, outcome='error')
+        metrics.resolve_errors.inc(provider=self.name)
+        with self._lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    logger.warning(f"Resolver {self.name} circuit opened")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def stats(self):
+        p95 = self.p95()
+        return {
+            'state': self.state,
+            'successes': self.successes,
+            'failures': self.failures,
+            'error_rate': round(self.error_rate(), 3),
+            'p95_ms': round(p95 * 1000, 1) if p95 is not None else None,
+        }
+
+
+class ResolverEngine:
+    """Resolve URLs across providers with hedging and circuit breakers.
+
+    Providers with a closed breaker are tried fastest-p95 first. If
+    the current one has not answered within its p95 latency, the next one
+    is started alongside it, and the first valid answer wins. A provider
+    that fails hands over immediately instead of waiting out the hedge.
+    """
+
+    def __init__(self, providers, max_workers=None):
+        self.providers = providers
+        self._executor = ThreadPoolExecutor(
+            max_workers or settings.RESOLVER_WORKERS, thread_name_prefix='resolver'
+        )
+
+    def ranked(self):
+        order = {provider: index for index, provider in enumerate(self.providers)}
+        candidates = [p for p in self.providers if p.available()]
+
+        def score(provider):
+            # Failing providers are handled by their breaker, not demoted
+            # here, so they keep getting probed until it opens. Unmeasured
+            # providers rank after measured ones and configured order breaks
+            # ties, so the primary stays first while it is healthy.
+            p95 = provider.p95()
+            return (p95 if p95 is not None else float('inf'), order[provider])
+
+        return sorted(candidates, key=score)
+
+    def hedge_delay(self, provider):
+        p95 = provider.p95()
+        if p95 is None:
+            return settings.RESOLVER_HEDGE_DEFAULT
+        return max(settings.RESOLVER_HEDGE_MIN, p95)
+
+    def resolve(self, url):
+        pending = {}
+        queue = deque(self.ranked())
+        errors = []
+        if not queue:
+            raise ValueError("Failed to fetch video information: all providers unavailable")
+
+        deadline = None
+        while queue or pending:
+            if queue and (not pending or time.monotonic() >= deadline):
+                provider = queue.popleft()
+                if not provider.acquire():
+                    continue
+                pending[self._executor.submit(self._call, provider, url)] = provider
+                deadline = time.monotonic() + self.hedge_delay(provider)
+
+            timeout = max(0.0, deadline - time.monotonic()) if queue else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                provider = pending.pop(future)
+                try:
+                    return future.result()
+                except Exception as e:
+                    errors.append(f"{provider.name}: {str(e)}")
+                    # A failure frees the slot for the next provider now
+                    deadline = time.monotonic()
+
+        raise ValueError('; '.join(errors) or "Failed to fetch video information")
+
+    async def aresolve(self, url):
+        """Async ``resolve``: hedges with tasks, threads for sync providers"""
+        pending = {}
+        queue = deque(self.ranked())
+        errors = []
+        if not queue:
+            raise ValueError("Failed to fetch video information: all providers unavailable")
+
+        deadline = None
+        try:
+            while queue or pending:
+                if queue and (not pending or time.monotonic() >= deadline):
+                    provider = queue.popleft()
+                    if not provider.acquire():
+                        continue
+                    task = asyncio.ensure_future(self._acall(provider, url))
+                    pending[task] = provider
+                    deadline = time.monotonic() + self.hedge_delay(provider)
+
+                timeout = max(0.0, deadline - time.monotonic()) if queue else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    provider = pending.pop(task)
+                    try:
+                        return task.result()
+                    except Exception as e:
+                        errors.append(f"{provider.name}: {str(e)}")
+                        deadline = time.monotonic()
+        finally:
+            for task in pending:
+                task.cancel()
+
+        raise ValueError('; '.join(errors) or "Failed to fetch video information")
+
+    def stats(self):
+        return {provider.name: provider.stats() for provider in self.providers}
+
+    def _call(self, provider, url):
+        start = time.monotonic()
+        try:
+            info = validate_info(provider.fetch(url))
+        except Exception:
+            provider.record_failure(time.monotonic() - start)
+            raise
+        provider.record_success(time.monotonic() - start)
+        return info
+
+    async def _acall(self, provider, url):
+        start = time.monotonic()
+        try:
+            if provider.afetch:
+                info = await provider.afetch(url)
+            else:
+                info = await asyncio.to_thread(provider.fetch, url)
+            info = validate_info(info)
+        except asyncio.CancelledError:
+            provider.release_trial()
+            raise
+        except Exception:
+            provider.record_failure(time.monotonic() - start)
+            raise
+        provider.record_success(time.monotonic() - start)
+        return info
+
+
+def validate_info(info):
+    """Reject answers without a usable download URL"""
+    urls = (info or {}).get('download_urls') or {}
+    if not (urls.get('hd') or urls.get('sd')):
+        raise ValueError("No download URL in response")
+    return info
+
+
+def from_downloader(result, url):
+    """Normalize a TikTokDownloader ``_get_info_method*`` result"""
+    urls = result.get('download_urls', {})
+    return {
+        'id': result.get('id') or parse_video_id(url) or '',
+        'title': result.get('title', 'TikTok Video'),
+        'author': result.get('author', 'user').lstrip('@'),
+        'thumbnail': result.get('thumbnail', ''),
+        'plays': result.get('plays', 0),
+        'likes': result.get('likes', 0),
+        'shares': result.get('shares', 0),
+        'url': url,
+        'download_urls': {
+            'hd': urls.get('hd', ''),
+            'sd': urls.get('sd', ''),
+            'audio': urls.get('audio', ''),
+        }
+    }
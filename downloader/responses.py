@@ -0,0 +1,259 @@
+import asyncio
+import os
+import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+from . import metrics
+
+CHUNK_SIZE = 256 * 1024
+MAX_RANGES = 16
+
+RANGE_SPEC = re.compile(r'^\s*(\d*)\s*-\s*(\d*)\s*$')
+
+
+def parse_range_header(header, size):
+    """Parse an RFC 7233 ``bytes=`` header into sorted, merged ranges.
+
+    Returns ``None`` when the header should be ignored (absent, malformed,
+    or too many ranges), an empty list when nothing is satisfiable, and a
+    list of inclusive ``(start, end)`` pairs otherwise.
+    """
+    if not header or not header.startswith('bytes='):
+        return None
+    specs = header[len('bytes='):].split(',')
+    if len(specs) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for spec in specs:
+        match = RANGE_SPEC.match(spec)
+        if not match or match.groups() == ('', ''):
+            return None
+        first, last = match.groups()
+        if first == '':
+            # Suffix range: the final N bytes
+            length = int(last)
+            if length == 0:
+                continue
+            start, end = max(0, size - length), size - 1
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+            if last and int(last) < start:
+                return None
+            if start >= size:
+                continue
+        ranges.append((start, end))
+
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def file_response(request, path, filename, content_type='video/mp4', digest=None,
+                  asynchronous=False, disposition='attachment'):
+    """Serve a stored file with Range, conditional GET and sendfile support.
+
+    ``digest`` becomes a strong ETag. Without it a weak validator built from
+    size and mtime is used. ``asynchronous`` picks an async body iterator so
+    ASGI servers never have to buffer a sync generator.
+    """
+    stat = os.stat(path)
+    size = stat.st_size
+    mtime = int(stat.st_mtime)
+    etag = f'"{digest}"' if digest else f'W/"{size:x}-{mtime:x}"'
+
+    validators = HttpResponse()
+    validators['ETag'] = etag
+    validators['Last-Modified'] = http_date(mtime)
+    conditional = get_conditional_response(
+        request, etag=etag, last_modified=mtime, response=validators
+    )
+    if conditional is not validators:
+        # 304 Not Modified or 412 Precondition Failed
+        return conditional
+
+    if settings.SENDFILE_BACKEND:
+        response = _sendfile_response(path, content_type)
+        if request.method == 'GET':
+            metrics.bytes_served.inc(size, view='sendfile')
+    else:
+        ranges = None
+        if _if_range_matches(request, etag, mtime):
+            ranges = parse_range_header(request.headers.get('Range'), size)
+
+        if ranges is None:
+            response = _full_response(path, size, content_type, asynchronous)
+            if request.method == 'GET' and not asynchronous:
+                # FileResponse bodies may go out via sendfile, so count them here
+                metrics.bytes_served.inc(size, view='file')
+        elif not ranges:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            response = _body([(start, end)], path, asynchronous, status=206, content_type=content_type)
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response['Content-Length'] = str(end - start + 1)
+        else:
+            response = _multipart_response(path, size, ranges, content_type, asynchronous)
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(mtime)
+    response['Content-Disposition'] = f'{disposition}; filename="{filename}"'
+    return response
+
+
+def _if_range_matches(request, etag, mtime):
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        # Only strong validators may be used with If-Range
+        return not etag.startswith('W/') and if_range == etag
+    return parse_http_date_safe(if_range) == mtime
+
+
+def _sendfile_response(path, content_type):
+    """Hand the body off to the front-end server"""
+    response = HttpResponse(content_type=content_type)
+    if settings.SENDFILE_BACKEND == 'nginx':
+        relative = os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, '/')
+        response['X-Accel-Redirect'] = settings.SENDFILE_URL.rstrip('/') + '/' + relative
+    else:
+        response['X-Sendfile'] = path
+    return response
+
+
+def _full_response(path, size, content_type, asynchronous):
+    if asynchronous:
+        response = _body([(0, size - 1)], path, True, content_type=content_type)
+    else:
+        # FileResponse lets WSGI servers use wsgi.file_wrapper/sendfile
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+    response['Content-Length'] = str(size)
+    return response
+
+
+def _multipart_response(path, size, ranges, content_type, asynchronous):
+    boundary = uuid.uuid4().hex
+    parts = []
+    length = 0
+    for start, end in ranges:
+        head = (
+            f'\r\n--{boundary}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+        ).encode()
+        parts += [head, (start, end)]
+        length += len(head) + end - start + 1
+    tail = f'\r\n--{boundary}--\r\n'.encode()
+    parts.append(tail)
+    length += len(tail)
+
+    response = _body(
+        parts, path, asynchronous, status=206,
+        content_type=f'multipart/byteranges; boundary={boundary}',
+    )
+    response['Content-Length'] = str(length)
+    return response
+
+
+def _body(parts, path, asynchronous, **kwargs):
+    if asynchronous:
+        iterator = metrics.atimed_stream(_aiter_parts(parts, path), 'file')
+    else:
+        iterator = metrics.timed_stream(_iter_parts(parts, path), 'file')
+    return StreamingHttpResponse(iterator, **kwargs)
+
+
+def _iter_parts(parts, path):
+    """Yield literal byte strings and ``(start, end)`` file slices in order"""
+    with open(path, 'rb') as f:
+        for part in parts:
+            if isinstance(part, bytes):
+                yield part
+                continue
+            start, end = part
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+
+async def _aiter_parts(parts, path):
+    f = await asyncio.to_thread(open, path, 'rb')
+    try:
+        for part in parts:
+            if isinstance(part, bytes):
+                yield part
+                continue
+            start, end = part
+            remaining = end - start + 1
+            offset = start
+            while remaining > 0:
+                chunk = await asyncio.to_thread(os.pread, f.fileno(), min(CHUNK_SIZE, remaining), offset)
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                offset += len(chunk)
+                yield chunk
+    finally:
+        f.close()
+
+
+_iterator_executor = None
+_iterator_lock = threading.Lock()
+
+
+def iterator_executor():
+    """The pool ``aiterate`` pulls chunks on, sized by ``STREAM_ITERATOR_THREADS``"""
+    global _iterator_executor
+    with _iterator_lock:
+        if _iterator_executor is None:
+            _iterator_executor = ThreadPoolExecutor(
+                settings.STREAM_ITERATOR_THREADS, thread_name_prefix='stream-iterator'
+            )
+        return _iterator_executor
+
+
+async def aiterate(chunks):
+    """Drive a blocking body iterator from worker threads for ASGI.
+
+    Django would otherwise collect a sync iterator in full before sending
+    it under ASGI. Chunks are pulled on a dedicated pool rather than the
+    loop's default executor, so slow bodies cannot starve ``sync_to_async``
+    callers, and the iterator is closed there too, so its cleanup runs when
+    the client goes away early.
+    """
+    loop = asyncio.get_running_loop()
+    executor = iterator_executor()
+    iterator = iter(chunks)
+    done = object()
+    try:
+        while True:
+            chunk = await loop.run_in_executor(executor, next, iterator, done)
+            if chunk is done:
+                return
+            yield chunk
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            await loop.run_in_executor(executor, close)
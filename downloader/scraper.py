@@ -0,0 +1,113 @@
+import json
+import re
+
+from django.conf import settings
+
+from . import metrics
+from .canonical import is_tiktok_url
+from .http_client import guarded_request
+
+# TikTok embeds the page state as one JSON script; newer pages use the
+# universal rehydration blob, older ones SIGI_STATE
+STATE_SCRIPT = re.compile(
+    rb'<script[^>]*\bid="(__UNIVERSAL_DATA_FOR_REHYDRATION__|SIGI_STATE)"[^>]*>'
+)
+SCRIPT_END = b'</script>'
+# Longest opening tag we expect, kept across chunk boundaries
+TAG_OVERLAP = 256
+
+
+class PageScanner:
+    """Finds the embedded state JSON in an HTML page fed chunk by chunk.
+
+    Bytes before the opening tag are dropped as they are scanned, so memory
+    stays bounded by the blob itself. ``feed`` returns ``True`` once the
+    blob is complete and the rest of the page can be skipped.
+    """
+
+    def __init__(self):
+        self.kind = None
+        self.blob = None
+        self._buffer = bytearray()
+        self._scanned = 0
+
+    def feed(self, chunk):
+        self._buffer += chunk
+        if self.kind is None:
+            match = STATE_SCRIPT.search(self._buffer)
+            if not match:
+                del self._buffer[:-TAG_OVERLAP]
+                return False
+            self.kind = match.group(1).decode()
+            del self._buffer[:match.end()]
+            self._scanned = 0
+
+        # The blob escapes '/' inside strings, so the first </script> ends it
+        end = self._buffer.find(SCRIPT_END, max(0, self._scanned - len(SCRIPT_END)))
+        if end < 0:
+            self._scanned = len(self._buffer)
+            return False
+        self.blob = bytes(self._buffer[:end])
+        self._buffer = bytearray()
+        return True
+
+
+def scrape_video_info(session, url, headers, video_id=None):
+    """Video info from a TikTok page, reading only as far as the state blob"""
+    scanner = PageScanner()
+    read = 0
+    # Redirects are checked hop by hop so the page fetch never leaves TikTok
+    with guarded_request('GET', url, is_tiktok_url, session=session, headers=headers, stream=True) as response:
+        if response.status_code != 200:
+            raise ValueError(f"Page request failed with status: {response.status_code}")
+        for chunk in response.iter_content(chunk_size=settings.SCRAPER_CHUNK_SIZE):
+            read += len(chunk)
+            if scanner.feed(chunk):
+                break
+            if read > settings.SCRAPER_MAX_BYTES:
+                break
+    # Leaving the block early closes the connection instead of draining it
+    metrics.scrape_bytes.inc(read, outcome='found' if scanner.blob is not None else 'missing')
+
+    if scanner.blob is None:
+        raise ValueError("Could not find video data")
+    try:
+        state = json.loads(scanner.blob)
+    except ValueError:
+        raise ValueError("Malformed video data")
+    return parse_page_state(scanner.kind, state, video_id)
+
+
+def parse_page_state(kind, state, video_id=None):
+    """Map a page state blob onto the ``_get_info_method*`` result shape"""
+    if kind == 'SIGI_STATE':
+        items = state.get('ItemModule') or {}
+        item = items.get(str(video_id)) if video_id else None
+        item = item or next(iter(items.values()), None)
+        author = item.get('author') if item else None
+    else:
+        detail = state.get('__DEFAULT_SCOPE__', {}).get('webapp.video-detail', {})
+        item = detail.get('itemInfo', {}).get('itemStruct')
+        author = (item or {}).get('author', {}).get('uniqueId')
+    if not item or not item.get('video'):
+        raise ValueError("Page has no video data")
+
+    video = item['video']
+    stats = item.get('stats', {})
+    music = item.get('music', {})
+    play_url = video.get('playAddr', '')
+    return {
+        'status': 'success',
+        'id': str(item.get('id', video_id or '')),
+        'title': item.get('desc') or 'TikTok Video',
+        'author': f"@{author or 'user'}",
+        'thumbnail': video.get('cover') or video.get('originCover', ''),
+        'plays': stats.get('playCount', 0),
+        'likes': stats.get('diggCount', 0),
+        'shares': stats.get('shareCount', 0),
+        'download_urls': {
+            'hd': video.get('downloadAddr') or play_url,
+            'sd': play_url or video.get('downloadAddr', ''),
+            'audio': music.get('playUrl', ''),
+        }
+    }
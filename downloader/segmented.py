@@ -0,0 +1,236 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+
+from .canonical import is_media_url
+from .http_client import get_session, guarded_request
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 256 * 1024
+STATE_FLUSH_BYTES = 4 * 1024 * 1024
+# Longest pause between two attempts at one segment
+MAX_BACKOFF = 10
+
+
+class RangesUnsupported(Exception):
+    """The upstream cannot serve this file in segments"""
+
+
+class SegmentedDownloader:
+    """Download one file over several parallel Range requests.
+
+    Segments are written with ``os.pwrite`` into a preallocated ``.part``
+    file. Progress per segment is kept in a ``.part.json`` sidecar so an
+    interrupted download resumes where each segment stopped, as long as the
+    upstream size and validator are unchanged.
+    """
+
+    def __init__(self, segments=4, min_size=0, retries=3, session=None, allowed=is_media_url):
+        self.segments = segments
+        self.min_size = min_size
+        self.retries = retries
+        self.session = session or get_session()
+        # Hosts the probe may be redirected to; segments then go to the final URL
+        self.allowed = allowed
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_quality(cls, quality):
+        """Build a downloader from the SEGMENTED_DOWNLOADS setting"""
+        config = settings.SEGMENTED_DOWNLOADS.get(quality, {})
+        return cls(
+            segments=config.get('segments', 1),
+            min_size=config.get('min_size', 0),
+            retries=config.get('retries', 3),
+        )
+
+    def download(self, url, dest_path, headers=None, progress=None):
+        """Fetch ``url`` into ``dest_path``.
+
+        Raises RangesUnsupported when the file is too small or the upstream
+        does not advertise byte ranges, so the caller can fall back to a
+        single stream.
+        """
+        headers = dict(headers or {})
+        url, size, validator = self._probe(url, headers)
+        if self.segments < 2 or size < max(self.min_size, self.segments):
+            raise RangesUnsupported('File too small to split')
+
+        # Another worker resuming the same file owns it until it finishes
+        lock_fd = _lock(dest_path + '.lock')
+        try:
+            return self._download(url, headers, dest_path, size, validator, progress)
+        except RangesUnsupported:
+            # The caller streams the whole file instead, so nothing will resume this
+            for path in (dest_path + '.part', dest_path + '.part.json'):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            raise
+        finally:
+            os.close(lock_fd)
+
+    def _download(self, url, headers, dest_path, size, validator, progress):
+        part_path = dest_path + '.part'
+        state_path = dest_path + '.part.json'
+        state = self._load_state(state_path, size, validator)
+        if state is None or not os.path.exists(part_path):
+            state = self._new_state(size, validator)
+            with open(part_path, 'wb') as f:
+                f.truncate(size)
+
+        fd = os.open(part_path, os.O_WRONLY)
+        # Set when one segment fails, so the others stop instead of finishing
+        # a download that is going to be abandoned anyway
+        cancelled = threading.Event()
+        try:
+            counter = _Progress(progress, size, sum(seg[2] for seg in state['segments']))
+            with ThreadPoolExecutor(len(state['segments']), thread_name_prefix='segment') as pool:
+                futures = [
+                    pool.submit(self._fetch_segment, url, headers, fd, seg, state, state_path, counter, cancelled)
+                    for seg in state['segments'] if seg[2] < seg[1] - seg[0] + 1
+                ]
+                for future in as_completed(futures):
+                    try:
+                        future.result()
+                    except BaseException:
+                        cancelled.set()
+                        raise
+        finally:
+            os.close(fd)
+            self._save_state(state_path, state)
+
+        if any(seg[2] != seg[1] - seg[0] + 1 for seg in state['segments']):
+            raise ValueError("Segmented download incomplete")
+        os.replace(part_path, dest_path)
+        os.remove(state_path)
+        return dest_path
+
+    def _probe(self, url, headers):
+        response = guarded_request('HEAD', url, self.allowed, session=self.session, headers=headers)
+        if response.status_code != 200:
+            raise RangesUnsupported(f"Probe failed with status: {response.status_code}")
+        if response.headers.get('Accept-Ranges', '').lower() != 'bytes':
+            raise RangesUnsupported('Upstream does not accept byte ranges')
+        size = int(response.headers.get('Content-Length') or 0)
+        validator = response.headers.get('ETag') or response.headers.get('Last-Modified', '')
+        return response.url, size, validator
+
+    def _new_state(self, size, validator):
+        step = -(-size // self.segments)
+        segments = [
+            [start, min(start + step, size) - 1, 0]
+            for start in range(0, size, step)
+        ]
+        return {'size': size, 'validator': validator, 'segments': segments}
+
+    def _load_state(self, state_path, size, validator):
+        try:
+            with open(state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state.get('size') != size or state.get('validator') != validator:
+            return None
+        return state
+
+    def _save_state(self, state_path, state):
+        with self._lock:
+            tmp_path = state_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, state_path)
+
+    def _fetch_segment(self, url, headers, fd, seg, state, state_path, counter, cancelled):
+        start, end = seg[0], seg[1]
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                # Back off between attempts; a cancelled download stops waiting
+                cancelled.wait(min(settings.UPSTREAM_BACKOFF * 2 ** (attempt - 1), MAX_BACKOFF))
+            if cancelled.is_set():
+                return
+            offset = start + seg[2]
+            if offset > end:
+                return
+            try:
+                response = self.session.get(
+                    url, headers={**headers, 'Range': f'bytes={offset}-{end}'}, stream=True,
+                    allow_redirects=False,
+                )
+                # Anything but the exact slice we asked for would corrupt the file
+                expected = f'bytes {offset}-{end}/{state["size"]}'
+                if response.status_code != 206 or response.headers.get('Content-Range') != expected:
+                    response.close()
+                    raise RangesUnsupported(f"Unexpected segment response: {response.status_code}")
+
+                unsaved = 0
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    if cancelled.is_set():
+                        # Progress so far is kept in the state for a resume
+                        response.close()
+                        return
+                    if offset + len(chunk) > end + 1:
+                        raise ValueError("Segment overran its range")
+                    os.pwrite(fd, chunk, offset)
+                    offset += len(chunk)
+                    seg[2] += len(chunk)
+                    counter.add(len(chunk))
+                    unsaved += len(chunk)
+                    if unsaved >= STATE_FLUSH_BYTES:
+                        self._save_state(state_path, state)
+                        unsaved = 0
+
+                if offset != end + 1:
+                    raise ValueError(f"Segment {start}-{end} ended early at {offset}")
+                return
+            except RangesUnsupported:
+                raise
+            except Exception as e:
+                last_error = e
+                logger.warning(f"Segment {start}-{end} attempt {attempt + 1} failed: {str(e)}")
+        raise ValueError(f"Segment {start}-{end} failed: {str(last_error)}")
+
+
+def _lock(lock_path):
+    """Hold an exclusive ``flock`` on ``lock_path`` without waiting.
+
+    Lock files are left in place: unlinking one while another worker has it
+    open would let a third create a fresh file and lock that instead. The
+    reaper only removes them while holding the lock itself, so once locked
+    the path must still name the file we hold, or we lost a race and retry.
+    """
+    while True:
+        fd = os.open(lock_path, os.O_CREAT | os.O_WRONLY, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            if os.stat(lock_path).st_ino == os.fstat(fd).st_ino:
+                return fd
+        except BlockingIOError:
+            os.close(fd)
+            raise RangesUnsupported('Segmented download already in progress')
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+
+
+class _Progress:
+    def __init__(self, callback, total, done):
+        self.callback = callback
+        self.total = total
+        self.done = done
+        self._lock = threading.Lock()
+
+    def add(self, count):
+        if not self.callback:
+            return
+        with self._lock:
+            self.done += count
+            self.callback(self.done, self.total)
@@ -0,0 +1,36 @@
+import gc
+import logging
+import mimetypes
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def preload():
+    """Do the per-worker setup once, before a prefork server forks.
+
+    Called from ``wsgi.py``/``asgi.py`` when STARTUP_PRELOAD is set. Under
+    ``gunicorn --preload`` that is the master, so every worker inherits the
+    imported modules, compiled URLconf and template, and the upstream
+    session copy-on-write instead of rebuilding them on its first request.
+    Nothing here may open a socket, a database connection or a thread,
+    since none of those survive a fork.
+    """
+    start = time.perf_counter()
+    from django.db import connections
+    from django.template.loader import get_template
+    from django.urls import get_resolver
+
+    from .views import get_resolver as get_resolver_engine
+
+    # Imports every view module and compiles the URL patterns
+    get_resolver().reverse_dict
+    get_template('downloader/home.html')
+    # Pulls in requests/urllib3; connection pools stay empty until first use
+    get_resolver_engine()
+    mimetypes.init()
+
+    connections.close_all()
+    # Keep the collector from touching, and so copying, the preloaded objects
+    gc.freeze()
+    logger.info(f"Preloaded app in {(time.perf_counter() - start) * 1000:.0f} ms")
@@ -188,7 +188,15 @@ document.addEventListener('DOMContentLoaded', function() {
                 })
             });
 
-            const data = await response.json();
+            let data = await response.json();
+
+            // Downloads run as background jobs; follow the event stream when
+            // the server offers one (ASGI) and poll the job status otherwise
+            if (data.status === 'success' && data.events_url && window.EventSource) {
+                data = await watchJob(data.events_url, data.status_url, downloadBtn);
+            } else if (data.status === 'success' && data.status_url) {
+                data = await waitForJob(data.status_url, downloadBtn);
+            }
 
             if (data.status === 'success' && data.download_url) {
                 showSuccess('Starting download...');
@@ -206,6 +214,76 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     };
 
+    function watchJob(eventsUrl, statusUrl, button) {
+        return new Promise(resolve => {
+            const source = new EventSource(eventsUrl);
+
+            source.addEventListener('progress', (e) => {
+                const job = JSON.parse(e.data);
+                if (job.status === 'done') {
+                    source.close();
+                    resolve({ status: 'success', download_url: job.download_url });
+                } else if (job.status === 'failed') {
+                    source.close();
+                    resolve({ status: 'error', message: job.message });
+                } else {
+                    showJobProgress(job, button);
+                }
+            });
+
+            // The browser reconnects on its own while the stream is open;
+            // a refused reconnect means the job expired or the server is gone
+            source.onerror = () => {
+                if (source.readyState === EventSource.CLOSED) {
+                    resolve(waitForJob(statusUrl, button));
+                }
+            };
+        });
+    }
+
+    function showJobProgress(job, button) {
+        if (job.phase === 'queued') {
+            button.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Queued...';
+        } else if (job.phase === 'resolving') {
+            button.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Preparing...';
+        } else if (job.total) {
+            const percent = Math.round(job.bytes / job.total * 100);
+            const details = [];
+            if (job.rate) {
+                details.push(formatBytes(job.rate) + '/s');
+            }
+            if (job.eta !== null && job.eta !== undefined) {
+                details.push(Math.ceil(job.eta) + 's left');
+            }
+            const suffix = details.length ? ` (${details.join(', ')})` : '';
+            button.innerHTML = `<i class="fas fa-spinner fa-spin"></i> Downloading ${percent}%${suffix}`;
+        } else if (job.bytes) {
+            button.innerHTML = `<i class="fas fa-spinner fa-spin"></i> Downloading ${formatBytes(job.bytes)}`;
+        }
+    }
+
+    async function waitForJob(statusUrl, button) {
+        while (true) {
+            await new Promise(resolve => setTimeout(resolve, 1000));
+
+            const response = await fetch(statusUrl);
+            const data = await response.json();
+            if (data.status !== 'success') {
+                return data;
+            }
+
+            const job = data.job;
+            if (job.status === 'done') {
+                return { status: 'success', download_url: job.download_url };
+            }
+            if (job.status === 'failed') {
+                return { status: 'error', message: job.message };
+            }
+
+            showJobProgress(job, button);
+        }
+    }
+
     function handleApiError(error) {
         if (error.message?.includes('Api Limit')) {
             showError('Please wait a moment before trying again');
@@ -279,6 +357,16 @@ document.addEventListener('DOMContentLoaded', function() {
         return num.toString();
     }
 
+    function formatBytes(bytes) {
+        if (bytes >= 1024 * 1024) {
+            return (bytes / (1024 * 1024)).toFixed(1) + ' MB';
+        }
+        if (bytes >= 1024) {
+            return (bytes / 1024).toFixed(0) + ' KB';
+        }
+        return bytes + ' B';
+    }
+
     function isValidTikTokUrl(url) {
         return url.toLowerCase().includes('tiktok.com/') && 
                (url.startsWith('http://') || url.startsWith('https://'));
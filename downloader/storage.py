@@ -0,0 +1,344 @@
+import fcntl
+import hashlib
+import logging
+import os
+import re
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import metrics
+from .mp4 import MP4Error, faststart, needs_faststart
+from .storage_backends import configured_backend
+
+logger = logging.getLogger(__name__)
+
+KEY_PATTERN = re.compile(r'^[\w-]+$')
+PUBLIC_NAME = re.compile(r'^tiktok_(.+)_([^_.]+)\.\w+$')
+DIGEST_XATTR = 'user.sha256'
+
+
+class BlobStore:
+    """Content-addressed store for downloaded media.
+
+    Every distinct payload is written once to ``blobs/<aa>/<sha256>``. The
+    public ``tiktok_<video_id>_<quality>.<ext>`` names served by ``/download/`` are
+    hardlinks to that blob, so the blob's link count doubles as its
+    reference count and repeat requests never hit the CDN again.
+
+    With a shared backend (STORAGE_BACKEND) every committed blob is also
+    published there, and this directory becomes a read-through cache:
+    ``lookup`` finds downloads made by other nodes and ``local_path``
+    fetches them on first use.
+    """
+
+    def __init__(self, root=None, backend=None):
+        self._root = root
+        self._backend = backend
+
+    @property
+    def root(self):
+        # Resolved lazily so MEDIA_ROOT overrides apply to the shared store
+        return self._root or os.path.join(settings.MEDIA_ROOT, 'downloads')
+
+    @property
+    def backend(self):
+        return self._backend or configured_backend()
+
+    @property
+    def blobs_dir(self):
+        return os.path.join(self.root, 'blobs')
+
+    @property
+    def tmp_dir(self):
+        return os.path.join(self.root, 'tmp')
+
+    def filename_for(self, video_id, quality, ext='mp4'):
+        """Public filename for a video id and quality"""
+        # str(None) would otherwise pass as the id 'None'
+        video_id = str(video_id) if video_id else ''
+        if not KEY_PATTERN.match(video_id) or not KEY_PATTERN.match(quality):
+            raise ValueError("Invalid video id or quality")
+        return f"tiktok_{video_id}_{quality}.{ext}"
+
+    def parse_filename(self, filename):
+        """``(video_id, quality)`` of a public filename, or ``None``"""
+        match = PUBLIC_NAME.match(filename)
+        return match.groups() if match else None
+
+    def path(self, filename):
+        """Absolute path of a public filename"""
+        return os.path.join(self.root, filename)
+
+    def blob_path(self, digest):
+        """Absolute path of the blob holding ``digest``"""
+        return os.path.join(self.blobs_dir, digest[:2], digest)
+
+    def lookup(self, video_id, quality, ext='mp4'):
+        """Return the public filename if the key is already stored"""
+        filename = self.filename_for(video_id, quality, ext)
+        if os.path.exists(self.path(filename)):
+            return filename
+        if self.backend.shared and self._resolve(filename):
+            return filename
+        return None
+
+    async def alookup(self, video_id, quality, ext='mp4'):
+        """``lookup`` that asks the shared backend off the event loop"""
+        filename = self.filename_for(video_id, quality, ext)
+        if os.path.exists(self.path(filename)):
+            return filename
+        if self.backend.shared:
+            return await sync_to_async(self.lookup, thread_sensitive=False)(video_id, quality, ext)
+        return None
+
+    def local_path(self, filename):
+        """Path of a public file on this node, fetched from the backend if needed"""
+        path = self.path(filename)
+        if os.path.exists(path) or not self.backend.shared:
+            return path
+        digest = self._resolve(filename)
+        if not digest:
+            raise FileNotFoundError(filename)
+        blob = self.blob_path(digest)
+        # Concurrent misses on any worker fetch the blob once
+        with file_lock(os.path.join(self.tmp_dir, f'fetch_{digest}')):
+            if not os.path.exists(blob):
+                tmp_path = os.path.join(self.tmp_dir, uuid.uuid4().hex)
+                try:
+                    with metrics.disk_write_seconds.time():
+                        self.backend.fetch(digest, tmp_path)
+                    self._commit(tmp_path, digest)
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+            self._link(digest, filename)
+        return path
+
+    def redirect_url(self, filename, content_type):
+        """Presigned backend URL for a public file, or ``None`` to serve it here"""
+        if not (self.backend.shared and settings.STORAGE_REDIRECT):
+            return None
+        digest = self.digest(filename) or self._resolve(filename)
+        if not digest:
+            return None
+        return self.backend.url(digest, filename, content_type)
+
+    def writer(self, video_id, quality, ext='mp4'):
+        """Open a BlobWriter for incremental writes of one key"""
+        return BlobWriter(self, self.filename_for(video_id, quality, ext))
+
+    def save(self, video_id, quality, chunks, ext='mp4'):
+        """Stream ``chunks`` into the store and return ``(filename, digest)``.
+
+        The content hash is computed while the bytes are written, so the
+        payload is only read once. If an identical blob already exists the
+        temporary copy is discarded and the key is linked to the old blob.
+        """
+        with self.writer(video_id, quality, ext) as writer:
+            for chunk in chunks:
+                writer.write(chunk)
+            return writer.commit()
+
+    async def asave(self, video_id, quality, chunks, ext='mp4'):
+        """Async twin of ``save`` for an async iterator of chunks"""
+        with self.writer(video_id, quality, ext) as writer:
+            async for chunk in chunks:
+                writer.write(chunk)
+            # Faststart, hashing, linking and the upload all block on I/O
+            return await sync_to_async(writer.commit, thread_sensitive=False)()
+
+    def partial_path(self, video_id, quality, ext='mp4'):
+        """Stable scratch path for resumable downloads of one key"""
+        return os.path.join(self.tmp_dir, self.filename_for(video_id, quality, ext))
+
+    def ingest(self, video_id, quality, file_path, ext='mp4'):
+        """Move a finished file into the store and return ``(filename, digest)``"""
+        filename = self.filename_for(video_id, quality, ext)
+        digest = self._prepare(file_path, filename)
+        with metrics.disk_write_seconds.time():
+            try:
+                self._commit(file_path, digest)
+            finally:
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+            self._link(digest, filename)
+        self._publish(digest, filename)
+        return filename, digest
+
+    def adopt(self, filename):
+        """Move an existing public file into the store, leaving a link behind"""
+        path = self.path(filename)
+        digest = _hash_file(path)
+        blob = self.blob_path(digest)
+        if not os.path.exists(blob):
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            try:
+                os.setxattr(path, DIGEST_XATTR, digest.encode())
+            except (AttributeError, OSError):
+                pass
+            os.link(path, blob)
+        elif not os.path.samefile(path, blob):
+            self._link(digest, filename)
+        return digest
+
+    def digest(self, filename):
+        """Content hash of a public file, read from its blob's xattr"""
+        try:
+            return os.getxattr(self.path(filename), DIGEST_XATTR).decode()
+        except (AttributeError, OSError):
+            # No xattr support (non-Linux) or a file from before the store
+            return None
+
+    def refcount(self, digest):
+        """Number of public names that reference a blob"""
+        try:
+            return os.stat(self.blob_path(digest)).st_nlink - 1
+        except FileNotFoundError:
+            return 0
+
+    def release(self, filename, digest=None):
+        """Drop a public name and the blob once nothing references it"""
+        path = self.path(filename)
+        if os.path.exists(path):
+            os.remove(path)
+        if digest and self.refcount(digest) <= 0:
+            blob = self.blob_path(digest)
+            if os.path.exists(blob):
+                os.remove(blob)
+
+    def _prepare(self, tmp_path, filename, digest=None):
+        """Finish a spooled file before it becomes a blob and return its digest.
+
+        MP4s whose moov sits after the media are rewritten moov-first, so
+        players can start before the whole file has arrived.
+        """
+        if settings.FASTSTART_ON_STORE and filename.endswith('.mp4') and needs_faststart(tmp_path):
+            fixed = f'{tmp_path}.faststart'
+            try:
+                faststart(tmp_path, fixed)
+                os.replace(fixed, tmp_path)
+                digest = None
+            except (MP4Error, OSError) as e:
+                logger.warning(f"Faststart failed for {filename}: {str(e)}")
+                if os.path.exists(fixed):
+                    os.remove(fixed)
+        return digest or _hash_file(tmp_path)
+
+    def _resolve(self, filename):
+        try:
+            return self.backend.resolve(filename)
+        except Exception as e:
+            logger.warning(f"Error resolving {filename} in shared storage: {str(e)}")
+            return None
+
+    def _publish(self, digest, filename):
+        # A failed upload leaves the download usable on this node
+        if not self.backend.shared:
+            return
+        try:
+            self.backend.publish(digest, self.blob_path(digest), filename)
+        except Exception as e:
+            logger.warning(f"Error publishing {filename} to shared storage: {str(e)}")
+
+    def _commit(self, tmp_path, digest):
+        blob = self.blob_path(digest)
+        if os.path.exists(blob):
+            return
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        try:
+            # Every hardlink shares the inode, so the digest travels with it
+            os.setxattr(tmp_path, DIGEST_XATTR, digest.encode())
+        except (AttributeError, OSError):
+            pass
+        os.replace(tmp_path, blob)
+
+    def _link(self, digest, filename):
+        # Link under a temporary name and rename over the key so concurrent
+        # writers of the same video never expose a half-linked file.
+        blob = self.blob_path(digest)
+        target = self.path(filename)
+        tmp_link = os.path.join(self.tmp_dir, f"link_{uuid.uuid4().hex}")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        try:
+            os.link(blob, tmp_link)
+        except OSError:
+            # Filesystems without hardlinks get a plain copy instead
+            logger.warning("Hardlinks unavailable, copying blob %s", digest)
+            shutil.copyfile(blob, tmp_link)
+        os.replace(tmp_link, target)
+
+
+class BlobWriter:
+    """Hashes and spools one payload, then commits it into the store.
+
+    Leaving the ``with`` block without ``commit()`` discards the bytes, so
+    an interrupted transfer never becomes a visible blob.
+    """
+
+    def __init__(self, store, filename):
+        self.store = store
+        self.filename = filename
+        self.size = 0
+        self.write_time = 0.0
+        self._hasher = hashlib.sha256()
+        os.makedirs(store.tmp_dir, exist_ok=True)
+        self._tmp_path = os.path.join(store.tmp_dir, uuid.uuid4().hex)
+        self._file = open(self._tmp_path, 'wb')
+
+    def write(self, chunk):
+        if chunk:
+            start = time.perf_counter()
+            self._hasher.update(chunk)
+            self._file.write(chunk)
+            self.size += len(chunk)
+            self.write_time += time.perf_counter() - start
+
+    def commit(self):
+        """Publish the payload and return ``(filename, digest)``"""
+        start = time.perf_counter()
+        self._file.close()
+        digest = self.store._prepare(self._tmp_path, self.filename, self._hasher.hexdigest())
+        self.store._commit(self._tmp_path, digest)
+        self.store._link(digest, self.filename)
+        metrics.disk_write_seconds.observe(self.write_time + time.perf_counter() - start)
+        self.store._publish(digest, self.filename)
+        return self.filename, digest
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.abort()
+
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive ``flock`` on ``<path>.lock`` across threads and workers"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(f'{path}.lock', os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def _hash_file(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+blob_store = BlobStore()
@@ -0,0 +1,286 @@
+import functools
+import hashlib
+import hmac
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import quote, urlsplit
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+
+from .http_client import get_session
+
+logger = logging.getLogger(__name__)
+
+UNSIGNED_PAYLOAD = 'UNSIGNED-PAYLOAD'
+EMPTY_SHA256 = hashlib.sha256(b'').hexdigest()
+UPLOAD_ID = re.compile(r'<UploadId>([^<]+)</UploadId>')
+# S3 rejects multipart parts below 5 MiB, except the last one
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+class StorageError(Exception):
+    """The shared store answered with an error"""
+
+
+class LocalBackend:
+    """Blobs live on this node's disk only; the single-node default"""
+
+    shared = False
+
+    def publish(self, digest, path, filename):
+        pass
+
+    def resolve(self, filename):
+        return None
+
+    def fetch(self, digest, path):
+        raise FileNotFoundError(digest)
+
+    def url(self, digest, filename, content_type):
+        return None
+
+
+class S3Backend:
+    """Blobs and public names in an S3-compatible bucket (AWS, MinIO, R2).
+
+    Each blob is stored once under ``blobs/<aa>/<sha256>``, and
+    ``names/<filename>`` holds the digest a public name points at. Every
+    node can then find any download, whichever node fetched it from the
+    CDN. Requests are SigV4-signed over the shared pooled session, so no
+    SDK is needed. Large blobs go up as multipart uploads read part by part
+    from disk, a few parts at a time.
+    """
+
+    shared = True
+
+    def __init__(self, endpoint_url, bucket, access_key, secret_key, region='us-east-1',
+                 prefix='', addressing='path', public_url=None, part_size=None,
+                 upload_concurrency=None, url_expiry=None):
+        self.endpoint_url = endpoint_url.rstrip('/')
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.prefix = prefix
+        self.addressing = addressing
+        # Clients may reach the bucket under another host than this server
+        self.public_url = (public_url or endpoint_url).rstrip('/')
+        self.part_size = max(MIN_PART_SIZE, part_size or settings.STORAGE_S3_PART_SIZE)
+        self.upload_concurrency = upload_concurrency or settings.STORAGE_S3_UPLOAD_CONCURRENCY
+        self.url_expiry = url_expiry or settings.STORAGE_URL_EXPIRY
+
+    def blob_key(self, digest):
+        return f'{self.prefix}blobs/{digest[:2]}/{digest}'
+
+    def name_key(self, filename):
+        return f'{self.prefix}names/{filename}'
+
+    def publish(self, digest, path, filename):
+        """Upload a blob unless the bucket has it, then point ``filename`` at it"""
+        if self.head(self.blob_key(digest)) is None:
+            self.put_file(self.blob_key(digest), path, digest)
+        self.request('PUT', self.name_key(filename), data=digest.encode(),
+                     payload_hash=hashlib.sha256(digest.encode()).hexdigest())
+
+    def resolve(self, filename):
+        """Digest a public name points at, or ``None``"""
+        response = self.request('GET', self.name_key(filename), allow_missing=True)
+        return response.text.strip() if response is not None else None
+
+    def fetch(self, digest, path):
+        """Download a blob to ``path``, streaming it to disk"""
+        response = self.request('GET', self.blob_key(digest), stream=True, allow_missing=True)
+        if response is None:
+            raise FileNotFoundError(digest)
+        with response, open(path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                f.write(chunk)
+
+    def url(self, digest, filename, content_type):
+        """Presigned GET that serves the blob under its public name"""
+        return self.presign('GET', self.blob_key(digest), {
+            'response-content-disposition': f'attachment; filename="{filename}"',
+            'response-content-type': content_type,
+        })
+
+    def head(self, key):
+        response = self.request('HEAD', key, allow_missing=True)
+        return response.headers if response is not None else None
+
+    def put_file(self, key, path, digest=None):
+        size = os.path.getsize(path)
+        if size <= self.part_size:
+            with open(path, 'rb') as f:
+                # A blob's name is its SHA-256, which is exactly the payload hash
+                self.request('PUT', key, data=f, payload_hash=digest or UNSIGNED_PAYLOAD,
+                             headers={'Content-Length': str(size)})
+            return
+        self._put_multipart(key, path, size)
+
+    def _put_multipart(self, key, path, size):
+        response = self.request('POST', key, query={'uploads': ''})
+        match = UPLOAD_ID.search(response.text)
+        if not match:
+            raise StorageError("No UploadId in CreateMultipartUpload response")
+        upload_id = match.group(1)
+        parts = [
+            (number, offset, min(self.part_size, size - offset))
+            for number, offset in enumerate(range(0, size, self.part_size), start=1)
+        ]
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            def upload(part):
+                number, offset, length = part
+                # pread keeps the shared descriptor free of seek races
+                data = os.pread(fd, length, offset)
+                reply = self.request('PUT', key, data=data, query={
+                    'partNumber': str(number), 'uploadId': upload_id,
+                })
+                return number, reply.headers['ETag']
+
+            with ThreadPoolExecutor(self.upload_concurrency, thread_name_prefix='s3-upload') as pool:
+                etags = list(pool.map(upload, parts))
+            body = ''.join(
+                f'<Part><PartNumber>{number}</PartNumber><ETag>{escape(etag)}</ETag></Part>'
+                for number, etag in etags
+            )
+            self.request('POST', key, query={'uploadId': upload_id},
+                         data=f'<CompleteMultipartUpload>{body}</CompleteMultipartUpload>'.encode())
+        except Exception:
+            try:
+                self.request('DELETE', key, query={'uploadId': upload_id})
+            except Exception as e:
+                logger.warning(f"Error aborting multipart upload of {key}: {str(e)}")
+            raise
+        finally:
+            os.close(fd)
+
+    def request(self, method, key, query=None, data=None, headers=None,
+                payload_hash=UNSIGNED_PAYLOAD, stream=False, allow_missing=False):
+        """Signed request against one object; ``None`` for a 404 if allowed"""
+        query = query or {}
+        if data is None:
+            payload_hash = EMPTY_SHA256
+        host, path = self._location(self.endpoint_url, key)
+        amz_date = _amz_date()
+        signed = {
+            'host': host,
+            'x-amz-content-sha256': payload_hash,
+            'x-amz-date': amz_date,
+        }
+        signature, signed_headers, scope = self._signature(method, path, query, signed, payload_hash, amz_date)
+        request_headers = dict(headers or {})
+        request_headers.update({
+            'x-amz-content-sha256': payload_hash,
+            'x-amz-date': amz_date,
+            'Authorization': (
+                f'AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, '
+                f'SignedHeaders={signed_headers}, Signature={signature}'
+            ),
+        })
+        scheme = urlsplit(self.endpoint_url).scheme
+        response = get_session().request(
+            method, f'{scheme}://{host}{path}', params=_canonical_query(query) or None,
+            data=data, headers=request_headers, stream=stream,
+        )
+        if response.status_code == 404 and allow_missing:
+            response.close()
+            return None
+        if response.status_code >= 300:
+            message = response.text[:200] if not stream else ''
+            response.close()
+            raise StorageError(f"{method} {key} failed with status {response.status_code} {message}".strip())
+        return response
+
+    def presign(self, method, key, params=None, expires=None):
+        host, path = self._location(self.public_url, key)
+        amz_date = _amz_date()
+        scope = f'{amz_date[:8]}/{self.region}/s3/aws4_request'
+        query = dict(params or {})
+        query.update({
+            'X-Amz-Algorithm': 'AWS4-HMAC-SHA256',
+            'X-Amz-Credential': f'{self.access_key}/{scope}',
+            'X-Amz-Date': amz_date,
+            'X-Amz-Expires': str(expires or self.url_expiry),
+            'X-Amz-SignedHeaders': 'host',
+        })
+        signature, _, _ = self._signature(method, path, query, {'host': host}, UNSIGNED_PAYLOAD, amz_date)
+        scheme = urlsplit(self.public_url).scheme
+        return f'{scheme}://{host}{path}?{_canonical_query(query)}&X-Amz-Signature={signature}'
+
+    def _location(self, base_url, key):
+        parts = urlsplit(base_url)
+        base_path = parts.path.rstrip('/')
+        if self.addressing == 'virtual':
+            return f'{self.bucket}.{parts.netloc}', f'{base_path}/{quote(key, safe="/~")}'
+        return parts.netloc, f'{base_path}/{self.bucket}/{quote(key, safe="/~")}'
+
+    def _signature(self, method, path, query, headers, payload_hash, amz_date):
+        """SigV4 signature, signed header list and credential scope"""
+        names = sorted(headers)
+        canonical_request = '\n'.join([
+            method,
+            path,
+            _canonical_query(query),
+            ''.join(f'{name}:{str(headers[name]).strip()}\n' for name in names),
+            ';'.join(names),
+            payload_hash,
+        ])
+        scope = f'{amz_date[:8]}/{self.region}/s3/aws4_request'
+        string_to_sign = '\n'.join([
+            'AWS4-HMAC-SHA256', amz_date, scope,
+            hashlib.sha256(canonical_request.encode()).hexdigest(),
+        ])
+        key = _signing_key(self.secret_key, amz_date[:8], self.region)
+        signature = hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+        return signature, ';'.join(names), scope
+
+
+def _amz_date():
+    return datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def _canonical_query(query):
+    return '&'.join(
+        f'{quote(name, safe="-_.~")}={quote(value, safe="-_.~")}'
+        for name, value in sorted(query.items())
+    )
+
+
+@functools.lru_cache(maxsize=16)
+def _signing_key(secret_key, date, region):
+    key = hmac.new(f'AWS4{secret_key}'.encode(), date.encode(), hashlib.sha256).digest()
+    for part in (region, 's3', 'aws4_request'):
+        key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+    return key
+
+
+@functools.lru_cache(maxsize=4)
+def _build(name, endpoint_url, bucket, access_key, secret_key, region, prefix, addressing, public_url):
+    if name == 'local':
+        return LocalBackend()
+    if name == 's3':
+        return S3Backend(
+            endpoint_url, bucket, access_key, secret_key, region=region, prefix=prefix,
+            addressing=addressing, public_url=public_url,
+        )
+    raise ValueError(f"Unknown storage backend: {name}")
+
+
+def configured_backend():
+    """The backend named by STORAGE_BACKEND, built once per configuration"""
+    return _build(
+        settings.STORAGE_BACKEND,
+        settings.STORAGE_S3_ENDPOINT_URL,
+        settings.STORAGE_S3_BUCKET,
+        settings.STORAGE_S3_ACCESS_KEY,
+        settings.STORAGE_S3_SECRET_KEY,
+        settings.STORAGE_S3_REGION,
+        settings.STORAGE_S3_PREFIX,
+        settings.STORAGE_S3_ADDRESSING,
+        settings.STORAGE_S3_PUBLIC_URL,
+    )
@@ -1,3 +1,1138 @@
-from django.test import TestCase
+import asyncio
+import fcntl
+import io
+import json
+import os
+import sqlite3
+import struct
+import tempfile
+import time
+from datetime import timedelta
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import urlsplit
 
-# Create your tests here.
+from django.conf import settings
+from django.http import JsonResponse
+from django.test import AsyncClient, Client, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from . import canonical, views
+from .accounting import DownloadCounter, download_stats
+from .admission import AdmissionController, Overloaded
+from . import async_views
+from .async_views import adownload_video
+from .cache import CachedError, MetadataCache
+from .http_client import build_session, close_async_session, guarded_request
+from .jobs import job_queue
+from .models import ShortLink, VideoDownload
+from .middleware import RateLimitMiddleware
+from .mp4 import MP4Error, box, faststart, full_box, needs_faststart, read_moov, tracks
+from .ratelimit import RateLimitPolicy, SlidingWindowLimiter, client_ip
+from .reaper import StorageReaper
+from .responses import aiterate, file_response, parse_range_header
+from .resolvers import Provider, ResolverEngine
+from .scraper import PageScanner, scrape_video_info
+from .segmented import RangesUnsupported, SegmentedDownloader
+from .storage import BlobWriter, blob_store
+
+
+class StubServer:
+    """Local HTTP server answering from a ``{path: (status, headers, body)}`` map.
+
+    A body may also be a list of byte strings and callables; it is then sent
+    piece by piece, calling each callable in between.
+    """
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.paths = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.paths.append(self.path)
+                status, headers, body = server.routes.get(self.path, (404, {}, b''))
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value.format(base=server.url))
+                if isinstance(body, bytes):
+                    self.send_header('Content-Length', str(len(body)))
+                    body = [body]
+                self.end_headers()
+                for piece in body:
+                    if callable(piece):
+                        piece()
+                        continue
+                    self.wfile.write(piece)
+                    self.wfile.flush()
+
+            do_HEAD = do_GET
+
+            def do_POST(self):
+                self.do_GET()
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self._server.server_address[1]}'
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class UrlPolicyTests(SimpleTestCase):
+    def test_tiktok_links_and_ids_are_accepted(self):
+        for url in (
+            'https://www.tiktok.com/@user/video/7234567890123456789',
+            'vm.tiktok.com/ZMabc123/',
+            'http://m.tiktok.com/v/7234567890123456789.html',
+            '7234567890123456789',
+        ):
+            self.assertEqual(canonical.require_tiktok_url(url), url)
+
+    def test_other_hosts_are_rejected(self):
+        for url in (
+            'http://127.0.0.1:8000/page',
+            'https://tiktok.com.evil.example/video/1',
+            'https://eviltiktok.com/video/1',
+            'file:///etc/passwd',
+            'ftp://www.tiktok.com/video/1',
+            '',
+            None,
+        ):
+            with self.assertRaises(ValueError):
+                canonical.require_tiktok_url(url)
+
+    def test_media_hosts_come_from_the_allow_list(self):
+        self.assertTrue(canonical.is_media_url('https://v16-webapp.tiktokcdn-us.com/abc/video.mp4'))
+        self.assertTrue(canonical.is_media_url('https://tikwm.com/video/media/play/1.mp4'))
+        self.assertFalse(canonical.is_media_url('http://169.254.169.254/latest/meta-data/'))
+        self.assertFalse(canonical.is_media_url('https://tiktokcdn.com.evil.example/a.mp4'))
+        self.assertFalse(canonical.is_media_url('gopher://tikwm.com/1'))
+        with override_settings(MEDIA_ALLOWED_HOSTS=['127.0.0.1']):
+            self.assertTrue(canonical.is_media_url('http://127.0.0.1:9000/video/1.mp4'))
+
+
+class GuardedRequestTests(SimpleTestCase):
+    def allowed(self, url):
+        return urlsplit(url).path.startswith('/public/')
+
+    def test_allowed_redirects_are_followed(self):
+        routes = {
+            '/public/a': (302, {'Location': '/public/b'}, b''),
+            '/public/b': (200, {}, b'ok'),
+        }
+        with StubServer(routes) as server:
+            response = guarded_request('GET', f'{server.url}/public/a', self.allowed)
+        self.assertEqual(response.content, b'ok')
+        self.assertEqual(server.paths, ['/public/a', '/public/b'])
+
+    def test_redirect_off_the_allow_list_is_never_fetched(self):
+        routes = {
+            '/public/a': (302, {'Location': '{base}/internal'}, b''),
+            '/internal': (200, {}, b'secret'),
+        }
+        with StubServer(routes) as server:
+            with self.assertRaises(ValueError):
+                guarded_request('GET', f'{server.url}/public/a', self.allowed)
+        self.assertEqual(server.paths, ['/public/a'])
+
+    def test_redirect_loops_are_cut_off(self):
+        routes = {'/public/a': (302, {'Location': '/public/a'}, b'')}
+        with StubServer(routes) as server:
+            with self.assertRaisesMessage(ValueError, 'Too many redirects'):
+                guarded_request('GET', f'{server.url}/public/a', self.allowed)
+
+
+class ShortLinkTests(TestCase):
+    def test_redirects_are_followed_only_on_tiktok(self):
+        session, adapter = fake_session({
+            'https://vm.tiktok.com/ZMgood/': (301, {'Location': 'https://www.tiktok.com/@a/video/7234567890123456789'}, b''),
+            'https://www.tiktok.com/@a/video/7234567890123456789': (200, {}, b''),
+            'https://vm.tiktok.com/ZMbad/': (301, {'Location': 'http://169.254.169.254/@a/video/1234567890'}, b''),
+        })
+        index = canonical.ShortLinkIndex(maxsize=10)
+        with mock.patch('downloader.http_client.get_session', return_value=session):
+            self.assertEqual(index.resolve('vm.tiktok.com/ZMgood/'), '7234567890123456789')
+            self.assertIsNone(index.resolve('vm.tiktok.com/ZMbad/'))
+        self.assertNotIn('http://169.254.169.254/@a/video/1234567890', adapter.urls)
+        self.assertEqual(ShortLink.objects.get().video_id, '7234567890123456789')
+
+
+class UpstreamSessionTests(SimpleTestCase):
+    def test_cookies_are_not_kept_between_requests(self):
+        routes = {'/a': (200, {'Set-Cookie': 'session=abc; Path=/'}, b'ok')}
+        with StubServer(routes) as server:
+            session = build_session()
+            session.get(f'{server.url}/a')
+        self.assertEqual(len(session.cookies), 0)
+
+    @override_settings(UPSTREAM_RETRIES=2, UPSTREAM_MAX_RETRY_AFTER=0.05)
+    def test_long_retry_after_is_capped(self):
+        with StubServer({'/busy': (503, {'Retry-After': '3600'}, b'')}) as server:
+            start = time.monotonic()
+            response = build_session().get(f'{server.url}/busy')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(server.paths, ['/busy'] * 3)
+        self.assertLess(time.monotonic() - start, 5)
+
+
+class FakeAdapter:
+    """requests transport adapter answering from a ``{url: (status, headers, body)}`` map"""
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.urls = []
+
+    def send(self, request, **kwargs):
+        from requests.adapters import HTTPAdapter
+        from urllib3 import HTTPResponse
+
+        self.urls.append(request.url)
+        status, headers, body = self.routes.get(request.url, (404, {}, b''))
+        raw = HTTPResponse(body=io.BytesIO(body), headers=headers, status=status, preload_content=False)
+        return HTTPAdapter().build_response(request, raw)
+
+    def close(self):
+        pass
+
+
+def fake_session(routes):
+    session = build_session()
+    adapter = FakeAdapter(routes)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session, adapter
+
+
+def page_state(video):
+    state = {'__DEFAULT_SCOPE__': {'webapp.video-detail': {'itemInfo': {'itemStruct': {
+        'id': '1', 'desc': 'clip', 'author': {'uniqueId': 'someone'}, 'video': video,
+    }}}}}
+    return (
+        '<html><head><script id="__UNIVERSAL_DATA_FOR_REHYDRATION__" type="application/json">'
+        + json.dumps(state) + '</script></head><body>' + 'x' * 100000 + '</body></html>'
+    ).encode()
+
+
+class ScraperTests(SimpleTestCase):
+    page_url = 'https://www.tiktok.com/@someone/video/1'
+
+    def test_state_blob_is_found_across_chunk_boundaries(self):
+        page = page_state({'playAddr': 'https://v16.tiktokcdn.com/1.mp4'})
+        for size in (1, 7, 64, 4096):
+            scanner = PageScanner()
+            done = False
+            for offset in range(0, len(page), size):
+                if scanner.feed(page[offset:offset + size]):
+                    done = True
+                    break
+            self.assertTrue(done)
+            self.assertEqual(scanner.kind, '__UNIVERSAL_DATA_FOR_REHYDRATION__')
+            self.assertEqual(json.loads(scanner.blob)['__DEFAULT_SCOPE__']['webapp.video-detail']
+                             ['itemInfo']['itemStruct']['id'], '1')
+            # Nothing after the blob was needed
+            self.assertLess(offset, len(page) - 90000)
+
+    def test_page_is_parsed_into_video_info(self):
+        session, _ = fake_session({self.page_url: (200, {}, page_state({
+            'playAddr': 'https://v16.tiktokcdn.com/1.mp4', 'cover': 'https://p16.tiktokcdn.com/1.jpg',
+        }))})
+        info = scrape_video_info(session, self.page_url, {}, '1')
+        self.assertEqual(info['author'], '@someone')
+        self.assertEqual(info['download_urls']['sd'], 'https://v16.tiktokcdn.com/1.mp4')
+
+    def test_redirect_off_tiktok_is_not_followed(self):
+        session, adapter = fake_session({
+            self.page_url: (302, {'Location': 'http://127.0.0.1:8000/admin/'}, b''),
+        })
+        with self.assertRaises(ValueError):
+            scrape_video_info(session, self.page_url, {}, '1')
+        self.assertEqual(adapter.urls, [self.page_url])
+
+    def test_non_tiktok_url_is_never_fetched(self):
+        session, adapter = fake_session({})
+        with self.assertRaises(ValueError):
+            scrape_video_info(session, 'http://169.254.169.254/latest/meta-data/', {}, None)
+        self.assertEqual(adapter.urls, [])
+
+
+def video_info(name):
+    return {'id': '1', 'download_urls': {'hd': f'https://tikwm.com/{name}.mp4', 'sd': ''}}
+
+
+class ResolverEngineTests(SimpleTestCase):
+    def failing(self, url):
+        raise ValueError('upstream down')
+
+    def test_failure_falls_back_to_the_next_provider(self):
+        engine = ResolverEngine([
+            Provider('first', self.failing, failure_threshold=5, cooldown=30),
+            Provider('second', lambda url: video_info('second'), failure_threshold=5, cooldown=30),
+        ])
+        info = engine.resolve('https://www.tiktok.com/@a/video/1')
+        self.assertEqual(info['download_urls']['hd'], 'https://tikwm.com/second.mp4')
+        self.assertEqual(engine.stats()['first']['failures'], 1)
+
+    def test_answers_without_download_urls_do_not_count(self):
+        engine = ResolverEngine([
+            Provider('empty', lambda url: {'download_urls': {}}, failure_threshold=5, cooldown=30),
+            Provider('good', lambda url: video_info('good'), failure_threshold=5, cooldown=30),
+        ])
+        self.assertEqual(engine.resolve('x')['download_urls']['hd'], 'https://tikwm.com/good.mp4')
+
+    def test_breaker_opens_after_consecutive_failures(self):
+        provider = Provider('flaky', self.failing, failure_threshold=2, cooldown=30)
+        engine = ResolverEngine([provider])
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                engine.resolve('x')
+        self.assertEqual(provider.state, 'open')
+        with self.assertRaisesMessage(ValueError, 'all providers unavailable'):
+            engine.resolve('x')
+
+
+class ScrapeSsrfTests(SimpleTestCase):
+    """Non-TikTok input never reaches a provider or the stream proxy"""
+
+    def page(self, base):
+        state = {'__DEFAULT_SCOPE__': {'webapp.video-detail': {'itemInfo': {'itemStruct': {
+            'id': '1', 'video': {'playAddr': f'{base}/secret'},
+        }}}}}
+        return (
+            '<script id="__UNIVERSAL_DATA_FOR_REHYDRATION__" type="application/json">'
+            + json.dumps(state) + '</script>'
+        ).encode()
+
+    def test_internal_url_is_refused_before_any_fetch(self):
+        with StubServer({'/secret': (200, {}, b'TOP SECRET')}) as server:
+            server.routes['/page'] = (200, {}, self.page(server.url))
+            request = RequestFactory().get('/download/stream/', {'url': f'{server.url}/page'})
+            response = views.stream_video(request)
+            with self.assertRaises(ValueError):
+                views.fetch_tiktok_info(f'{server.url}/page')
+        self.assertNotIn(b'TOP SECRET', response.content)
+        self.assertEqual(json.loads(response.content)['status'], 'error')
+        self.assertEqual(server.paths, [])
+
+    def test_downloads_need_a_video_id(self):
+        info = {'id': '', 'download_urls': {'hd': 'https://v16.tiktokcdn.com/1.mp4', 'sd': '', 'audio': ''}}
+        with mock.patch.object(views, 'download_video') as download:
+            with self.assertRaisesMessage(ValueError, 'Could not extract video ID'):
+                views.download_for_quality(info, 'https://www.tiktok.com/@someone', 'hd')
+        download.assert_not_called()
+        with self.assertRaises(ValueError):
+            blob_store.filename_for(None, 'hd')
+
+    def test_cdn_url_from_metadata_must_be_allowed(self):
+        info = {'download_urls': {'hd': 'http://127.0.0.1:9/secret', 'sd': '', 'audio': ''}}
+        with self.assertRaises(ValueError):
+            views.select_download_url(info, 'hd')
+
+
+class AsyncDownloadTests(SimpleTestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(
+            MEDIA_ROOT=media.name, MEDIA_ALLOWED_HOSTS=['127.0.0.1'], STORAGE_BACKEND='local',
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        # Accounting is flushed by a background thread outside the test database
+        recorder = mock.patch.object(download_stats, 'record')
+        recorder.start()
+        self.addCleanup(recorder.stop)
+
+    def download(self, url, count):
+        async def run():
+            try:
+                return await asyncio.gather(*[adownload_video(url, '42', 'hd') for _ in range(count)])
+            finally:
+                await close_async_session()
+        return asyncio.run(run())
+
+    def test_concurrent_calls_share_one_transfer(self):
+        body = b'v' * 300000
+        with StubServer({'/video/42.mp4': (200, {}, body)}) as server:
+            filenames = self.download(f'{server.url}/video/42.mp4', 20)
+        self.assertEqual(set(filenames), {'tiktok_42_hd.mp4'})
+        self.assertEqual(server.paths, ['/video/42.mp4'])
+        with open(blob_store.path('tiktok_42_hd.mp4'), 'rb') as f:
+            self.assertEqual(f.read(), body)
+
+    def test_commit_runs_off_the_event_loop(self):
+        threads = []
+        commit = BlobWriter.commit
+
+        def record_thread(writer):
+            threads.append(threading.current_thread())
+            return commit(writer)
+
+        with StubServer({'/video/42.mp4': (200, {}, b'v' * 1000)}) as server:
+            with mock.patch.object(BlobWriter, 'commit', record_thread):
+                self.download(f'{server.url}/video/42.mp4', 1)
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.main_thread())
+
+
+LOCMEM_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'shared'},
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES, RATELIMIT_ENABLE=False)
+class JobEventTests(SimpleTestCase):
+    def test_events_reach_asgi_clients_while_the_job_runs(self):
+        release = threading.Event()
+
+        def task(progress=None):
+            progress(10, 100)
+            release.wait(5)
+            return {'download_url': '/download/tiktok_1_hd.mp4'}
+
+        job = job_queue.submit('test:events', task)
+
+        async def watch():
+            response = await AsyncClient().get(f"/api/jobs/{job['id']}/events/")
+            stream = aiter(response.streaming_content)
+            first = await anext(stream)
+            finished_early = release.is_set()
+            release.set()
+            rest = b''.join([chunk async for chunk in stream])
+            return first, finished_early, rest
+
+        first, finished_early, rest = asyncio.run(watch())
+        self.assertFalse(finished_early)
+        self.assertIn(b'event: progress', first)
+        self.assertNotIn(b'"status": "done"', first)
+        self.assertIn(b'"status": "done"', rest)
+
+    def test_submitted_job_is_not_changed_by_the_worker(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def task(progress=None):
+            started.set()
+            release.wait(5)
+            return {'download_url': '/download/tiktok_1_hd.mp4'}
+
+        job = job_queue.submit('test:snapshot', task)
+        started.wait(5)
+        self.assertEqual(job['status'], 'queued')
+        self.assertEqual(job_queue.get(job['id'])['status'], 'running')
+        release.set()
+        deadline = time.monotonic() + 5
+        while job_queue.get(job['id'])['status'] != 'done' and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(job['status'], 'queued')
+        self.assertNotIn('download_url', job)
+
+    def test_event_stream_is_only_offered_under_asgi(self):
+        job = {'id': 'abc', 'status': 'queued'}
+        body = {'url': 'https://www.tiktok.com/@a/video/7234567890123456789'}
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media), \
+                mock.patch.object(views.job_queue, 'submit', return_value=job):
+            request = RequestFactory().post('/api/process/', body, content_type='application/json')
+            wsgi = json.loads(views.process_video(request).content)
+            asgi = asyncio.run(AsyncClient().post('/api/process/', body, content_type='application/json')).json()
+        self.assertNotIn('events_url', wsgi)
+        self.assertEqual(wsgi['status_url'], '/api/jobs/abc/')
+        self.assertEqual(asgi['events_url'], '/api/async/jobs/abc/events/')
+
+
+@override_settings(CACHES=LOCMEM_CACHES, RATELIMIT_ENABLE=False, MEDIA_ALLOWED_HOSTS=['127.0.0.1'])
+class AsyncStreamTests(SimpleTestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name, STORAGE_BACKEND='local')
+        settings.enable()
+        self.addCleanup(settings.disable)
+        recorder = mock.patch.object(download_stats, 'record')
+        recorder.start()
+        self.addCleanup(recorder.stop)
+
+    def test_proxy_sends_chunks_before_the_upstream_finishes(self):
+        release = threading.Event()
+        half = b'v' * 100000
+        route = (200, {'Content-Type': 'video/mp4', 'Content-Length': str(2 * len(half))},
+                 [half, lambda: release.wait(5), half])
+
+        async def watch(server):
+            info = {'id': '42', 'download_urls': {'hd': f'{server.url}/video/42.mp4', 'sd': '', 'audio': ''}}
+            with mock.patch.object(async_views, 'afetch_tiktok_info', mock.AsyncMock(return_value=info)):
+                response = await AsyncClient().get(
+                    '/download/async/stream/', {'url': 'https://www.tiktok.com/@a/video/42'}
+                )
+            try:
+                stream = aiter(response.streaming_content)
+                first = await anext(stream)
+                finished_early = release.is_set()
+                release.set()
+                rest = b''.join([chunk async for chunk in stream])
+            finally:
+                await close_async_session()
+            return response, first, finished_early, rest
+
+        with StubServer({'/video/42.mp4': route}) as server:
+            response, first, finished_early, rest = asyncio.run(watch(server))
+        self.assertFalse(finished_early)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="tiktok_42_hd.mp4"')
+        self.assertEqual(first + rest, half + half)
+        # The full body was also kept
+        with open(blob_store.path('tiktok_42_hd.mp4'), 'rb') as f:
+            self.assertEqual(f.read(), half + half)
+
+    @override_settings(STREAM_TEE_TO_STORE=False)
+    def test_audio_falls_back_to_the_music_track_before_headers_go_out(self):
+        # A stored video without a sound track cannot be demuxed
+        blob_store.save('42', 'sd', [moov_last_mp4([b'v' * 100] * 3)])
+        music = b'm' * 1000
+
+        async def fetch_async(server, info):
+            with mock.patch.object(async_views, 'afetch_tiktok_info', mock.AsyncMock(return_value=info)):
+                response = await AsyncClient().get(
+                    '/download/async/stream/', {'url': 'https://www.tiktok.com/@a/video/42', 'quality': 'audio'}
+                )
+            try:
+                if response.streaming:
+                    return response, b''.join([chunk async for chunk in response.streaming_content])
+                return response, response.content
+            finally:
+                await close_async_session()
+
+        with StubServer({'/music/42.mp3': (200, {'Content-Type': 'audio/mpeg'}, music)}) as server:
+            for audio_url, expected in ((f'{server.url}/music/42.mp3', music), ('', None)):
+                info = {'id': '42', 'download_urls': {'hd': '', 'sd': '', 'audio': audio_url}}
+                with mock.patch.object(views, 'fetch_tiktok_info', return_value=info):
+                    response = Client().get(
+                        '/download/stream/', {'url': 'https://www.tiktok.com/@a/video/42', 'quality': 'audio'}
+                    )
+                    sync_body = b''.join(response.streaming_content) if response.streaming else response.content
+                async_response, async_body = asyncio.run(fetch_async(server, info))
+                for response, body in ((response, sync_body), (async_response, async_body)):
+                    if expected is None:
+                        self.assertEqual(json.loads(body)['status'], 'error')
+                    else:
+                        self.assertEqual(response['Content-Disposition'], 'attachment; filename="tiktok_42_audio.mp3"')
+                        self.assertEqual(body, expected)
+
+    def test_stream_mode_points_asgi_clients_at_the_async_proxy(self):
+        body = {'url': 'https://www.tiktok.com/@a/video/42', 'mode': 'stream'}
+        request = RequestFactory().post('/api/process/', body, content_type='application/json')
+        wsgi = json.loads(views.process_video(request).content)
+        asgi = asyncio.run(AsyncClient().post('/api/process/', body, content_type='application/json')).json()
+        self.assertTrue(wsgi['download_url'].startswith('/download/stream/?'))
+        self.assertTrue(asgi['download_url'].startswith('/download/async/stream/?'))
+
+
+@override_settings(CACHES=LOCMEM_CACHES, RATELIMIT_ENABLE=False)
+class BatchStreamTests(SimpleTestCase):
+    def test_ndjson_lines_reach_asgi_clients_as_items_finish(self):
+        release = threading.Event()
+        fast = 'https://www.tiktok.com/@a/video/1'
+        slow = 'https://www.tiktok.com/@a/video/2'
+
+        def fetch(url):
+            if url == slow:
+                release.wait(5)
+            return {'id': url[-1], 'download_urls': {}}
+
+        async def watch():
+            response = await AsyncClient().post('/api/batch/', {'urls': [fast, slow]}, content_type='application/json')
+            stream = aiter(response.streaming_content)
+            first = await anext(stream)
+            finished_early = release.is_set()
+            release.set()
+            rest = b''.join([chunk async for chunk in stream])
+            return first, finished_early, rest
+
+        with mock.patch.object(views, 'fetch_tiktok_info', fetch):
+            first, finished_early, rest = asyncio.run(watch())
+        self.assertFalse(finished_early)
+        self.assertEqual(json.loads(first)['url'], fast)
+        self.assertEqual(json.loads(rest)['url'], slow)
+
+    def test_bodies_are_pulled_off_the_default_executor(self):
+        threads = []
+
+        def chunks():
+            try:
+                threads.append(threading.current_thread().name)
+                yield b'a'
+                yield b'b'
+            finally:
+                threads.append(threading.current_thread().name)
+
+        async def consume():
+            body = aiterate(chunks())
+            first = await anext(body)
+            await body.aclose()
+            return first
+
+        self.assertEqual(asyncio.run(consume()), b'a')
+        self.assertEqual(len(threads), 2)
+        self.assertTrue(all(name.startswith('stream-iterator') for name in threads))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RateLimitTests(SimpleTestCase):
+    def setUp(self):
+        self.limiter = SlidingWindowLimiter('default')
+        self.policy = RateLimitPolicy('test', '/api/', limit=10, window=60)
+        self.limiter.cache.clear()
+
+    def test_budget_is_spent_within_a_window(self):
+        for count in range(10):
+            self.assertEqual(self.limiter.hit(self.policy, 'a', now=10), (True, 9 - count, 0))
+        # The previous window decays from 10 to 4 by the time one more fits
+        self.assertEqual(self.limiter.hit(self.policy, 'a', now=10), (False, 0, 56))
+        self.assertFalse(self.limiter.hit(self.policy, 'a', now=65)[0])
+        self.assertEqual(self.limiter.hit(self.policy, 'a', now=66), (True, 0, 0))
+        # Other clients have their own budget
+        self.assertTrue(self.limiter.hit(self.policy, 'b', now=10)[0])
+
+    def test_previous_window_is_weighted_by_its_overlap(self):
+        for _ in range(10):
+            self.limiter.hit(self.policy, 'a', now=0)
+        # Halfway through the next window the old count weighs 5
+        self.assertEqual(self.limiter.hit(self.policy, 'a', now=90), (True, 4, 0))
+        for _ in range(4):
+            self.assertTrue(self.limiter.hit(self.policy, 'a', now=90)[0])
+        self.assertEqual(self.limiter.hit(self.policy, 'a', now=90), (False, 0, 6))
+        self.assertTrue(self.limiter.hit(self.policy, 'a', now=96)[0])
+
+    def test_header_key_needs_a_trusted_proxy(self):
+        policy = RateLimitPolicy('test', '/api/', limit=10, window=60, key='header:X-Api-Key')
+        request = RequestFactory().post('/api/process/', HTTP_X_API_KEY='k', REMOTE_ADDR='10.1.2.3')
+        self.assertEqual(policy.client_key(request), '10.1.2.3')
+        with override_settings(RATELIMIT_TRUSTED_PROXIES=['10.0.0.0/8']):
+            self.assertEqual(policy.client_key(request), 'k')
+            request.META['REMOTE_ADDR'] = '192.0.2.1'
+            self.assertEqual(policy.client_key(request), '192.0.2.1')
+
+    @override_settings(RATELIMIT_IP_HEADER='X-Forwarded-For', RATELIMIT_TRUSTED_PROXIES=['10.0.0.0/8'])
+    def test_forwarded_ip_needs_a_trusted_proxy(self):
+        spoofed = RequestFactory().get('/', HTTP_X_FORWARDED_FOR='203.0.113.9', REMOTE_ADDR='192.0.2.1')
+        self.assertEqual(client_ip(spoofed), '192.0.2.1')
+        # The client's own entries sit left of what our proxies appended
+        proxied = RequestFactory().get(
+            '/', HTTP_X_FORWARDED_FOR='203.0.113.9, 198.51.100.7, 10.0.0.2', REMOTE_ADDR='10.0.0.1'
+        )
+        self.assertEqual(client_ip(proxied), '198.51.100.7')
+
+    def test_async_requests_are_counted_off_the_event_loop(self):
+        threads = []
+        check = RateLimitMiddleware.check
+
+        def record_thread(middleware, request):
+            threads.append(threading.current_thread())
+            return check(middleware, request)
+
+        async def get_response(request):
+            return JsonResponse({'status': 'success'})
+
+        async def run():
+            middleware = RateLimitMiddleware(get_response)
+            response = await middleware(RequestFactory().post('/api/process/'))
+            return response, threading.current_thread()
+
+        with mock.patch.object(RateLimitMiddleware, 'check', record_thread):
+            response, loop_thread = asyncio.run(run())
+        self.assertEqual(response['X-RateLimit-Remaining'], '9')
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], loop_thread)
+
+
+def moov_last_mp4(samples, per_chunk=2):
+    """An MP4 with one video track and its moov after the media data"""
+    ftyp = box(b'ftyp', b'isom', struct.pack('>I', 512), b'isomiso2mp41')
+    mdat = box(b'mdat', *samples)
+    offsets = []
+    position = len(ftyp) + 8
+    for index, sample in enumerate(samples):
+        if index % per_chunk == 0:
+            offsets.append(position)
+        position += len(sample)
+    stbl = box(
+        b'stbl',
+        full_box(b'stsd', 0, 0, struct.pack('>I', 0)),
+        full_box(b'stts', 0, 0, struct.pack('>III', 1, len(samples), 512)),
+        full_box(b'stsc', 0, 0, struct.pack('>IIII', 1, 1, per_chunk, 1)),
+        full_box(b'stsz', 0, 0, struct.pack('>II', 0, len(samples)),
+                 struct.pack(f'>{len(samples)}I', *map(len, samples))),
+        full_box(b'stco', 0, 0, struct.pack('>I', len(offsets)), struct.pack(f'>{len(offsets)}I', *offsets)),
+    )
+    trak = box(
+        b'trak',
+        full_box(b'tkhd', 0, 3, struct.pack('>IIII', 0, 0, 1, 0), bytes(64)),
+        box(b'mdia',
+            full_box(b'mdhd', 0, 0, struct.pack('>IIII', 0, 0, 12800, 512 * len(samples)), bytes(4)),
+            full_box(b'hdlr', 0, 0, bytes(4), b'vide', bytes(13)),
+            box(b'minf', stbl)),
+    )
+    return ftyp + mdat + box(b'moov', trak)
+
+
+def sample_bytes(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+        f.seek(0)
+        moov = read_moov(f)
+    return [data[offset:offset + size] for offset, size, *_ in tracks(moov)[0].samples()]
+
+
+class FaststartTests(SimpleTestCase):
+    def test_moov_moves_first_and_samples_survive(self):
+        samples = [bytes([n]) * (100 + n) for n in range(7)]
+        with tempfile.TemporaryDirectory() as directory:
+            src = os.path.join(directory, 'in.mp4')
+            dst = os.path.join(directory, 'out.mp4')
+            with open(src, 'wb') as f:
+                f.write(moov_last_mp4(samples))
+            self.assertTrue(needs_faststart(src))
+            self.assertEqual(sample_bytes(src), samples)
+
+            faststart(src, dst)
+            self.assertFalse(needs_faststart(dst))
+            self.assertEqual(os.path.getsize(dst), os.path.getsize(src))
+            self.assertEqual(sample_bytes(dst), samples)
+
+    @override_settings(STORAGE_BACKEND='local')
+    def test_truncated_chunk_offsets_store_the_file_as_is(self):
+        data = bytearray(moov_last_mp4([b'x' * 100] * 3))
+        # An stco claiming more entries than the moov holds
+        count = data.rindex(b'stco') + 8
+        data[count:count + 4] = struct.pack('>I', 1000)
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media):
+            src = os.path.join(media, 'in.mp4')
+            with open(src, 'wb') as f:
+                f.write(data)
+            with self.assertRaises(MP4Error):
+                faststart(src, os.path.join(media, 'out.mp4'))
+
+            filename, _ = blob_store.save('1', 'hd', [bytes(data)])
+            with open(blob_store.path(filename), 'rb') as f:
+                self.assertEqual(f.read(), bytes(data))
+
+
+class ReaperTests(SimpleTestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media = media.name
+        settings = override_settings(MEDIA_ROOT=media.name, STORAGE_BACKEND='local')
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.now = time.time()
+
+    def reaper(self, **kwargs):
+        options = dict(max_age=0, quota=0, pause=0, grace=600, hls_max_age=0, hls_quota=0,
+                       thumbnail_max_age=0, thumbnail_quota=0)
+        options.update(kwargs)
+        return StorageReaper(**options)
+
+    def write(self, path, size, age):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        os.utime(path, (self.now - age, self.now - age))
+
+    def rendition(self, key, age, size=1000):
+        directory = os.path.join(self.media, 'hls', key)
+        self.write(os.path.join(directory, 'index.m3u8'), 100, age)
+        self.write(os.path.join(directory, '0.m4s'), size, age)
+        os.utime(directory, (self.now - age, self.now - age))
+        return directory
+
+    def test_hls_renditions_of_missing_blobs_are_removed(self):
+        orphan = self.rendition('a' * 64, age=3600)
+        kept = self.rendition('b' * 64, age=3600)
+        self.write(blob_store.blob_path('b' * 64), 10, 3600)
+        report = self.reaper().run()
+        self.assertFalse(os.path.exists(orphan))
+        self.assertTrue(os.path.exists(kept))
+        self.assertEqual(report.counts, {'hls orphan': 1})
+
+    def test_hls_renditions_expire_and_respect_the_quota(self):
+        old = self.rendition('tiktok_1_hd-10-1', age=7200)
+        older = self.rendition('tiktok_2_hd-10-1', age=5400)
+        newer = self.rendition('tiktok_3_hd-10-1', age=3600)
+        fresh = self.rendition('tiktok_4_hd-10-1', age=60, size=10 ** 6)
+        report = self.reaper(hls_max_age=6000, hls_quota=1500).run()
+        self.assertFalse(os.path.exists(old))
+        self.assertFalse(os.path.exists(older))
+        self.assertTrue(os.path.exists(newer))
+        # Renditions being cut right now are left alone
+        self.assertTrue(os.path.exists(fresh))
+        self.assertEqual(report.counts, {'hls expired': 1, 'hls quota': 1})
+
+    def test_thumbnails_are_evicted_per_video(self):
+        root = os.path.join(self.media, 'thumbnails')
+        for name, age in (('1_source', 9000), ('1_320.webp', 9000), ('1_320.webp.lock', 9000),
+                          ('2_source', 9000), ('2_160.jpeg', 1000), ('3_source', 4000), ('4_source', 60)):
+            self.write(os.path.join(root, name), 1000, age)
+        report = self.reaper(thumbnail_max_age=8000, thumbnail_quota=2500).run()
+        # Video 2 was rendered recently, so its older source stays with it;
+        # 3 is the oldest left once 1 expired and goes to fit the quota
+        self.assertEqual(sorted(os.listdir(root)), ['2_160.jpeg', '2_source', '4_source'])
+        self.assertEqual(report.counts, {'thumbnail expired': 1, 'thumbnail quota': 1})
+
+    def test_stale_partial_downloads_are_removed_unless_locked(self):
+        tmp = blob_store.tmp_dir
+        for stem in ('tiktok_1_hd.mp4', 'tiktok_2_hd.mp4'):
+            for suffix in ('.part', '.part.json', '.lock'):
+                self.write(os.path.join(tmp, stem + suffix), 100, 7 * 3600)
+        held = os.open(os.path.join(tmp, 'tiktok_2_hd.mp4.lock'), os.O_RDONLY)
+        self.addCleanup(os.close, held)
+        fcntl.flock(held, fcntl.LOCK_EX)
+
+        report = self.reaper(tmp_max_age=6 * 3600).run()
+        self.assertEqual(sorted(os.listdir(tmp)), [
+            'tiktok_2_hd.mp4.lock', 'tiktok_2_hd.mp4.part', 'tiktok_2_hd.mp4.part.json',
+        ])
+        self.assertEqual(report.counts, {'stale tmp': 3})
+
+
+class SegmentedDownloadTests(SimpleTestCase):
+    body = b's' * 4096
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.dest = os.path.join(directory.name, 'tiktok_1_hd.mp4')
+        self.downloader = SegmentedDownloader(segments=4, retries=0, allowed=lambda url: True)
+
+    def test_partial_files_go_when_ranges_are_not_honoured(self):
+        # The stub advertises ranges but answers every GET with the whole body
+        with StubServer({'/v.mp4': (200, {'Accept-Ranges': 'bytes'}, self.body)}) as server:
+            with self.assertRaises(RangesUnsupported):
+                self.downloader.download(f'{server.url}/v.mp4', self.dest)
+        self.assertFalse(os.path.exists(self.dest + '.part'))
+        self.assertFalse(os.path.exists(self.dest + '.part.json'))
+        # The lock file stays, unlocked, for the next download
+        fd = os.open(self.dest + '.lock', os.O_RDONLY)
+        self.addCleanup(os.close, fd)
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def test_download_in_progress_elsewhere_is_left_alone(self):
+        held = os.open(self.dest + '.lock', os.O_CREAT | os.O_WRONLY)
+        self.addCleanup(os.close, held)
+        fcntl.flock(held, fcntl.LOCK_EX)
+        with open(self.dest + '.part', 'wb') as f:
+            f.write(b'partial')
+        with StubServer({'/v.mp4': (200, {'Accept-Ranges': 'bytes'}, self.body)}) as server:
+            with self.assertRaisesMessage(RangesUnsupported, 'already in progress'):
+                self.downloader.download(f'{server.url}/v.mp4', self.dest)
+        with open(self.dest + '.part', 'rb') as f:
+            self.assertEqual(f.read(), b'partial')
+
+    def session(self, segment):
+        """Fake upstream whose GETs are answered by ``segment(start, end, attempt)``"""
+        size = len(self.body)
+        attempts = {}
+
+        def request(method, url, **kwargs):
+            return mock.Mock(status_code=200, headers={'Accept-Ranges': 'bytes', 'Content-Length': str(size)}, url=url)
+
+        def get(url, headers, **kwargs):
+            start, end = map(int, headers['Range'][len('bytes='):].split('-'))
+            attempt = attempts[start] = attempts.get(start, -1) + 1
+            chunks = segment(start, end, attempt)
+            return mock.Mock(
+                status_code=206, headers={'Content-Range': f'bytes {start}-{end}/{size}'},
+                iter_content=lambda chunk_size: chunks,
+            )
+
+        return mock.Mock(request=request, get=get)
+
+    def test_a_failed_segment_stops_its_siblings(self):
+        def segment(start, end, attempt):
+            if start == 0:
+                raise RangesUnsupported('gone')
+            for offset in range(start, end + 1, 16):
+                time.sleep(0.05)
+                yield self.body[offset:min(offset + 16, end + 1)]
+
+        downloader = SegmentedDownloader(segments=4, retries=0, session=self.session(segment), allowed=lambda url: True)
+        started = time.monotonic()
+        with self.assertRaises(RangesUnsupported):
+            downloader.download('https://cdn.example/v.mp4', self.dest)
+        # Each sibling alone would take over three seconds
+        self.assertLess(time.monotonic() - started, 1)
+
+    @override_settings(UPSTREAM_BACKOFF=0.1)
+    def test_failed_segments_are_retried_after_a_pause(self):
+        failures = []
+
+        def segment(start, end, attempt):
+            if attempt == 0:
+                failures.append(time.monotonic())
+                raise ConnectionError('reset')
+            yield self.body[start:end + 1]
+
+        downloader = SegmentedDownloader(segments=4, retries=1, session=self.session(segment), allowed=lambda url: True)
+        downloader.download('https://cdn.example/v.mp4', self.dest)
+        self.assertGreaterEqual(time.monotonic() - min(failures), 0.1)
+        with open(self.dest, 'rb') as f:
+            self.assertEqual(f.read(), self.body)
+
+
+class ReaperRecordTests(TestCase):
+    def test_audio_formats_keep_their_own_record(self):
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media, STORAGE_BACKEND='local'):
+            old = time.time() - 7200
+            os.makedirs(blob_store.root)
+            for name in ('tiktok_1_audio.mp3', 'tiktok_1_audio.aac'):
+                with open(blob_store.path(name), 'wb') as f:
+                    f.write(b'a' * 100)
+                os.utime(blob_store.path(name), (old, old))
+            # Only the AAC was fetched recently
+            row = VideoDownload.objects.create(
+                url='https://www.tiktok.com/@a/video/1', video_id='1', quality='audio',
+                file_path=blob_store.path('tiktok_1_audio.aac'), download_count=3,
+            )
+            VideoDownload.objects.filter(id=row.id).update(last_downloaded=timezone.now())
+
+            report = StorageReaper(max_age=3600, quota=0, pause=0, grace=0).run()
+
+            self.assertEqual(sorted(os.listdir(blob_store.root)), ['tiktok_1_audio.aac'])
+        self.assertEqual(report.counts, {'expired': 1})
+        self.assertTrue(VideoDownload.objects.filter(id=row.id).exists())
+
+    def test_expired_unpopular_and_orphaned_files_are_evicted(self):
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media, STORAGE_BACKEND='local'):
+            now = time.time()
+            for video_id, age in (('1', 7200), ('2', 1000), ('3', 500)):
+                filename, _ = blob_store.save(video_id, 'hd', [video_id.encode() * 100])
+                os.utime(blob_store.path(filename), (now - age, now - age))
+            orphan = blob_store.blob_path('f' * 64)
+            os.makedirs(os.path.dirname(orphan))
+            with open(orphan, 'wb') as f:
+                f.write(b'o' * 10)
+            # Video 2 is older than 3 but far more popular
+            rows = {
+                video_id: VideoDownload.objects.create(
+                    url=f'https://www.tiktok.com/@a/video/{video_id}', video_id=video_id, quality='hd',
+                    download_count=count,
+                )
+                for video_id, count in (('1', 1), ('2', 1023))
+            }
+            VideoDownload.objects.filter(video_id='1').update(last_downloaded=timezone.now() - timedelta(hours=2))
+            VideoDownload.objects.filter(video_id='2').update(last_downloaded=timezone.now() - timedelta(seconds=1000))
+
+            report = StorageReaper(max_age=3600, quota=150, pause=0, grace=0, popularity_weight=3600).run()
+
+            self.assertEqual(sorted(os.listdir(blob_store.root)), ['blobs', 'tiktok_2_hd.mp4', 'tmp'])
+            self.assertFalse(os.path.exists(orphan))
+            # Blobs of evicted files went with them
+            self.assertEqual(sum(len(files) for _, _, files in os.walk(blob_store.blobs_dir)), 1)
+        self.assertEqual(report.counts, {'expired': 1, 'quota': 1, 'orphaned': 1})
+        self.assertEqual(report.bytes, {'expired': 100, 'quota': 100, 'orphaned': 10})
+        self.assertFalse(VideoDownload.objects.filter(id=rows['1'].id).exists())
+        self.assertTrue(VideoDownload.objects.filter(id=rows['2'].id).exists())
+
+
+class DownloadCounterTests(TestCase):
+    def test_flush_upserts_one_row_per_video_and_quality(self):
+        counter = DownloadCounter(interval=3600, max_pending=100)
+        with mock.patch.object(counter, '_ensure_thread'):
+            VideoDownload.objects.create(
+                url='https://www.tiktok.com/@a/video/1', video_id='1', quality='hd', download_count=2,
+                content_hash='a' * 64, file_path='tiktok_1_hd.mp4',
+            )
+            counter.record('https://www.tiktok.com/@a/video/1', '1', 'hd', served=3)
+            counter.record('https://www.tiktok.com/@a/video/2', '2', 'hd', 'tiktok_2_hd.mp4', 'b' * 64, served=1)
+            self.assertEqual(counter.flush(), 2)
+            counter.record('https://www.tiktok.com/@a/video/2', '2', 'hd', 'tiktok_2_hd.mp4', 'c' * 64)
+            self.assertEqual(counter.flush(), 1)
+
+        rows = {row.video_id: row for row in VideoDownload.objects.all()}
+        self.assertEqual(len(rows), 2)
+        self.assertEqual((rows['1'].download_count, rows['1'].content_hash), (5, 'a' * 64))
+        self.assertEqual((rows['2'].download_count, rows['2'].content_hash), (1, 'c' * 64))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class MetadataCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = MetadataCache('test', maxsize=16, ttl=60, negative_ttl=60)
+        self.cache.shared.clear()
+
+    def concurrently(self, call, count=10):
+        results = [None] * count
+
+        def run(index):
+            try:
+                results[index] = call()
+            except Exception as e:
+                results[index] = e
+
+        threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads, results
+
+    def test_concurrent_misses_share_one_fetch(self):
+        calls = []
+        release = threading.Event()
+
+        def fetch():
+            calls.append(1)
+            release.wait(5)
+            return {'id': '1'}
+
+        threads, results = self.concurrently(lambda: self.cache.get_or_fetch('id:1', fetch))
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'id': '1'}] * 10)
+        # Later lookups are served from the cache
+        self.assertEqual(self.cache.get_or_fetch('id:1', fetch), {'id': '1'})
+        self.assertEqual(len(calls), 1)
+
+    def test_waiters_get_their_own_error(self):
+        release = threading.Event()
+
+        def fetch():
+            release.wait(5)
+            raise ValueError('upstream down')
+
+        threads, results = self.concurrently(lambda: self.cache.get_or_fetch('id:1', fetch))
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(all(isinstance(error, ValueError) for error in results))
+        self.assertEqual({str(error) for error in results}, {'upstream down'})
+        self.assertEqual(len({id(error) for error in results}), 10)
+        with self.assertRaisesMessage(CachedError, 'upstream down'):
+            self.cache.get_or_fetch('id:1', fetch)
+
+    def test_result_stored_after_the_miss_is_not_fetched_again(self):
+        self.cache._set('id:1', {'value': {'id': '1'}}, 60)
+        fetch = mock.Mock(return_value={'id': 'stale'})
+        # As if the previous leader finished between the miss and the flight
+        with mock.patch.object(self.cache, '_get', return_value=None):
+            self.assertEqual(self.cache.get_or_fetch('id:1', fetch), {'id': '1'})
+        fetch.assert_not_called()
+
+
+class DatabaseSettingsTests(SimpleTestCase):
+    def test_connecting_does_not_change_the_journal_mode(self):
+        # The journal mode is stored in the file; only migration 0005 switches it
+        with tempfile.TemporaryDirectory() as directory:
+            db = sqlite3.connect(os.path.join(directory, 'db.sqlite3'))
+            try:
+                db.executescript(settings.DATABASES['default']['OPTIONS']['init_command'])
+                self.assertEqual(db.execute('PRAGMA journal_mode').fetchone()[0], 'delete')
+            finally:
+                db.close()
+
+
+class RangeParsingTests(SimpleTestCase):
+    def test_single_ranges(self):
+        for header, expected in (
+            ('bytes=0-99', [(0, 99)]),
+            ('bytes=900-', [(900, 999)]),
+            ('bytes=500-5000', [(500, 999)]),
+            ('bytes=-100', [(900, 999)]),
+            ('bytes=-5000', [(0, 999)]),
+            ('bytes= 10 - 19 ', [(10, 19)]),
+        ):
+            self.assertEqual(parse_range_header(header, 1000), expected, header)
+
+    def test_ranges_are_sorted_and_merged(self):
+        self.assertEqual(parse_range_header('bytes=50-59,0-9,5-20,21-21', 1000), [(0, 21), (50, 59)])
+
+    def test_unsatisfiable_ranges_are_dropped(self):
+        self.assertEqual(parse_range_header('bytes=1000-', 1000), [])
+        self.assertEqual(parse_range_header('bytes=-0', 1000), [])
+        self.assertEqual(parse_range_header('bytes=2000-2100,0-0', 1000), [(0, 0)])
+
+    def test_invalid_headers_are_ignored(self):
+        for header in (None, '', 'items=0-1', 'bytes=', 'bytes=5-2', 'bytes=a-b', 'bytes=-',
+                       'bytes=' + ','.join(['0-1'] * 17)):
+            self.assertIsNone(parse_range_header(header, 1000), header)
+
+
+@override_settings(SENDFILE_BACKEND='')
+class FileResponseTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'tiktok_1_hd.mp4')
+        self.data = bytes(range(256)) * 4
+        with open(self.path, 'wb') as f:
+            f.write(self.data)
+
+    def get(self, **headers):
+        request = RequestFactory().get('/download/tiktok_1_hd.mp4', **headers)
+        response = file_response(request, self.path, 'tiktok_1_hd.mp4', digest='abc')
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        response.close()
+        return response, body
+
+    def test_range_gets_a_partial_response(self):
+        response, body = self.get(HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 100-199/1024')
+        self.assertEqual(body, self.data[100:200])
+
+    def test_several_ranges_become_multipart(self):
+        response, body = self.get(HTTP_RANGE='bytes=0-9,-10')
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response['Content-Type'].startswith('multipart/byteranges'))
+        self.assertEqual(int(response['Content-Length']), len(body))
+        self.assertIn(b'Content-Range: bytes 0-9/1024\r\n\r\n' + self.data[:10], body)
+        self.assertIn(b'Content-Range: bytes 1014-1023/1024\r\n\r\n' + self.data[-10:], body)
+
+    def test_unsatisfiable_range_is_416(self):
+        response, _ = self.get(HTTP_RANGE='bytes=5000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */1024')
+
+    def test_stale_if_range_gets_the_whole_file(self):
+        response, body = self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"other"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.data)
+
+    def test_matching_etag_is_not_modified(self):
+        response = file_response(
+            RequestFactory().get('/', HTTP_IF_NONE_MATCH='"abc"'), self.path, 'tiktok_1_hd.mp4', digest='abc',
+        )
+        self.assertEqual(response.status_code, 304)
+
+
+class AdmissionTests(SimpleTestCase):
+    def test_idle_host_is_admitted_while_another_host_has_a_queue(self):
+        controller = AdmissionController(max_active=10, max_per_host=1, max_per_client=10, max_queue=10, timeout=1.5)
+        busy = controller.acquire('https://a.example/1.mp4')
+        queued = threading.Thread(target=lambda: self.assertRaises(
+            Overloaded, controller.acquire, 'https://a.example/2.mp4'))
+        queued.start()
+        deadline = time.monotonic() + 5
+        while not controller.snapshot()['queued'] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(controller.snapshot()['queued'], 1)
+
+        start = time.monotonic()
+        ticket = controller.acquire('https://b.example/1.mp4')
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(controller.snapshot()['hosts'], {'a.example': 1, 'b.example': 1})
+        ticket.release()
+        queued.join()
+        busy.release()
+        self.assertEqual(controller.snapshot()['active'], 0)
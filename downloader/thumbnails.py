@@ -0,0 +1,120 @@
+import logging
+import os
+import re
+import uuid
+from io import BytesIO
+
+from django.conf import settings
+
+from .canonical import is_media_url
+from .http_client import guarded_request
+from .storage import file_lock
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+VIDEO_ID = re.compile(r'^\d+$')
+CONTENT_TYPES = {'webp': 'image/webp', 'jpeg': 'image/jpeg', 'png': 'image/png'}
+
+
+def sniff_format(data):
+    """Image format from magic bytes, as used for the variant extension"""
+    if data[:3] == b'\xff\xd8\xff':
+        return 'jpeg'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'png'
+    return None
+
+
+class ThumbnailStore:
+    """Resized video covers on disk, keyed by video id, width and format.
+
+    The original cover is fetched once into ``<id>_source`` and every
+    variant is rendered from that copy into ``<id>_<width>.<format>``.
+    Work on one file happens under an ``flock``, so concurrent misses in
+    any thread or worker fetch and resize only once while the others wait
+    for the result. Without Pillow the source is served unresized.
+    """
+
+    def __init__(self, root=None):
+        self._root = root
+
+    @property
+    def root(self):
+        return self._root or os.path.join(settings.MEDIA_ROOT, 'thumbnails')
+
+    def widths(self):
+        return settings.THUMBNAIL_WIDTHS
+
+    def variant(self, video_id, width, fmt, cover_url):
+        """Path and format of a rendered variant, creating it if needed.
+
+        ``cover_url`` is a callable returning the upstream cover URL, so the
+        metadata lookup only happens when the source is not on disk yet.
+        """
+        if not VIDEO_ID.match(str(video_id)):
+            raise ValueError("Invalid video id")
+        if width not in self.widths():
+            raise ValueError("Unsupported thumbnail width")
+
+        source = self.source(video_id, cover_url)
+        if Image is None:
+            with open(source, 'rb') as f:
+                return source, sniff_format(f.read(16)) or 'jpeg'
+
+        path = os.path.join(self.root, f'{video_id}_{width}.{fmt}')
+        if os.path.exists(path):
+            return path, fmt
+        with file_lock(path):
+            if not os.path.exists(path):
+                self._render(source, path, width, fmt)
+        return path, fmt
+
+    def source(self, video_id, cover_url):
+        path = os.path.join(self.root, f'{video_id}_source')
+        if os.path.exists(path):
+            return path
+        with file_lock(path):
+            if not os.path.exists(path):
+                url = cover_url()
+                if not url:
+                    raise ValueError("Video has no cover image")
+                response = guarded_request('GET', url, is_media_url, headers={'Referer': 'https://www.tiktok.com/'})
+                if response.status_code != 200:
+                    raise ValueError(f"Cover download failed with status: {response.status_code}")
+                if len(response.content) > settings.THUMBNAIL_MAX_SOURCE_BYTES:
+                    raise ValueError("Cover image too large")
+                if not sniff_format(response.content):
+                    raise ValueError("Cover is not an image")
+                self._write(path, response.content)
+        return path
+
+    def _render(self, source, path, width, fmt):
+        with Image.open(source) as image:
+            image.draft('RGB', (width, width * 4))
+            image = image.convert('RGB')
+            if image.width > width:
+                height = round(image.height * width / image.width)
+                image = image.resize((width, height), Image.LANCZOS)
+            out = BytesIO()
+            if fmt == 'webp':
+                image.save(out, 'WEBP', quality=settings.THUMBNAIL_QUALITY, method=4)
+            else:
+                image.save(out, 'JPEG', quality=settings.THUMBNAIL_QUALITY, optimize=True, progressive=True)
+        self._write(path, out.getvalue())
+
+    def _write(self, path, data):
+        # Readers only ever see complete files
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+
+thumbnail_store = ThumbnailStore()
@@ -1,5 +1,6 @@
 from django.urls import path
 from . import views
+from . import async_views
 from django.conf.urls.static import static
 from django.contrib import admin
 from django.conf import settings
@@ -12,5 +13,20 @@ urlpatterns = [
     path('', views.home, name='home'),
     path('api/video-info/', views.get_video_info, name='get_video_info'),
     path('api/process/', views.process_video, name='process_video'),
+    path('api/batch/', views.batch_process, name='batch_process'),
+    path('metrics', views.metrics_view, name='metrics'),
+    path('api/jobs/<str:job_id>/', views.job_status, name='job_status'),
+    path('api/jobs/<str:job_id>/events/', views.job_events, name='job_events'),
+    path('download/stream/', views.stream_video, name='stream_video'),
     path('download/<str:filename>', views.download_file, name='download_file'),
+    path('thumb/<str:video_id>/', views.thumbnail, name='thumbnail'),
+    path('hls/<str:filename>/index.m3u8', views.hls_playlist, name='hls_playlist'),
+    path('hls/<str:filename>/<str:segment>', views.hls_segment, name='hls_segment'),
+
+    # Async (ASGI) variants of the API
+    path('api/async/video-info/', async_views.get_video_info, name='async_get_video_info'),
+    path('api/async/process/', async_views.process_video, name='async_process_video'),
+    path('download/async/stream/', async_views.stream_video, name='async_stream_video'),
+    path('download/async/<str:filename>', async_views.download_file, name='async_download_file'),
+    path('api/async/jobs/<str:job_id>/events/', async_views.job_events, name='async_job_events'),
 ] 
\ No newline at end of file
@@ -1,10 +1,14 @@
-import requests
-import re
 import os
 import json
-import uuid
+import logging
 from django.conf import settings
 import time
+from . import canonical
+from .http_client import get_session, guarded_request
+from .scraper import scrape_video_info
+from .storage import blob_store
+
+logger = logging.getLogger(__name__)
 
 class TikTokDownloader:
     def __init__(self):
@@ -13,8 +17,8 @@ class TikTokDownloader:
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
             'Accept-Language': 'en-US,en;q=0.5',
         }
-        self.session = requests.Session()
-        self.session.headers.update(self.headers)
+        # Shared pooled session; headers go per request so it stays generic
+        self.session = get_session()
     def get_video_info(self, url):
         """Get video information"""
         try:
@@ -36,28 +40,39 @@ class TikTokDownloader:
                 raise ValueError("Could not extract video ID")
 
             api_url = f"https://api16-normal-c-useast1a.tiktokv.com/aweme/v1/feed/?aweme_id={video_id}"
-            response = self.session.get(api_url)
+            response = self.session.get(api_url, headers=self.headers)
             data = response.json()
 
             video_data = data['aweme_list'][0]
+            # The feed endpoint may answer with a different video
+            if str(video_data.get('aweme_id', video_id)) != video_id:
+                raise ValueError("API returned a different video")
+
+            statistics = video_data.get('statistics', {})
             return {
                 'status': 'success',
+                'id': video_id,
                 'title': video_data.get('desc', 'TikTok Video'),
                 'author': f"@{video_data.get('author', {}).get('unique_id', 'user')}",
                 'thumbnail': video_data.get('video', {}).get('cover', {}).get('url_list', [''])[0],
+                'plays': statistics.get('play_count', 0),
+                'likes': statistics.get('digg_count', 0),
+                'shares': statistics.get('share_count', 0),
                 'download_urls': {
                     'hd': video_data.get('video', {}).get('play_addr', {}).get('url_list', [''])[0],
-                    'sd': video_data.get('video', {}).get('play_addr', {}).get('url_list', [''])[0]
+                    'sd': video_data.get('video', {}).get('play_addr', {}).get('url_list', [''])[0],
+                    'audio': video_data.get('music', {}).get('play_url', {}).get('url_list', [''])[0]
                 }
             }
-        except Exception:
+        except Exception as e:
+            logger.warning(f"Info lookup via aweme API failed: {str(e)}")
             raise
 
     def _get_info_method2(self, url):
         """Alternative API method"""
         try:
             api_url = "https://www.tikwm.com/api/"
-            response = self.session.post(api_url, data={'url': url})
+            response = self.session.post(api_url, data={'url': url}, headers=self.headers)
             data = response.json()
 
             if data.get('code') != 0:
@@ -74,69 +89,55 @@ class TikTokDownloader:
                     'sd': video_data.get('play', '')
                 }
             }
-        except Exception:
+        except Exception as e:
+            logger.warning(f"Info lookup via TikWM API failed: {str(e)}")
             raise
 
     def _get_info_method3(self, url):
         """Direct web scraping method"""
         try:
-            response = self.session.get(url)
-            matches = re.findall(r'"downloadAddr":"([^"]+)"', response.text)
-            if not matches:
-                raise ValueError("Could not find video URL")
-
-            video_url = matches[0].encode().decode('unicode-escape')
-            return {
-                'status': 'success',
-                'title': 'TikTok Video',
-                'author': '@user',
-                'thumbnail': '',
-                'download_urls': {
-                    'hd': video_url,
-                    'sd': video_url
-                }
-            }
-        except Exception:
+            return scrape_video_info(self.session, url, self.headers, self._extract_video_id(url))
+        except Exception as e:
+            logger.warning(f"Info lookup via page scrape failed: {str(e)}")
             raise
 
     def download_video(self, url, quality='hd', remove_watermark=True):
         """Download video and return filename"""
         try:
-            # Create downloads directory
-            downloads_dir = os.path.join(settings.MEDIA_ROOT, 'downloads')
-            os.makedirs(downloads_dir, exist_ok=True)
+            video_id = self._extract_video_id(url)
+            if not video_id:
+                raise ValueError("Could not extract video ID")
 
-            # Generate unique filename
-            filename = f"tiktok_{uuid.uuid4().hex[:8]}.mp4"
-            file_path = os.path.join(downloads_dir, filename)
+            # Reuse the stored blob for repeat requests of the same video
+            filename = blob_store.lookup(video_id, quality)
+            if filename:
+                return filename
 
-            # Example implementation - replace with your actual download logic
-            # Download video file and save to file_path
+            info = self._get_info_method2(url)
+            download_url = info['download_urls'].get(quality) or info['download_urls']['sd']
+            response = guarded_request(
+                'GET', download_url, canonical.is_media_url, session=self.session,
+                headers=self.headers, stream=True,
+            )
+            response.raise_for_status()
 
+            filename, _ = blob_store.save(
+                video_id, quality, response.iter_content(chunk_size=64 * 1024)
+            )
             return filename
         except Exception as e:
+            logger.error(f"Error downloading video: {str(e)}")
             raise Exception(f"Failed to download video: {str(e)}")
     
     def _extract_video_id(self, url):
         """Extract video ID from TikTok URL"""
-        patterns = [
-            r'/video/(\d+)',
-            r'/v/(\d+)',
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, url)
-            if match:
-                return match.group(1)
-        return None
+        return canonical.video_id_for(url)
 
     def _clean_url(self, url):
         """Clean and validate TikTok URL"""
         try:
-            # Remove query parameters
-            url = url.split('?')[0]
-            if not any(domain in url.lower() for domain in ['tiktok.com', 'vm.tiktok.com']):
+            if not canonical.is_tiktok_url(url):
                 raise ValueError("Not a valid TikTok URL")
-            return url
+            return canonical.normalize_url(url)
         except Exception:
             raise ValueError("Invalid URL format")
\ No newline at end of file
@@ -1,15 +1,35 @@
 from django.shortcuts import render
-from django.http import JsonResponse, FileResponse
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import ensure_csrf_cookie, csrf_exempt
 from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
 import logging
 import json
-import requests
+import mimetypes
 import os
 import re
 import time
-from bs4 import BeautifulSoup
+from urllib.parse import urlencode
+from . import metrics
+from .accounting import download_stats
+from .admission import Overloaded, admission
+from .audio import extract_adts
+from .batch import batch_processor, expand_sources, iter_ndjson, iter_zip
+from . import canonical
+from .cache import info_cache
+from .hls import hls_store
+from .http_client import get_session, guarded_request
+from .jobs import DONE, FAILED, job_queue
+from .mp4 import MP4Error
+from .progress import progress_hub
+from .ratelimit import client_ip
+from .resolvers import Provider, ResolverEngine, from_downloader
+from .responses import aiterate, file_response
+from .segmented import RangesUnsupported, SegmentedDownloader
+from .storage import blob_store
+from .thumbnails import CONTENT_TYPES, thumbnail_store
+from .utils import TikTokDownloader
 
 FAQ_DATA = [
     {
@@ -40,6 +60,11 @@ FAQ_DATA = [
 
 logger = logging.getLogger(__name__)
 
+FIRST_RANGE = re.compile(r'^bytes=0-')
+
+# Audio is either the original sound (mp3) or demuxed from a video (aac)
+AUDIO_EXTS = ('mp3', 'aac')
+
 @ensure_csrf_cookie
 def home(request):
     return render(request, 'downloader/home.html')
@@ -63,11 +88,12 @@ def get_video_info(request):
         
         return JsonResponse({
             'status': 'success',
-            'data': video_info
+            'data': with_local_thumbnail(video_info)
         })
         
     except Exception as e:
         logger.error(f"Error getting video info: {str(e)}")
+        metrics.request_errors.inc(view='video_info')
         return JsonResponse({
             'status': 'error',
             'message': str(e)
@@ -90,149 +116,698 @@ def process_video(request):
                 'status': 'error',
                 'message': 'URL is required'
             })
+        canonical.require_tiktok_url(url)
 
-        # Get video info
-        video_info = fetch_tiktok_info(url)
-        
-        # Get appropriate download URL based on quality
-        if quality == 'audio':
-            download_url = video_info['download_urls']['audio']
-        else:
-            download_url = video_info['download_urls']['hd'] if quality == 'hd' else video_info['download_urls']['sd']
+        # Already stored videos need no job at all
+        key = info_cache_key(url)
+        if key.startswith('id:'):
+            filename = lookup_stored(key[3:], quality)
+            if filename:
+                record_download(url, key[3:], quality, filename)
+                return JsonResponse({
+                    'status': 'success',
+                    'message': 'Video downloaded successfully!',
+                    'download_url': f'/download/{filename}'
+                })
 
-        if not download_url:
-            raise ValueError("No download URL available")
+        # Stream mode skips the job and pipes the CDN straight to the client
+        if data.get('mode', settings.DOWNLOAD_MODE) == 'stream':
+            return JsonResponse({
+                'status': 'success',
+                'message': 'Video ready to stream',
+                'download_url': stream_url(request, url, quality)
+            })
 
-        # Download the video
-        filename = download_video(download_url, video_info['id'])
-        if not filename:
-            raise ValueError("Failed to download video")
+        # Refuse now rather than queue a job that would only time out
+        client = client_ip(request)
+        admission.check(client)
+        job = job_queue.submit(f'{key}:{quality}', process_download, url, quality, client=client)
 
-        return JsonResponse({
+        payload = {
             'status': 'success',
-            'message': 'Video downloaded successfully!',
-            'download_url': f'/download/{filename}'
-        })
+            'message': 'Download queued',
+            'job': job,
+            'status_url': f"/api/jobs/{job['id']}/"
+        }
+        # Under WSGI an open event stream pins a worker thread for as long as
+        # it is watched, so clients poll status_url there instead
+        if isinstance(request, ASGIRequest):
+            payload['events_url'] = f"/api/async/jobs/{job['id']}/events/"
+        return JsonResponse(payload)
 
+    except Overloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         logger.error(f"Error processing video: {str(e)}")
+        metrics.request_errors.inc(view='process')
         return JsonResponse({
             'status': 'error',
             'message': str(e)
         })
 
-def download_video(url, video_id):
-    """Download video and save to file"""
+def stream_url(request, url, quality):
+    """Proxy URL for stream mode; ASGI deployments get the async proxy"""
+    prefix = '/download/async/stream/' if isinstance(request, ASGIRequest) else '/download/stream/'
+    return f"{prefix}?{urlencode({'url': url, 'quality': quality})}"
+
+def overloaded_response(error):
+    """503 or 429 telling the client when to retry"""
+    response = JsonResponse({
+        'status': 'error',
+        'message': str(error)
+    }, status=error.status)
+    response['Retry-After'] = str(error.retry_after)
+    return response
+
+def select_download_url(video_info, quality):
+    """Pick the CDN URL for the requested quality"""
+    if quality == 'audio':
+        download_url = video_info['download_urls']['audio']
+    else:
+        download_url = video_info['download_urls']['hd'] if quality == 'hd' else video_info['download_urls']['sd']
+
+    if not download_url:
+        raise ValueError("No download URL available")
+    return canonical.require_media_url(download_url)
+
+def lookup_stored(video_id, quality):
+    """Public filename of a stored download in any of its formats"""
+    if quality != 'audio':
+        return blob_store.lookup(video_id, quality)
+    for ext in AUDIO_EXTS:
+        filename = blob_store.lookup(video_id, quality, ext)
+        if filename:
+            return filename
+    return None
+
+def download_for_quality(video_info, url, quality, progress=None, client=None):
+    """Store the requested quality of a resolved video and return its filename"""
+    if quality == 'audio':
+        return download_audio(video_info, url, progress=progress, client=client)
+    video_id = video_info['id'] or require_video_id(url)
+    return download_video(
+        select_download_url(video_info, quality), video_id, quality,
+        page_url=url, progress=progress, client=client,
+    )
+
+def process_download(url, quality='hd', progress=None, client=None):
+    """Resolve a TikTok URL and download it, as run by the job queue"""
+    video_info = fetch_tiktok_info(url)
+    filename = download_for_quality(video_info, url, quality, progress=progress, client=client)
+    if not filename:
+        raise ValueError("Failed to download video")
+
+    return {'download_url': f'/download/{filename}'}
+
+@csrf_exempt
+def batch_process(request):
+    """Resolve many URLs, a user profile or a hashtag in one request.
+
+    Results stream back as NDJSON in completion order, or as a single ZIP
+    of the downloaded videos when ``format`` is ``zip``.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Method not allowed'})
+
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Referer': 'https://tikwm.com/'
-        }
-        
-        response = requests.get(url, headers=headers, stream=True)
-        if response.status_code != 200:
-            raise ValueError(f"Download failed with status: {response.status_code}")
+        data = json.loads(request.body)
+        quality = data.get('quality', 'hd')
+        output = data.get('format', 'ndjson')
+        limit = min(int(data.get('limit') or settings.BATCH_MAX_URLS), settings.BATCH_MAX_URLS)
 
-        # Generate filename
-        filename = f"tiktok_{video_id}_{int(time.time())}.mp4"
-        file_path = os.path.join(settings.MEDIA_ROOT, 'downloads', filename)
-        
-        # Create directory if it doesn't exist
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        urls = expand_sources(data, limit)
+        if not urls:
+            return JsonResponse({'status': 'error', 'message': 'At least one URL is required'})
+
+        if output == 'zip':
+            results = batch_processor.run(urls, quality, download=True)
+            response = StreamingHttpResponse(streaming_body(request, iter_zip(results)), content_type='application/zip')
+            response['Content-Disposition'] = 'attachment; filename="tiktok_batch.zip"'
+            return response
 
-        # Save file in chunks
-        with open(file_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
+        results = batch_processor.run(urls, quality, download=bool(data.get('download')))
+        response = StreamingHttpResponse(
+            streaming_body(request, iter_ndjson(results)), content_type='application/x-ndjson'
+        )
+        # Let proxies pass each line through as soon as it is written
+        response['X-Accel-Buffering'] = 'no'
+        return response
 
-        return filename
+    except Exception as e:
+        logger.error(f"Error processing batch: {str(e)}")
+        metrics.request_errors.inc(view='batch')
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        })
+
+def streaming_body(request, chunks):
+    """Body for a StreamingHttpResponse built from a blocking iterator.
+
+    Django collects a sync body in full before sending it under ASGI, so
+    there the iterator is driven from worker threads instead.
+    """
+    return aiterate(chunks) if isinstance(request, ASGIRequest) else chunks
 
+def with_local_thumbnail(video_info):
+    """Copy of ``video_info`` whose cover is served by ``/thumb/``"""
+    if not video_info.get('id') or not video_info.get('thumbnail'):
+        return video_info
+    return dict(
+        video_info,
+        thumbnail=f"/thumb/{video_info['id']}/?w={settings.THUMBNAIL_DEFAULT_WIDTH}",
+    )
+
+@require_http_methods(["GET", "HEAD"])
+def thumbnail(request, video_id):
+    """Serve a resized cover, fetching and rendering it on first use"""
+    try:
+        width = int(request.GET.get('w') or settings.THUMBNAIL_DEFAULT_WIDTH)
+        fmt = request.GET.get('format')
+        negotiated = fmt is None
+        if negotiated:
+            fmt = 'webp' if 'image/webp' in request.headers.get('Accept', '') else 'jpeg'
+        if fmt not in ('webp', 'jpeg') or width not in settings.THUMBNAIL_WIDTHS:
+            return JsonResponse({'status': 'error', 'message': 'Unsupported thumbnail size or format'}, status=400)
+
+        # The metadata cache normally still holds the cover from the info lookup
+        path, fmt = thumbnail_store.variant(
+            video_id, width, fmt,
+            lambda: fetch_tiktok_info(f'https://www.tiktok.com/@/video/{video_id}').get('thumbnail'),
+        )
+        response = file_response(
+            request, path, f'tiktok_{video_id}_{width}.{fmt}',
+            content_type=CONTENT_TYPES[fmt], disposition='inline',
+        )
+        response['Cache-Control'] = f'public, max-age={settings.THUMBNAIL_CACHE_SECONDS}, immutable'
+        if negotiated:
+            response['Vary'] = 'Accept'
+        return response
+    except Exception as e:
+        logger.error(f"Error serving thumbnail: {str(e)}")
+        metrics.request_errors.inc(view='thumbnail')
+        return JsonResponse({'status': 'error', 'message': 'Thumbnail not available'}, status=404)
+
+@require_http_methods(["GET", "HEAD"])
+def hls_playlist(request, filename):
+    """Serve the HLS playlist of a stored MP4"""
+    return _hls_response(request, filename, 'index.m3u8', 'application/vnd.apple.mpegurl', hls_store.playlist)
+
+@require_http_methods(["GET", "HEAD"])
+def hls_segment(request, filename, segment):
+    """Serve the init segment or one fMP4 media segment of a stored MP4"""
+    if segment == 'init.mp4':
+        return _hls_response(request, filename, segment, 'video/mp4', hls_store.init_segment)
+    match = re.match(r'^(\d+)\.m4s$', segment)
+    if not match:
+        return JsonResponse({'status': 'error', 'message': 'Segment not found'}, status=404)
+    number = int(match.group(1))
+    return _hls_response(
+        request, filename, segment, 'video/iso.segment',
+        lambda name: hls_store.segment(name, number),
+    )
+
+def _hls_response(request, filename, name, content_type, build):
+    if not settings.HLS_ENABLE or not filename.endswith('.mp4') or not blob_store.parse_filename(filename):
+        return JsonResponse({'status': 'error', 'message': 'File not found'}, status=404)
+    try:
+        path = build(filename)
+        response = file_response(request, path, name, content_type=content_type, disposition='inline')
+        response['Cache-Control'] = f'public, max-age={settings.HLS_CACHE_SECONDS}'
+        return response
+    except FileNotFoundError:
+        return JsonResponse({'status': 'error', 'message': 'File not found'}, status=404)
+    except MP4Error as e:
+        logger.error(f"Error building HLS output: {str(e)}")
+        metrics.request_errors.inc(view='hls')
+        return JsonResponse({'status': 'error', 'message': 'Segment not available'}, status=404)
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Segment not found'}, status=404)
+
+@require_http_methods(["GET"])
+def metrics_view(request):
+    """Prometheus metrics for this worker process"""
+    if settings.METRICS_ALLOWED_IPS and client_ip(request) not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@require_http_methods(["GET"])
+def job_status(request, job_id):
+    job = job_queue.get(job_id)
+    if not job:
+        return JsonResponse({
+            'status': 'error',
+            'message': 'Job not found'
+        })
+    return JsonResponse({
+        'status': 'success',
+        'job': job
+    })
+
+@require_http_methods(["GET"])
+def job_events(request, job_id):
+    """Stream a job's progress as Server-Sent Events until it finishes"""
+    job = job_queue.get(job_id)
+    if not job:
+        return JsonResponse({
+            'status': 'error',
+            'message': 'Job not found'
+        }, status=404)
+    if isinstance(request, ASGIRequest):
+        # Django buffers sync iterators in full under ASGI, which would hold
+        # every event back until the job ends
+        from .async_views import _ajob_events
+        return event_stream_response(_ajob_events(job_id, job))
+    return event_stream_response(_job_events(job_id, job))
+
+def event_stream_response(events):
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Proxies must pass each event through as soon as it is written
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def sse_event(job):
+    return f"event: progress\ndata: {json.dumps(job)}\n\n".encode()
+
+def _job_events(job_id, job):
+    # Jobs running in this process push through the hub; jobs owned by
+    # another worker are followed through the shared cache instead
+    version, local = progress_hub.latest(job_id)
+    job = local or job
+    yield b'retry: 2000\n\n' + sse_event(job)
+
+    deadline = time.monotonic() + settings.PROGRESS_STREAM_SECONDS
+    idle = 0
+    while job['status'] not in (DONE, FAILED) and time.monotonic() < deadline:
+        timeout = settings.PROGRESS_HEARTBEAT_SECONDS if local else settings.PROGRESS_POLL_SECONDS
+        version, event = progress_hub.wait(job_id, version, timeout)
+        if event is not None:
+            local = event
+        elif not local:
+            event = job_queue.get(job_id)
+            if event is None:
+                return
+            if event == job:
+                event = None
+        if event is None:
+            idle += timeout
+            if idle >= settings.PROGRESS_HEARTBEAT_SECONDS:
+                idle = 0
+                yield b': keepalive\n\n'
+            continue
+        idle = 0
+        job = event
+        yield sse_event(job)
+
+def download_video(url, video_id, quality='hd', page_url=None, progress=None, ext='mp4', client=None):
+    """Download video into the blob store and return its filename"""
+    try:
+        # Repeat requests for the same video reuse the stored blob
+        filename = blob_store.lookup(video_id, quality, ext)
+        if filename:
+            record_download(page_url or url, video_id, quality, filename)
+            return filename
+
+        canonical.require_media_url(url)
+        # Waits in the bounded queue, or raises Overloaded when saturated
+        with admission.acquire(url, client):
+            return _transfer(url, video_id, quality, page_url, progress, ext)
+
+    except Overloaded:
+        raise
     except Exception as e:
         logger.error(f"Error downloading video: {str(e)}")
+        metrics.request_errors.inc(view='download')
+        return None
+
+def _transfer(url, video_id, quality, page_url, progress, ext):
+    """Fetch one CDN file into the blob store while holding a download slot"""
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+        'Referer': 'https://tikwm.com/'
+    }
+    
+    # Large files go over parallel Range requests when the CDN allows it
+    downloader = SegmentedDownloader.for_quality(quality)
+    if downloader.segments > 1:
+        try:
+            start = time.perf_counter()
+            part_path = blob_store.partial_path(video_id, quality, ext)
+            os.makedirs(os.path.dirname(part_path), exist_ok=True)
+            downloader.download(url, part_path, headers=headers, progress=progress)
+            metrics.download_bytes.inc(os.path.getsize(part_path), mode='segmented')
+            filename, digest = blob_store.ingest(video_id, quality, part_path, ext)
+            metrics.download_seconds.observe(time.perf_counter() - start, mode='segmented')
+            record_download(page_url or url, video_id, quality, filename, digest)
+            return filename
+        except RangesUnsupported as e:
+            logger.info(f"Falling back to a single stream: {str(e)}")
+
+    start = time.perf_counter()
+    response = guarded_request('GET', url, canonical.is_media_url, headers=headers, stream=True)
+    if response.status_code != 200:
+        raise ValueError(f"Download failed with status: {response.status_code}")
+
+    chunks = response.iter_content(chunk_size=64 * 1024)
+    if progress:
+        total = int(response.headers.get('Content-Length') or 0) or None
+        chunks = _report_progress(chunks, progress, total)
+
+    # Hash while streaming so identical payloads share one blob
+    filename, digest = blob_store.save(video_id, quality, chunks, ext)
+    metrics.download_seconds.observe(time.perf_counter() - start, mode='single')
+    metrics.download_bytes.inc(os.path.getsize(blob_store.path(filename)), mode='single')
+    record_download(page_url or url, video_id, quality, filename, digest)
+    return filename
+
+def download_audio(video_info, page_url, progress=None, client=None):
+    """Store the audio of a video and return its filename.
+
+    A video already in the store has its AAC track demuxed locally, which
+    costs no upstream request and no re-encoding. Otherwise the original
+    sound is fetched, and videos without one are downloaded in SD and
+    demuxed.
+    """
+    video_id = video_info['id'] or require_video_id(page_url)
+    filename = lookup_stored(video_id, 'audio')
+    if filename:
+        record_download(page_url, video_id, 'audio', filename)
+        return filename
+
+    source = stored_video(video_id)
+    if source:
+        filename = extract_audio(video_id, source, page_url)
+        if filename:
+            return filename
+
+    music_url = video_info['download_urls'].get('audio')
+    if music_url:
+        return download_video(
+            music_url, video_id, 'audio', page_url=page_url, progress=progress, ext='mp3', client=client
+        )
+
+    sd_url = video_info['download_urls'].get('sd') or video_info['download_urls'].get('hd')
+    if not sd_url:
         return None
+    source = download_video(sd_url, video_id, 'sd', page_url=page_url, progress=progress, client=client)
+    return extract_audio(video_id, source, page_url) if source else None
+
+def stored_video(video_id):
+    """Filename of any stored video rendition, smallest first"""
+    for quality in ('sd', 'hd'):
+        filename = blob_store.lookup(video_id, quality)
+        if filename:
+            return filename
+    return None
+
+def extract_audio(video_id, source, page_url):
+    """Demux the AAC track of a stored video into the store"""
+    try:
+        filename, digest = blob_store.save(
+            video_id, 'audio', extract_adts(blob_store.local_path(source)), 'aac'
+        )
+        record_download(page_url, video_id, 'audio', filename, digest)
+        return filename
+    except (MP4Error, OSError) as e:
+        logger.error(f"Error extracting audio: {str(e)}")
+        return None
+
+def _report_progress(chunks, progress, total):
+    done = 0
+    for chunk in chunks:
+        done += len(chunk)
+        progress(done, total)
+        yield chunk
+
+def record_download(url, video_id, quality, filename, digest=None):
+    """Note the VideoDownload row tracking a stored blob, flushed in batches"""
+    file_path = blob_store.blob_path(digest) if digest else blob_store.path(filename)
+    download_stats.record(url, video_id, quality, file_path, digest)
+
+def record_served(request, response, filename):
+    """Count a delivery to a client, ignoring revalidations and resumed ranges"""
+    if request.method != 'GET' or response.status_code not in (200, 206, 302):
+        return
+    # Players following a storage redirect come back once per range
+    if response.status_code != 200 and not FIRST_RANGE.match(request.headers.get('Range') or 'bytes=0-'):
+        return
+    key = blob_store.parse_filename(filename)
+    if key:
+        download_stats.record('', key[0], key[1], served=1)
+
+def info_cache_key(url):
+    """Cache key for a TikTok URL, preferring the numeric video id"""
+    return canonical.cache_key(url)
+
+def info_cache_aliases(info):
+    """Extra cache keys for a fetched info dict"""
+    return [f"id:{info['id']}"] if info.get('id') else []
 
 def fetch_tiktok_info(url):
+    """Fetch video information, served from the metadata cache when possible"""
+    # Providers fetch what they are given, so only TikTok links get that far
+    canonical.require_tiktok_url(url)
+    info = info_cache.get_or_fetch(
+        info_cache_key(url),
+        lambda: get_resolver().resolve(url),
+        aliases=info_cache_aliases,
+    )
+    # A resolved short link never needs its redirect followed again
+    canonical.remember(url, info.get('id'))
+    return info
+
+_resolver = None
+
+def get_resolver():
+    """The process-wide resolver engine over the configured providers"""
+    global _resolver
+    if _resolver is None:
+        downloader = TikTokDownloader()
+        available = {
+            'tikwm': lambda: Provider('tikwm', _fetch_tiktok_info, afetch=_afetch_tikwm),
+            'aweme': lambda: Provider(
+                'aweme', lambda url: from_downloader(downloader._get_info_method1(url), url)
+            ),
+            'scrape': lambda: Provider(
+                'scrape', lambda url: from_downloader(downloader._get_info_method3(url), url)
+            ),
+        }
+        _resolver = ResolverEngine([available[name]() for name in settings.TIKTOK_RESOLVERS])
+    return _resolver
+
+@metrics.registry.collector
+def _resolver_metrics():
+    if _resolver is None:
+        return
+    stats = _resolver.stats()
+    yield ('tiktok_resolver_circuit_open', 'gauge', 'Whether a provider is being skipped',
+           [({'provider': name}, int(s['state'] != 'closed')) for name, s in stats.items()])
+    yield ('tiktok_resolver_p95_seconds', 'gauge', 'Recent p95 latency used for hedging',
+           [({'provider': name}, s['p95_ms'] / 1000) for name, s in stats.items() if s['p95_ms'] is not None])
+
+async def _afetch_tikwm(url):
+    from .async_views import _afetch_tiktok_info
+    return await _afetch_tiktok_info(url)
+
+TIKWM_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'application/json',
+    'Content-Type': 'application/x-www-form-urlencoded'
+}
+
+def _fetch_tiktok_info(url):
     """Fetch video information using TikWM API"""
     try:
-        api_url = "https://tikwm.com/api/"
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Accept': 'application/json',
-            'Content-Type': 'application/x-www-form-urlencoded'
-        }
-        
         params = {
             'url': url,
             'hd': 1
         }
         
-        response = requests.post(api_url, data=params, headers=headers)
+        response = get_session().post(settings.TIKWM_API_URL, data=params, headers=TIKWM_HEADERS)
         if response.status_code != 200:
             raise ValueError(f"API request failed with status: {response.status_code}")
 
-        data = response.json()
-        if data.get('code') != 0:
-            raise ValueError(data.get('msg', 'Failed to fetch video information'))
-
-        video_data = data.get('data', {})
-        
-        # Extract information
-        return {
-            'id': video_data.get('id', ''),
-            'title': video_data.get('title', 'TikTok Video'),
-            'author': video_data.get('author', {}).get('unique_id', 'user'),
-            'thumbnail': video_data.get('cover', video_data.get('origin_cover', '')),
-            'plays': video_data.get('play_count', 0),
-            'likes': video_data.get('digg_count', 0),
-            'shares': video_data.get('share_count', 0),
-            'url': url,
-            'download_urls': {
-                'hd': video_data.get('hdplay', video_data.get('play', '')),
-                'sd': video_data.get('play', ''),
-                'audio': video_data.get('music', video_data.get('music_info', {}).get('play', ''))
-            }
-        }
+        return parse_tikwm_response(response.json(), url)
 
     except Exception as e:
         logger.error(f"Error fetching TikTok info: {str(e)}")
         raise ValueError(f"Failed to fetch video information: {str(e)}")
 
+def parse_tikwm_response(data, url):
+    """Turn a TikWM API payload into our video info dict"""
+    if data.get('code') != 0:
+        raise ValueError(data.get('msg', 'Failed to fetch video information'))
+
+    video_data = data.get('data', {})
+    
+    # Extract information
+    return {
+        'id': video_data.get('id', ''),
+        'title': video_data.get('title', 'TikTok Video'),
+        'author': video_data.get('author', {}).get('unique_id', 'user'),
+        'thumbnail': video_data.get('cover', video_data.get('origin_cover', '')),
+        'plays': video_data.get('play_count', 0),
+        'likes': video_data.get('digg_count', 0),
+        'shares': video_data.get('share_count', 0),
+        'url': url,
+        'download_urls': {
+            'hd': video_data.get('hdplay', video_data.get('play', '')),
+            'sd': video_data.get('play', ''),
+            'audio': video_data.get('music', video_data.get('music_info', {}).get('play', ''))
+        }
+    }
+
 def extract_video_id(url):
     """Extract video ID from TikTok URL"""
     try:
-        # Handle different URL formats
-        patterns = [
-            r'/video/(\d+)',
-            r'/v/(\d+)',
-            r'@[\w.-]+/video/(\d+)'
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, url)
-            if match:
-                return match.group(1)
-                
-        # Handle shortened URLs
-        if 'vm.tiktok.com' in url or 'vt.tiktok.com' in url:
-            response = requests.head(url, allow_redirects=True)
-            return extract_video_id(response.url)
-            
-        return None
+        # Short links are resolved once, then served from the index
+        return canonical.video_id_for(url)
     except Exception as e:
         logger.error(f"Error extracting video ID: {str(e)}")
         return None
 
-@require_http_methods(["GET"])
+def require_video_id(url):
+    """Video ID from the URL; ValueError when it has none, as filenames need one"""
+    video_id = extract_video_id(url)
+    if not video_id:
+        raise ValueError("Could not extract video ID")
+    return video_id
 
 @require_http_methods(["GET"])
+def stream_video(request):
+    """Proxy the CDN response straight to the client without touching disk.
+
+    Under ASGI Django collects sync bodies in full before sending them, so
+    ASGI deployments use ``async_views.stream_video`` instead.
+    """
+    try:
+        url = request.GET.get('url')
+        quality = request.GET.get('quality', 'hd')
+        if not url:
+            return JsonResponse({'status': 'error', 'message': 'URL is required'})
+
+        video_info = fetch_tiktok_info(url)
+        video_id = video_info['id'] or require_video_id(url)
+
+        # A stored copy is cheaper than another trip to the CDN
+        filename = lookup_stored(video_id, quality)
+        if filename:
+            return download_file(request, filename)
+
+        if quality == 'audio':
+            source = stored_video(video_id)
+            if source is None and not video_info['download_urls'].get('audio'):
+                source = download_video(
+                    video_info['download_urls'].get('sd') or video_info['download_urls'].get('hd'),
+                    video_id, 'sd', page_url=url, client=client_ip(request),
+                )
+            if source:
+                try:
+                    return _stream_extracted_audio(request, url, video_id, source)
+                except MP4Error as e:
+                    # Nothing has been sent yet; proxy the music track instead
+                    logger.warning(f"Error extracting audio: {str(e)}")
+                    if not video_info['download_urls'].get('audio'):
+                        raise
+
+        headers = {'Referer': 'https://tikwm.com/'}
+        for header in ('Range', 'If-Range'):
+            value = request.headers.get(header)
+            if value:
+                headers[header] = value
+
+        download_url = select_download_url(video_info, quality)
+        # The slot is held until the proxied body has been sent
+        ticket = admission.acquire(download_url, client_ip(request))
+        try:
+            upstream = guarded_request('GET', download_url, canonical.is_media_url, headers=headers, stream=True)
+        except Exception:
+            ticket.release()
+            raise
+        if upstream.status_code not in (200, 206):
+            upstream.close()
+            ticket.release()
+            raise ValueError(f"Download failed with status: {upstream.status_code}")
+
+        ext = 'mp3' if quality == 'audio' else 'mp4'
+        chunks = metrics.timed_stream(upstream.iter_content(chunk_size=settings.STREAM_CHUNK_SIZE), 'proxy')
+        # Only a complete body can become a blob
+        if upstream.status_code == 200 and settings.STREAM_TEE_TO_STORE:
+            chunks = _tee_to_store(chunks, url, video_id, quality, ext)
+
+        response = StreamingHttpResponse(
+            chunks,
+            status=upstream.status_code,
+            content_type=upstream.headers.get('Content-Type', 'video/mp4'),
+        )
+        for header in ('Content-Length', 'Content-Range', 'Accept-Ranges', 'Last-Modified', 'ETag'):
+            if header in upstream.headers:
+                response[header] = upstream.headers[header]
+        filename = blob_store.filename_for(video_id, quality, ext)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response._resource_closers.append(upstream.close)
+        response._resource_closers.append(ticket.release)
+        record_served(request, response, filename)
+        return response
+
+    except Overloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        logger.error(f"Error streaming video: {str(e)}")
+        metrics.request_errors.inc(view='stream')
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        })
+
+def _stream_extracted_audio(request, url, video_id, source):
+    """Stream the AAC track of a stored video while storing the result"""
+    return extracted_audio_response(request, extracted_audio_chunks(url, video_id, source), video_id)
+
+def extracted_audio_chunks(url, video_id, source):
+    """ADTS chunks of a stored video; raises MP4Error up front if it has no usable AAC track"""
+    chunks = metrics.timed_stream(extract_adts(blob_store.local_path(source)), 'audio')
+    if settings.STREAM_TEE_TO_STORE:
+        chunks = _tee_to_store(chunks, url, video_id, 'audio', 'aac')
+    return chunks
+
+def extracted_audio_response(request, chunks, video_id):
+    filename = blob_store.filename_for(video_id, 'audio', 'aac')
+    response = StreamingHttpResponse(chunks, content_type='audio/aac')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    record_served(request, response, filename)
+    return response
+
+def _tee_to_store(chunks, url, video_id, quality, ext='mp4'):
+    """Yield chunks to the client while spooling them into the blob store"""
+    with blob_store.writer(video_id, quality, ext) as writer:
+        for chunk in chunks:
+            writer.write(chunk)
+            yield chunk
+        filename, digest = writer.commit()
+    record_download(url, video_id, quality, filename, digest)
+
+@require_http_methods(["GET", "HEAD"])
 def download_file(request, filename):
     try:
-        file_path = os.path.join(settings.MEDIA_ROOT, 'downloads', filename)
-        if os.path.exists(file_path):
-            response = FileResponse(open(file_path, 'rb'))
-            response['Content-Disposition'] = f'attachment; filename="{filename}"'
-            response['Content-Type'] = 'video/mp4'
+        # With shared storage the bytes come straight from the bucket
+        redirect_url = blob_store.redirect_url(filename, content_type_for(filename))
+        if redirect_url:
+            response = storage_redirect(redirect_url)
+            record_served(request, response, filename)
+            return response
+
+        try:
+            file_path = blob_store.local_path(filename)
+        except FileNotFoundError:
+            file_path = None
+        if file_path and os.path.exists(file_path):
+            response = file_response(
+                request, file_path, filename,
+                content_type=content_type_for(filename), digest=blob_store.digest(filename),
+            )
+            record_served(request, response, filename)
             return response
         else:
             return JsonResponse({
@@ -240,7 +815,19 @@ def download_file(request, filename):
                 'message': 'File not found'
             })
     except Exception as e:
+        logger.error(f"Error serving file: {str(e)}")
+        metrics.request_errors.inc(view='file')
         return JsonResponse({
             'status': 'error',
             'message': 'Error downloading file'
-        })
\ No newline at end of file
+        })
+
+def storage_redirect(url):
+    response = HttpResponseRedirect(url)
+    # Presigned URLs expire, so the redirect itself must not be cached
+    response['Cache-Control'] = 'no-store'
+    return response
+
+def content_type_for(filename):
+    """MIME type of a stored file from its extension"""
+    return mimetypes.guess_type(filename)[0] or 'video/mp4'
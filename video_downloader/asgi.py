@@ -9,8 +9,14 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'video_downloader.settings')
 
 application = get_asgi_application()
+
+if settings.STARTUP_PRELOAD:
+    from downloader.startup import preload
+
+    preload()
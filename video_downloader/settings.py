@@ -19,19 +19,16 @@ load_dotenv()
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
-SECRET_KEY = os.getenv('SECRET_KEY')
-DEBUG = os.getenv('DEBUG', 'True').lower() == 'true'
-ALLOWED_HOSTS = os.getenv('ALLOWED_HOSTS', '').split(',')
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
 
 # SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = 'django-insecure-reav7f)kd@xpthtf=2_*h&t4f$^95@z4ybrh+r32n)%*fh$p!5'
+SECRET_KEY = os.getenv('SECRET_KEY', 'django-insecure-reav7f)kd@xpthtf=2_*h&t4f$^95@z4ybrh+r32n)%*fh$p!5')
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = os.getenv('DEBUG', 'True').lower() == 'true'
 
-ALLOWED_HOSTS = []
+ALLOWED_HOSTS = [host for host in os.getenv('ALLOWED_HOSTS', '').split(',') if host]
 
 
 # Application definition
@@ -55,6 +52,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'downloader.middleware.RateLimitMiddleware',
 ]
 
 ROOT_URLCONF = 'video_downloader.urls'
@@ -85,6 +83,18 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Per-connection tuning only; WAL mode is persistent and is
+            # switched on once by migration downloader 0005
+            'init_command': (
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA temp_store=MEMORY;'
+                'PRAGMA cache_size=-16000;'
+                'PRAGMA mmap_size=134217728;'
+            ),
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
     }
 }
 
@@ -133,12 +143,29 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 # Cache settings
+# Per-process LRU in front of a cache shared by all workers: Redis when
+# CACHE_REDIS_URL is set, otherwise a SQLite file in WAL mode
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
-        'LOCATION': '/var/tmp/django_cache',
-    }
+        'BACKEND': 'downloader.cache_backends.TieredCache',
+        'OPTIONS': {
+            'SHARED': 'shared',
+            'MAX_ENTRIES': 10000,
+            'LOCAL_TIMEOUT': 2,
+        },
+    },
 }
+if os.getenv('CACHE_REDIS_URL'):
+    CACHES['shared'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('CACHE_REDIS_URL'),
+    }
+else:
+    CACHES['shared'] = {
+        'BACKEND': 'downloader.cache_backends.SQLiteCache',
+        'LOCATION': os.getenv('CACHE_SQLITE_PATH', '/var/tmp/django_cache.sqlite3'),
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    }
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
@@ -150,4 +177,171 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Rate limiting settings
 RATELIMIT_ENABLE = True
 RATELIMIT_USE_CACHE = 'default'
-RATELIMIT_FAIL_OPEN = False
\ No newline at end of file
+RATELIMIT_FAIL_OPEN = False
+# Header carrying the client IP behind a proxy, e.g. 'X-Forwarded-For'; only
+# read on requests from RATELIMIT_TRUSTED_PROXIES
+RATELIMIT_IP_HEADER = os.getenv('RATELIMIT_IP_HEADER', '')
+# Addresses or networks of the proxies allowed to supply the IP header or a
+# 'header:<Name>' policy key; requests from anywhere else are keyed by peer IP
+RATELIMIT_TRUSTED_PROXIES = [proxy for proxy in os.getenv('RATELIMIT_TRUSTED_PROXIES', '').split(',') if proxy]
+# First matching path prefix wins; 'key' is 'ip' or 'header:<Name>' and
+# 'overrides' gives specific keys their own limit
+RATELIMIT_POLICIES = [
+    {'name': 'process', 'path': '/api/process/', 'limit': 10, 'window': 3600},
+    {'name': 'process', 'path': '/api/async/process/', 'limit': 10, 'window': 3600},
+    {'name': 'batch', 'path': '/api/batch/', 'limit': 5, 'window': 3600},
+    {'name': 'info', 'path': '/api/', 'limit': 120, 'window': 60, 'methods': ['POST']},
+]
+
+# TikTok metadata cache (in-process LRU in front of the shared cache)
+TIKTOK_INFO_CACHE_ALIAS = 'default'
+TIKTOK_INFO_CACHE_SIZE = int(os.getenv('TIKTOK_INFO_CACHE_SIZE', 1024))
+TIKTOK_INFO_CACHE_TTL = int(os.getenv('TIKTOK_INFO_CACHE_TTL', 300))
+TIKTOK_INFO_NEGATIVE_TTL = int(os.getenv('TIKTOK_INFO_NEGATIVE_TTL', 30))
+
+# Upstream endpoints
+TIKWM_API_URL = os.getenv('TIKWM_API_URL', 'https://tikwm.com/api/')
+# Hosts (with their subdomains) that video, audio and cover URLs taken from
+# metadata may point at, redirects included
+MEDIA_ALLOWED_HOSTS = [host for host in os.getenv(
+    'MEDIA_ALLOWED_HOSTS',
+    'tiktok.com,tiktokv.com,tiktokcdn.com,tiktokcdn-us.com,tiktokcdn-eu.com,'
+    'byteoversea.com,ibytedtos.com,ibyteimg.com,muscdn.com,tikwm.com',
+).split(',') if host]
+
+# Upstream HTTP client pooling
+UPSTREAM_POOLS = {
+    # URL prefix: keep-alive connections per host
+    'https://tikwm.com/': 32,
+    'https://www.tikwm.com/': 32,
+}
+UPSTREAM_DEFAULT_POOL_SIZE = int(os.getenv('UPSTREAM_DEFAULT_POOL_SIZE', 16))
+UPSTREAM_POOL_HOSTS = 32
+UPSTREAM_RETRIES = int(os.getenv('UPSTREAM_RETRIES', 3))
+UPSTREAM_BACKOFF = 0.3
+# Longest Retry-After wait honoured before a retry
+UPSTREAM_MAX_RETRY_AFTER = float(os.getenv('UPSTREAM_MAX_RETRY_AFTER', 5))
+UPSTREAM_TIMEOUT = float(os.getenv('UPSTREAM_TIMEOUT', 30))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', 5))
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv('UPSTREAM_MAX_CONNECTIONS', 200))
+UPSTREAM_MAX_CONNECTIONS_PER_HOST = int(os.getenv('UPSTREAM_MAX_CONNECTIONS_PER_HOST', 100))
+
+# Background download jobs
+DOWNLOAD_JOB_WORKERS = int(os.getenv('DOWNLOAD_JOB_WORKERS', 4))
+DOWNLOAD_JOB_TTL = 3600
+DOWNLOAD_JOB_CACHE_ALIAS = 'default'
+
+# Download delivery: 'job' stores the file first, 'stream' proxies the CDN
+DOWNLOAD_MODE = os.getenv('DOWNLOAD_MODE', 'job')
+STREAM_CHUNK_SIZE = 256 * 1024
+STREAM_TEE_TO_STORE = True
+# Threads driving blocking body iterators under ASGI, kept apart from the
+# default executor that sync_to_async work runs on
+STREAM_ITERATOR_THREADS = int(os.getenv('STREAM_ITERATOR_THREADS', 32))
+
+# Let the front-end server send file bodies: '' (Django), 'nginx' or 'apache'
+SENDFILE_BACKEND = os.getenv('SENDFILE_BACKEND', '')
+SENDFILE_URL = '/protected/'
+
+# Parallel Range downloads per quality; files under min_size use one stream
+SEGMENTED_DOWNLOADS = {
+    'hd': {'segments': 4, 'min_size': 4 * 1024 * 1024},
+    'sd': {'segments': 2, 'min_size': 4 * 1024 * 1024},
+    'audio': {'segments': 1},
+}
+
+# Metadata providers, in order of preference, with hedging and breakers
+TIKTOK_RESOLVERS = ['tikwm', 'aweme', 'scrape']
+RESOLVER_WORKERS = 16
+RESOLVER_HEDGE_DEFAULT = 1.5
+RESOLVER_HEDGE_MIN = 0.2
+RESOLVER_FAILURE_THRESHOLD = 5
+RESOLVER_COOLDOWN = 30
+
+# Batch endpoint: shared pool, per-request concurrency and size cap
+BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', 8))
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', 4))
+BATCH_MAX_URLS = int(os.getenv('BATCH_MAX_URLS', 100))
+
+# Storage reaper (manage.py reap_downloads); quota 0 means no size limit
+REAPER_MAX_AGE = int(os.getenv('REAPER_MAX_AGE', 24 * 3600))
+REAPER_QUOTA_BYTES = int(os.getenv('REAPER_QUOTA_BYTES', 0))
+REAPER_BATCH_SIZE = 200
+REAPER_BATCH_PAUSE = 0.05
+REAPER_GRACE = 600
+REAPER_TMP_MAX_AGE = 6 * 3600
+# Extra seconds of life per doubling of a file's download count
+REAPER_POPULARITY_WEIGHT = 3600
+# HLS renditions are recut on demand, so they get their own age and quota
+REAPER_HLS_MAX_AGE = int(os.getenv('REAPER_HLS_MAX_AGE', 24 * 3600))
+REAPER_HLS_QUOTA_BYTES = int(os.getenv('REAPER_HLS_QUOTA_BYTES', 0))
+# Thumbnails likewise; a cover is fetched again on its next request
+REAPER_THUMBNAIL_MAX_AGE = int(os.getenv('REAPER_THUMBNAIL_MAX_AGE', 7 * 24 * 3600))
+REAPER_THUMBNAIL_QUOTA_BYTES = int(os.getenv('REAPER_THUMBNAIL_QUOTA_BYTES', 0))
+
+# Download accounting is buffered per process and flushed in batches
+DOWNLOAD_STATS_FLUSH_INTERVAL = float(os.getenv('DOWNLOAD_STATS_FLUSH_INTERVAL', 5))
+DOWNLOAD_STATS_MAX_PENDING = 500
+
+# /metrics is open to everyone unless this lists the allowed client IPs
+METRICS_ALLOWED_IPS = [ip for ip in os.getenv('METRICS_ALLOWED_IPS', '').split(',') if ip]
+
+# Short links (vm.tiktok.com/...) remembered in memory in front of the ShortLink table
+SHORTLINK_CACHE_SIZE = int(os.getenv('SHORTLINK_CACHE_SIZE', 10000))
+
+# Cover thumbnails, resized with Pillow when it is installed
+THUMBNAIL_WIDTHS = [160, 320, 640]
+THUMBNAIL_DEFAULT_WIDTH = 320
+THUMBNAIL_QUALITY = 80
+THUMBNAIL_MAX_SOURCE_BYTES = 5 * 1024 * 1024
+THUMBNAIL_CACHE_SECONDS = 30 * 24 * 3600
+
+# Admission control for upstream transfers, per process: beyond the slots a
+# bounded queue waits up to the timeout, then requests get 503/429 fast
+ADMISSION_MAX_ACTIVE = int(os.getenv('ADMISSION_MAX_ACTIVE', 32))
+ADMISSION_MAX_PER_HOST = int(os.getenv('ADMISSION_MAX_PER_HOST', 16))
+ADMISSION_MAX_PER_CLIENT = int(os.getenv('ADMISSION_MAX_PER_CLIENT', 4))
+ADMISSION_MAX_QUEUE = int(os.getenv('ADMISSION_MAX_QUEUE', 64))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', 10))
+
+# Rewrite stored MP4s moov-first; HLS serves lazily cut fMP4 segments
+FASTSTART_ON_STORE = True
+HLS_ENABLE = os.getenv('HLS_ENABLE', 'False').lower() == 'true'
+HLS_SEGMENT_SECONDS = 4
+HLS_CACHE_SECONDS = 7 * 24 * 3600
+
+# Download progress event streams (/api/jobs/<id>/events)
+PROGRESS_PUBLISH_INTERVAL = float(os.getenv('PROGRESS_PUBLISH_INTERVAL', 0.25))
+PROGRESS_RETAIN_SECONDS = 60
+PROGRESS_HEARTBEAT_SECONDS = 15
+PROGRESS_POLL_SECONDS = 1
+PROGRESS_STREAM_SECONDS = int(os.getenv('PROGRESS_STREAM_SECONDS', 300))
+
+# HTML fallback resolver: pages are read in chunks only up to the state blob
+SCRAPER_CHUNK_SIZE = 16 * 1024
+SCRAPER_MAX_BYTES = int(os.getenv('SCRAPER_MAX_BYTES', 4 * 1024 * 1024))
+
+# Worker start-up: preload before forking (gunicorn --preload) and the
+# cold start budget enforced by bench_startup
+STARTUP_PRELOAD = os.getenv('STARTUP_PRELOAD', 'False').lower() == 'true'
+STARTUP_BUDGET_MS = int(os.getenv('STARTUP_BUDGET_MS', 1500))
+
+# Shared blob storage for multi-node deployments. 'local' keeps downloads on
+# this node only; 's3' publishes them to an S3-compatible bucket and the
+# local store becomes a read-through cache in front of it
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'local')
+STORAGE_S3_ENDPOINT_URL = os.getenv('STORAGE_S3_ENDPOINT_URL', 'https://s3.amazonaws.com')
+STORAGE_S3_PUBLIC_URL = os.getenv('STORAGE_S3_PUBLIC_URL')
+STORAGE_S3_BUCKET = os.getenv('STORAGE_S3_BUCKET', '')
+STORAGE_S3_ACCESS_KEY = os.getenv('STORAGE_S3_ACCESS_KEY', '')
+STORAGE_S3_SECRET_KEY = os.getenv('STORAGE_S3_SECRET_KEY', '')
+STORAGE_S3_REGION = os.getenv('STORAGE_S3_REGION', 'us-east-1')
+STORAGE_S3_PREFIX = os.getenv('STORAGE_S3_PREFIX', '')
+# 'path' for MinIO and most self-hosted stores, 'virtual' for AWS
+STORAGE_S3_ADDRESSING = os.getenv('STORAGE_S3_ADDRESSING', 'path')
+STORAGE_S3_PART_SIZE = 8 * 1024 * 1024
+STORAGE_S3_UPLOAD_CONCURRENCY = 4
+# Send clients straight to the bucket with presigned URLs instead of
+# proxying the bytes through Django
+STORAGE_REDIRECT = os.getenv('STORAGE_REDIRECT', 'True').lower() == 'true'
+STORAGE_URL_EXPIRY = 3600